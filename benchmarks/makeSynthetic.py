@@ -0,0 +1,146 @@
+import os
+import csv
+import random
+import argparse
+
+
+'''
+Parse arguments.
+'''
+def parseArgs():
+    parser = argparse.ArgumentParser(description='Write a synthetic MeSH file (ASCII format) and a ChEMBL-like indications table, to benchmark the pipeline without the real releases.')
+    parser.add_argument('-o', '--output', help='Output directory. mesh.bin and indications.tsv are written to it.', default='.', type=str, required=False)
+    parser.add_argument('-n', '--num-drugs', help='The number of drugs. Default is 1000.', default=1000, type=int, required=False)
+    parser.add_argument('-r', '--roots', help='The MeSH tree roots to fill, e.g. CF. Default is C.', default='C', type=str, required=False)
+    parser.add_argument('-d', '--depth', help='The maximum depth of a tree number below its root. Default is 6.', default=6, type=int, required=False)
+    parser.add_argument('-f', '--fan-out', help='The smallest and largest number of children of a heading. Default is 2 8.', nargs=2, default=[2, 8], type=int, required=False)
+    parser.add_argument('-l', '--leaf', help='The chance that a heading above the maximum depth has no children. Default is 0.25.', default=0.25, type=float, required=False)
+    parser.add_argument('-p', '--multi-parent', help='The fraction of headings (with their subtree) that also sit under a second parent. Default is 0.1.', default=0.1, type=float, required=False)
+    parser.add_argument('-i', '--indications', help='The mean number of indications per drug. Default is 3.', default=3.0, type=float, required=False)
+    parser.add_argument('-z', '--zipf', help='The exponent of the Zipf popularity of headings as indications. Default is 1.', default=1.0, type=float, required=False)
+    parser.add_argument('--seed', help='The random seed. Default is 0.', default=0, type=int, required=False)
+    args = parser.parse_args()
+    return args
+
+
+'''
+Synthetic MeSH tree. Every heading has a primary tree number, children are numbered below their parent like MeSH (C01, C01.123, C01.123.456), and multi-parent headings get a second tree number under another heading, together with copies of the numbers of their whole subtree.
+'''
+class SyntheticMesh:
+
+    def __init__(self, roots='C', depth=6, fan_out=(2, 8), leaf=0.25, multi_parent=0.1, seed=0):
+        self.random = random.Random(seed)
+        self.numbers = {} # heading -> tree numbers, primary first
+        self.children = {} # heading -> child headings
+        self.depth = depth
+        self.fan_out = fan_out
+        self.leaf = leaf
+
+        for root in roots:
+            for k in range(self.random.randint(*fan_out)):
+                self.grow(f'{root}{k + 1:02d}', 1)
+
+        self.graft(multi_parent)
+
+    '''
+    Add a heading at a tree number and grow its subtree.
+    '''
+    def grow(self, number, level):
+        heading = f'Heading {number}'
+        self.numbers[heading] = [number]
+        self.children[heading] = []
+        if level >= self.depth or self.random.random() < self.leaf:
+            return heading
+
+        for k in range(self.random.randint(*self.fan_out)):
+            self.children[heading].append(self.grow(f'{number}.{k + 1:03d}', level + 1))
+        return heading
+
+    '''
+    Give a fraction of the headings below the top level a second parent in another branch. As in MeSH, the heading and its subtree are numbered again below every tree number of the new parent, so the ancestors of a heading are always the prefixes of its tree numbers.
+    '''
+    def graft(self, fraction):
+        headings = [heading for heading, numbers in self.numbers.items() if '.' in numbers[0]]
+        parents = [heading for heading in self.numbers if self.children[heading]]
+        owner = {number: heading for heading, numbers in self.numbers.items() for number in numbers}
+
+        for heading in self.random.sample(headings, int(fraction * len(headings))):
+            parent = self.random.choice(parents)
+            ancestors = {owner[number[:k]] for number in self.numbers[parent] for k in range(len(number) + 1) if number[k:k + 1] in ('.', '')}
+            if heading in ancestors or heading in self.children[parent]:
+                continue # a heading is never below itself
+            if max(number.count('.') for number in self.numbers[parent]) >= self.depth + 2:
+                continue # keep tree numbers from growing without bound
+
+            k = len(self.children[parent]) + 1
+            self.children[parent].append(heading)
+            for number in list(self.numbers[parent]):
+                self.renumber(heading, f'{number}.{k:03d}', owner)
+
+    '''
+    Add a tree number to a heading and matching tree numbers to every heading below it.
+    '''
+    def renumber(self, heading, number, owner):
+        self.numbers[heading].append(number)
+        owner[number] = heading
+        for k, child in enumerate(self.children[heading]):
+            self.renumber(child, f'{number}.{k + 1:03d}', owner)
+
+    '''
+    Write the headings as MeSH ASCII descriptor records, with a few of the other fields of a real record.
+    '''
+    def write(self, path):
+        with open(path, 'w') as f:
+            for k, (heading, numbers) in enumerate(self.numbers.items()):
+                f.write('*NEWRECORD\nRECTYPE = D\n')
+                f.write(f'MH = {heading}\n')
+                for entry in range(2):
+                    f.write(f'ENTRY = {heading} term {entry}|T047|NON|EQV|UNK (19XX)|771003|abbcdef\n')
+                for number in numbers:
+                    f.write(f'MN = {number}\n')
+                f.write(f'MS = Synthetic heading number {k}.\n')
+                f.write(f'UI = D{k:06d}\n\n')
+
+
+'''
+Write a ChEMBL-like indications table. Drugs get at least one indication and an exponentially distributed number of further ones, headings are picked with a Zipf popularity, and some indications are repeated across clinical phases like in ChEMBL.
+'''
+def write_indications(path, headings, num_drugs, mean=3.0, zipf=1.0, seed=0):
+    rng = random.Random(seed)
+    popular = list(headings)
+    rng.shuffle(popular)
+    weights = [1 / (rank + 1) ** zipf for rank in range(len(popular))]
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(['molecule_chembl_id', 'pref_name', 'mesh_id', 'mesh_heading', 'max_phase_for_ind'])
+        for drug in range(num_drugs):
+            extra = rng.expovariate(1 / (mean - 1)) if mean > 1 else 0 # indications on top of the first
+            n_indications = min(len(popular), 1 + int(extra))
+            indications = set(rng.choices(popular, weights, k=n_indications))
+            for heading in sorted(indications):
+                for phase in rng.sample(range(1, 5), 2 if rng.random() < 0.2 else 1):
+                    writer.writerow([f'CHEMBL{drug + 1}', f'DRUG{drug:06d}', f'D{headings[heading]:06d}', heading, phase])
+
+
+'''
+Write a synthetic MeSH file and indications table to a directory. Returns their paths.
+'''
+def make_synthetic(output, num_drugs, roots='C', depth=6, fan_out=(2, 8), leaf=0.25, multi_parent=0.1, indications=3.0, zipf=1.0, seed=0):
+    os.makedirs(output, exist_ok=True)
+    mesh = SyntheticMesh(roots, depth, fan_out, leaf, multi_parent, seed)
+    mesh_path = os.path.join(output, 'mesh.bin')
+    indications_path = os.path.join(output, 'indications.tsv')
+
+    mesh.write(mesh_path)
+    write_indications(indications_path, {heading: k for k, heading in enumerate(mesh.numbers)}, num_drugs, indications, zipf, seed)
+    return mesh_path, indications_path
+
+
+'''
+Main.
+'''
+if __name__ == '__main__':
+    args = parseArgs()
+    mesh_path, indications_path = make_synthetic(args.output, args.num_drugs, args.roots, args.depth, args.fan_out, args.leaf, args.multi_parent, args.indications, args.zipf, args.seed)
+    print(f'Wrote {mesh_path} and {indications_path}')
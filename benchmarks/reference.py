@@ -0,0 +1,191 @@
+'''
+The original, pure Python implementation of every pipeline stage, kept as the reference that faster engines are checked against.
+
+The functions follow the first release of drugstance.py, rbfKernel.py and avgKernels.py, with their global state passed as arguments. They are slow (every pair of drugs is compared on its own) and meant for small drug sets only. The elementwise kernels came later and are computed straight from their definition.
+'''
+
+import re
+import math
+import numpy as np
+import networkx as nx
+
+
+ROOTS = {'A' : 'Anatomy',
+        'B' : 'Organisms',
+        'C' : 'Diseases',
+        'D' : 'Chemicals and Drugs',
+        'E' : 'Analytical, Diagnostic and Therapeutic Techniques, and Equipment',
+        'F' : 'Psychiatry and Psychology',
+        'G' : 'Phenomena and Processes',
+        'H' : 'Disciplines and Occupations',
+        'I' : 'Anthropology, Education, Sociology, and Social Phenomena',
+        'J' : 'Technology, Industry, and Agriculture',
+        'K' : 'Humanities',
+        'L' : 'Information Science',
+        'M' : 'Named Groups',
+        'N' : 'Health Care',
+        'V' : 'Publication Characteristics',
+        'Z' : 'Geographicals'}
+
+
+'''
+Create mesh_headings (heading -> tree numbers) and mesh_numbers (tree number -> heading) by matching every line of the MeSH file.
+'''
+def map_mesh(meshFile):
+    mesh_headings = {}
+    mesh_numbers = {}
+
+    with open(meshFile, mode='rb') as file:
+        mesh = file.readlines()
+
+    for line in mesh:
+        meshTerm = re.search(b'MH = (.+)$', line)
+        if meshTerm:
+            term = meshTerm.group(1).decode()
+        meshNumber = re.search(b'MN = (.+)$', line)
+        if meshNumber:
+            number = meshNumber.group(1).decode()
+            mesh_numbers[number] = term
+            mesh_headings.setdefault(term, []).append(number)
+
+    # add roots
+    for number, heading in ROOTS.items():
+        mesh_headings[heading] = number
+        mesh_numbers[number] = heading
+
+    return mesh_headings, mesh_numbers
+
+
+'''
+Get the parent number (move UP the tree one level/generation).
+'''
+def up(n):
+    sep = '.'
+    n = n.split(sep)
+    if len(n) > 1:
+        n.pop()
+        n = sep.join(n)
+    else:
+        return n[0][0]
+    return n
+
+
+'''
+Make the graph of MeSH headings, with the drugs of every node as its 'drugs' attribute, and the drug -> nodes dict.
+'''
+def make_graph(drugs, chembl, mesh_headings, mesh_numbers, name='pref_name', indication='mesh_heading'):
+    drug_node_dict = {}
+    node_drug_dict = {}
+    G = nx.DiGraph()
+
+    for drug in drugs:
+        drug_node_dict[drug] = set()
+        headings = sorted(set(chembl[chembl[name] == drug.upper()][indication]))
+        for heading in headings:
+            if heading not in G:
+                G.add_node(heading)
+                node_drug_dict[heading] = set()
+
+            drug_node_dict[drug].add(heading)
+            node_drug_dict[heading].add(drug)
+
+            # add all parents
+            for n in mesh_headings[heading]:
+                c_heading = heading
+                for i in range(n.count('.') + 1):
+                    p = up(n)
+                    p_heading = mesh_numbers[p]
+
+                    if p_heading not in G:
+                        G.add_node(p_heading)
+                        node_drug_dict[p_heading] = set()
+
+                    drug_node_dict[drug].add(p_heading)
+                    node_drug_dict[p_heading].add(drug)
+
+                    if not G.has_edge(p_heading, c_heading):
+                        G.add_edge(p_heading, c_heading)
+
+                    n = p
+                    c_heading = p_heading
+
+    nx.set_node_attributes(G, node_drug_dict, 'drugs')
+
+    return G, drug_node_dict
+
+
+'''
+Compute the information accretion of every node: -log2 of the fraction of the drugs of its parents that also have the node.
+'''
+def compute_ia(G):
+    node_ia_dict = {}
+
+    for node in G.nodes:
+        n_drugs = len(G.nodes[node]['drugs'])
+        drug_sets = [G.nodes[parent]['drugs'] for parent in G.predecessors(node)]
+        n_p_drugs = len(set().union(*drug_sets))
+
+        prob = 1 if n_p_drugs == 0 else n_drugs / n_p_drugs
+        node_ia_dict[node] = -math.log2(prob)
+
+    nx.set_node_attributes(G, node_ia_dict, 'ia')
+
+    return G
+
+
+'''
+Calculate the semantic distance between two drugs: the IA of the nodes of one drug graph missing from the other, both ways.
+'''
+def semantic_distance(G, drug_node_dict, drug1, drug2):
+    mi = sum(G.nodes[n]['ia'] for n in np.setdiff1d(list(drug_node_dict[drug1]), list(drug_node_dict[drug2])))
+    ru = sum(G.nodes[n]['ia'] for n in np.setdiff1d(list(drug_node_dict[drug2]), list(drug_node_dict[drug1])))
+    return mi + ru
+
+
+'''
+Calculate the overlap coefficient of two sets of indications.
+'''
+def overlap(indications1, indications2):
+    return len(indications1 & indications2) / min(len(indications1), len(indications2))
+
+
+'''
+Compare every pair of drugs. Returns the semantic distance and overlap matrices as numpy arrays.
+'''
+def run_comparisons(drugs, G, drug_node_dict, chembl, name='pref_name', indication='mesh_heading'):
+    indications = {drug: set(chembl[chembl[name] == drug][indication]) for drug in drugs}
+
+    n = len(drugs)
+    distances = np.zeros((n, n))
+    overlaps = np.zeros((n, n))
+    for i, drug1 in enumerate(drugs):
+        for j, drug2 in enumerate(drugs):
+            distances[i, j] = semantic_distance(G, drug_node_dict, drug1, drug2)
+            overlaps[i, j] = overlap(indications[drug1], indications[drug2])
+
+    return distances, overlaps
+
+
+'''
+Transform a matrix with sklearn's rbf_kernel, which compares its rows as feature vectors.
+'''
+def rbf_kernel(X, gamma):
+    from sklearn.metrics.pairwise import rbf_kernel
+    return rbf_kernel(X, gamma=gamma)
+
+
+'''
+Transform every distance of a matrix on its own: exp(-gamma * d^2) for gaussian, exp(-gamma * |d|) for laplacian.
+'''
+def elementwise_kernel(D, kernel, gamma):
+    if kernel == 'gaussian':
+        return np.exp(-gamma * D ** 2)
+    return np.exp(-gamma * np.abs(D))
+
+
+'''
+Average similarity matrices as distances (1 - similarity), with weights.
+'''
+def average_kernels(matrices, weights=None):
+    weights = np.ones(len(matrices)) if weights is None else np.asarray(weights, dtype=np.float64)
+    return sum(w * (1 - X) for w, X in zip(weights, matrices)) / weights.sum()
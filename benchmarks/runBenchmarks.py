@@ -0,0 +1,283 @@
+import os
+import sys
+import csv
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make drugstance_core importable
+from drugstance_core.average import average_rows, open_aligned
+from drugstance_core.fused import FusedIndex
+from drugstance_core.ia import compute_ia
+from drugstance_core.indications import load_indications
+from drugstance_core.kernels import ELEMENTWISE, KERNELS, transform
+from drugstance_core.mesh import load_mesh
+from drugstance_core.overlap import OverlapIndex
+from drugstance_core.semantic import SemanticIndex
+from drugstance_core.store import DTYPES, create_matrix, open_matrix, write_rows
+from drugstance_core.tiles import parse_memory, run_tiled, sparse_nbytes, tile_size_for_budget
+from drugstance_core.tree import MeshTree, build_graph
+import reference
+from makeSynthetic import SyntheticMesh, write_indications
+
+
+NAME = 'pref_name' # the name of the drug
+INDICATION = 'mesh_heading' # the MeSH heading
+STAGES = ('loadIndications', 'mapMeSH', 'makeGraph', 'computeIA', 'runComparisons', 'kernel', 'average', 'fused')
+
+
+'''
+Parse arguments.
+'''
+def parseArgs():
+    parser = argparse.ArgumentParser(description='Time every stage of the pipeline on synthetic MeSH and indications data, and check the results against the reference implementation.')
+    parser.add_argument('-n', '--num-drugs', help='The drug counts to benchmark. Default is 100 500 2000. Larger counts (e.g. 5000 20000) run for a long time and need a lot of memory, so they must be asked for explicitly.', nargs='+', default=[100, 500, 2000], type=int, required=False)
+    parser.add_argument('-s', '--stages', help='The stages to time. Later stages need the earlier ones, which are run untimed. Default is all.', nargs='+', choices=STAGES, default=list(STAGES), required=False)
+    parser.add_argument('-o', '--output', help='The TSV the timings are appended to.', default='benchmark_results.tsv', type=str, required=False)
+    parser.add_argument('-w', '--workdir', help='Directory for the synthetic inputs and the matrices. Default is a temporary directory.', type=str, required=False)
+    parser.add_argument('-k', '--kernel', help='The kernel applied to the semantic distances. The fused stage needs an elementwise kernel. Default is gaussian.', choices=KERNELS, default='gaussian', required=False)
+    parser.add_argument('-g', '--gamma', help='The gamma of the kernel. Default is 0.01.', default=0.01, type=float, required=False)
+    parser.add_argument('--dtype', help='The dtype of the matrices.', choices=sorted(DTYPES), default='float64', required=False)
+    parser.add_argument('--max-memory', help='The memory budget of the tiled comparisons. Default is 2G.', default='2G', type=str, required=False)
+    parser.add_argument('--no-memory', help='Do not run every stage a second time to trace its peak memory.', action='store_true', required=False)
+    parser.add_argument('-c', '--check', help='The number of drugs to check against the reference implementation, 0 to skip the check. Default is 100.', default=100, type=int, required=False)
+    parser.add_argument('--tol', help='The largest difference to the reference that is accepted. Default is 1e-9.', default=1e-9, type=float, required=False)
+    parser.add_argument('-d', '--depth', help='The depth of the synthetic MeSH tree. Default is 6.', default=6, type=int, required=False)
+    parser.add_argument('-f', '--fan-out', help='The smallest and largest number of children of a synthetic heading. Default is 2 8.', nargs=2, default=[2, 8], type=int, required=False)
+    parser.add_argument('-p', '--multi-parent', help='The fraction of synthetic headings with a second parent. Default is 0.1.', default=0.1, type=float, required=False)
+    parser.add_argument('--seed', help='The random seed of the synthetic data. Default is 0.', default=0, type=int, required=False)
+    args = parser.parse_args()
+    return args
+
+
+'''
+The pipeline as drugstance.py runs it, one method per stage. Every stage keeps its results on the object for the next one, and can be run again.
+'''
+class Pipeline:
+
+    def __init__(self, mesh_path, indications_path, workdir, kernel='gaussian', gamma=0.01, dtype=np.float64, max_memory=2 << 30):
+        self.mesh_path = mesh_path
+        self.indications_path = indications_path
+        self.workdir = workdir
+        self.kernel_name = kernel
+        self.gamma = gamma
+        self.dtype = dtype
+        self.max_memory = max_memory
+
+    '''
+    Get the path of a matrix in the working directory.
+    '''
+    def path(self, name):
+        return os.path.join(self.workdir, f'{name}.npy')
+
+    '''
+    Load the indications as interned columns, without the indications cache.
+    '''
+    def loadIndications(self):
+        self.indications = load_indications(self.indications_path, NAME, INDICATION, cache=False)
+        self.drugs = self.indications.drugs
+
+    '''
+    Parse the MeSH file, without the parse cache.
+    '''
+    def mapMeSH(self):
+        self.mesh_headings, self.mesh_numbers = load_mesh(self.mesh_path, cache=False)
+
+    '''
+    Build the graph of MeSH headings of the drugs.
+    '''
+    def makeGraph(self):
+        tree = MeshTree(self.mesh_headings, self.mesh_numbers)
+        drug_headings = {drug: self.indications.headings_of(drug.upper()) for drug in self.drugs}
+        self.G, self.drug_node_dict = build_graph(self.drugs, drug_headings, tree)
+
+    '''
+    Compute the information accretion of every node.
+    '''
+    def computeIA(self):
+        self.G = compute_ia(self.G)
+
+    '''
+    Compute the semantic distance and overlap matrices tile by tile, like drugstance.py --max-memory.
+    '''
+    def runComparisons(self):
+        self.sd_index = SemanticIndex.from_graph(self.drugs, self.drug_node_dict, self.G)
+        self.o_index = OverlapIndex.from_indications(self.drugs, self.indications)
+
+        n = len(self.drugs)
+        reserved = 2 * sparse_nbytes(self.sd_index.A) + sparse_nbytes(self.o_index.B)
+        tile = tile_size_for_budget(n, self.max_memory, reserved)
+        metrics = {
+            'semantic_distances': (self.sd_index.distances, create_matrix(self.path('semantic_distances'), self.drugs, 'full', self.dtype, self.sd_index.diagonal())),
+            'overlaps': (self.o_index.overlaps, create_matrix(self.path('overlaps'), self.drugs, 'full', self.dtype, self.o_index.diagonal())),
+        }
+        run_tiled(metrics, n, tile)
+
+    '''
+    Transform the semantic distances with the kernel, like rbfKernel.py.
+    '''
+    def kernel(self):
+        write_rows(self.path('kernel'), self.drugs, transform(open_matrix(self.path('semantic_distances')), self.kernel_name, self.gamma), self.dtype)
+
+    '''
+    Average the kernel and the overlaps as distances, like avgKernels.py.
+    '''
+    def average(self):
+        with open_aligned([self.path('kernel'), self.path('overlaps')]) as (labels, aligned):
+            write_rows(self.path('average'), labels, average_rows(labels, aligned, convert=lambda X: 1 - X), self.dtype)
+
+    '''
+    Compute the average straight from the indexes in one pass, like drugstance.py --fused.
+    '''
+    def fused(self):
+        engine = FusedIndex(self.sd_index, self.o_index, self.kernel_name, self.gamma)
+        n = len(self.drugs)
+        reserved = 2 * sparse_nbytes(self.sd_index.A) + sparse_nbytes(self.o_index.B)
+        tile = tile_size_for_budget(n, self.max_memory // 2, reserved) # the fused engine keeps the four blocks of the last tile
+        run_tiled({'average': (engine.averages, create_matrix(self.path('fused_average'), self.drugs, 'full', self.dtype, engine.diagonal()))}, n, tile)
+
+
+'''
+Run a stage and get its wall time in seconds. With memory the stage is run a second time under tracemalloc, so tracing does not slow down the timed run, and the peak of its Python and numpy allocations in MB is returned too.
+'''
+def measure(stage, memory=True):
+    start = time.perf_counter()
+    stage()
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        stage()
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return seconds, peak
+
+
+'''
+Run the stages of a pipeline in order. Stages in timed are measured, the others only run because later stages need them. Generates (stage, seconds, peak MB).
+'''
+def run_stages(pipeline, timed, memory=True):
+    last = max(STAGES.index(stage) for stage in timed)
+    for stage in STAGES[:last + 1]:
+        if stage == 'fused' and pipeline.kernel_name not in ELEMENTWISE:
+            print(f'Skipping the fused stage, the {pipeline.kernel_name} kernel is not elementwise.')
+            continue
+        if stage in timed:
+            seconds, peak = measure(getattr(pipeline, stage), memory)
+            yield stage, seconds, peak
+        elif stage != 'fused':
+            getattr(pipeline, stage)()
+
+
+'''
+Compare the pipeline to the reference implementation. Returns a list of (stage, largest difference): the largest absolute difference of a numeric result, or 0/1 for results that have to match exactly.
+'''
+def check(pipeline):
+    for stage in STAGES[:-1]:
+        getattr(pipeline, stage)()
+
+    results = []
+    chembl = pd.read_csv(pipeline.indications_path, sep='\t') # the reference reads the table on its own
+    ref_headings, ref_numbers = reference.map_mesh(pipeline.mesh_path)
+    roots = set(reference.ROOTS.values())
+    headings_match = {h: v for h, v in ref_headings.items() if h not in roots} == {h: v for h, v in pipeline.mesh_headings.items() if h not in roots}
+    numbers_match = {k: v for k, v in ref_numbers.items() if k not in reference.ROOTS} == {k: v for k, v in pipeline.mesh_numbers.items() if k not in reference.ROOTS}
+    results.append(('mapMeSH', 0.0 if headings_match and numbers_match else 1.0))
+
+    ref_G, ref_drug_node_dict = reference.make_graph(pipeline.drugs, chembl, ref_headings, ref_numbers, NAME, INDICATION)
+    G = pipeline.G
+    graph_match = set(ref_G.nodes) == set(G.nodes) and set(ref_G.edges) == set(G.edges) and ref_drug_node_dict == pipeline.drug_node_dict
+    graph_match = graph_match and all(ref_G.nodes[node]['drugs'] == G.nodes[node]['drugs'] for node in ref_G.nodes)
+    results.append(('makeGraph', 0.0 if graph_match else 1.0))
+    if not graph_match:
+        return results # later stages would only repeat the difference
+
+    ref_G = reference.compute_ia(ref_G)
+    results.append(('computeIA', max((abs(ref_G.nodes[node]['ia'] - G.nodes[node]['ia']) for node in G.nodes), default=0.0)))
+
+    ref_D, ref_O = reference.run_comparisons(pipeline.drugs, ref_G, ref_drug_node_dict, chembl, NAME, INDICATION)
+    D = open_matrix(pipeline.path('semantic_distances'))
+    O = open_matrix(pipeline.path('overlaps'))
+    results.append(('runComparisons', max(np.abs(D.block() - ref_D).max(), np.abs(O.block() - ref_O).max())))
+
+    if pipeline.kernel_name == 'rbf':
+        try:
+            ref_K = reference.rbf_kernel(ref_D, pipeline.gamma)
+        except ImportError:
+            print('scikit-learn is not installed, the rbf kernel and the average are not checked.')
+            return results
+    else:
+        ref_K = reference.elementwise_kernel(ref_D, pipeline.kernel_name, pipeline.gamma)
+    results.append(('kernel', np.abs(open_matrix(pipeline.path('kernel')).block() - ref_K).max()))
+
+    ref_average = reference.average_kernels([ref_K, ref_O])
+    results.append(('average', np.abs(open_matrix(pipeline.path('average')).block() - ref_average).max()))
+    if pipeline.kernel_name in ELEMENTWISE:
+        pipeline.fused()
+        results.append(('fused', np.abs(open_matrix(pipeline.path('fused_average')).block() - ref_average).max()))
+
+    return results
+
+
+'''
+Append timings to the results TSV, writing the header to a new file.
+'''
+def write_timings(path, rows):
+    new = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, 'a', newline='') as f:
+        writer = csv.writer(f, delimiter='\t')
+        if new:
+            writer.writerow(['drugs', 'stage', 'seconds', 'peak_mb', 'pairs_per_second'])
+        writer.writerows(rows)
+
+
+'''
+Main.
+'''
+if __name__ == '__main__':
+    args = parseArgs()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir if args.workdir is not None else tmp
+        os.makedirs(workdir, exist_ok=True)
+        dtype = DTYPES[args.dtype]
+        max_memory = parse_memory(args.max_memory)
+
+        # one MeSH tree for every drug count
+        mesh = SyntheticMesh('C', args.depth, args.fan_out, multi_parent=args.multi_parent, seed=args.seed)
+        mesh_path = os.path.join(workdir, 'mesh.bin')
+        mesh.write(mesh_path)
+        headings = {heading: k for k, heading in enumerate(mesh.numbers)}
+        print(f'Synthetic MeSH tree with {len(headings)} headings and {sum(len(numbers) for numbers in mesh.numbers.values())} tree numbers')
+
+        failed = False
+        if args.check > 0:
+            indications_path = os.path.join(workdir, f'indications_{args.check}.tsv')
+            write_indications(indications_path, headings, args.check, seed=args.seed)
+            pipeline = Pipeline(mesh_path, indications_path, workdir, args.kernel, args.gamma, np.float64, max_memory)
+
+            print(f'Checking {args.check} drugs against the reference implementation...')
+            for stage, difference in check(pipeline):
+                status = 'ok' if difference <= args.tol else 'FAILED'
+                failed = failed or status == 'FAILED'
+                print(f'    {stage}: {status} (largest difference {difference:.3g})')
+
+        for num_drugs in args.num_drugs:
+            indications_path = os.path.join(workdir, f'indications_{num_drugs}.tsv')
+            write_indications(indications_path, headings, num_drugs, seed=args.seed)
+            pipeline = Pipeline(mesh_path, indications_path, workdir, args.kernel, args.gamma, dtype, max_memory)
+
+            print(f'Benchmarking {num_drugs} drugs...')
+            rows = []
+            for stage, seconds, peak in run_stages(pipeline, args.stages, not args.no_memory):
+                pairs = len(pipeline.drugs) ** 2 if stage in ('runComparisons', 'kernel', 'average', 'fused') else None
+                rows.append([num_drugs, stage, f'{seconds:.4f}', '' if peak is None else f'{peak:.1f}', '' if pairs is None else f'{pairs / seconds:.0f}'])
+                print(f'    {stage}: {seconds:.3f} s' + ('' if peak is None else f', peak {peak:.1f} MB'))
+            write_timings(args.output, rows)
+
+    if failed:
+        sys.exit('The pipeline does not match the reference implementation.')
@@ -1,5 +1,10 @@
+import os
+import sys
 import argparse
-import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make drugstance_core importable
+from drugstance_core.average import average_rows, open_aligned
+from drugstance_core.store import DTYPES, write_rows
 
 
 '''
@@ -7,36 +12,33 @@ Parse arguments. None are required.
 '''
 def parseArgs():
     parser = argparse.ArgumentParser(description='Average kernels for an improved metric of drug distance. Input matrices should be similarity scores between 0 and 1, where 1 indicates equivalence.')
-    parser.add_argument('-i', '--input', help='A list of similarity matrices (TSV files) with the different kernels to be averaged.', nargs='*', action='store', dest='input', type=str, required=True)
+    parser.add_argument('-i', '--input', help='A list of similarity matrices (TSV or binary .npy files) with the different kernels to be averaged.', nargs='*', action='store', dest='input', type=str, required=True)
+    parser.add_argument('-w', '--weights', help='A weight for every input matrix, in the same order. Default is an equal weight for all.', nargs='*', type=float, required=False)
+    parser.add_argument('-b', '--block-size', help='The number of rows averaged at once. Default is 1024.', default=1024, type=int, required=False)
+    parser.add_argument('--binary', help='Write a binary .npy matrix with a .json drug label sidecar instead of a TSV.', action='store_true', required=False)
+    parser.add_argument('--dtype', help='The dtype of a binary output.', choices=sorted(DTYPES), default='float64', required=False)
     parser.add_argument('-o', '--output', help='Output directory.', default='.', type=str, required=False)
     args = parser.parse_args()
     return args
 
 
+'''
+Convert similarities to distances.
+'''
+def toDistance(X):
+    return 1 - X
+
+
 '''
 Main.
 '''
 if __name__ == "__main__":
     args = parseArgs() # parse arguments
-    DRUG = 'Drug' # column header to use as index
-    matrices = []
-
-    # read, sort, and convert to distances, all input matrices
-    for matrix in args.input:
-        X = pd.read_csv(matrix, delimiter='\t', index_col=DRUG) # read matrix into pandas
-        
-        X = X.sort_index() # sort rows
-        X = X.reindex(sorted(X.columns), axis = 1) # sort columns
-        X = 1 - X # convert to distance
-        matrices.append(X)
-
-    # add all the kernels together
-    sum = matrices[0] # init df
-    for X in matrices:
-        sum += X
-    
-    # get the average
-    sum = sum / len(matrices)
-
-    # write average distance kernel to file
-    sum.to_csv(f'{args.output}/drug_average_kernel.tsv', sep='\t')
\ No newline at end of file
+
+    # align all input matrices by their drugs once, then average matching row blocks as distances
+    with open_aligned(args.input) as (drugs, matrices):
+        average = average_rows(drugs, matrices, args.weights, args.block_size, toDistance)
+
+        # write average distance kernel to file block by block
+        extension = 'npy' if args.binary else 'tsv'
+        write_rows(f'{args.output}/drug_average_kernel.{extension}', drugs, average, DTYPES[args.dtype])
@@ -1,30 +1,73 @@
+import os
+import sys
+import csv
 import argparse
-import pandas as pd
-from sklearn.metrics.pairwise import rbf_kernel
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make drugstance_core importable
+from drugstance_core.kernels import KERNELS, KernelStats, sweep
+from drugstance_core.store import DTYPES, RowWriter, open_rows
 
 
 '''
 Parse arguments. None are required.
 '''
 def parseArgs():
-    parser = argparse.ArgumentParser(description='Compute the Radial Basis Function Kernel for a distance matrix')
-    parser.add_argument('-i', '--input', help='A distance matrix in TSV format.', type=str, required=True)
-    parser.add_argument('-s', '--sigma', help='The value of sigma to use in the RBF kernel.', default=10, type=int, required=False)
+    parser = argparse.ArgumentParser(description='Compute a kernel for a distance matrix, streaming it in row blocks.')
+    parser.add_argument('-i', '--input', help='A distance matrix in TSV format, or a binary .npy matrix.', type=str, required=True)
+    parser.add_argument('-s', '--sigma', help='The value of sigma (used as gamma) to use in the kernel. Several values sweep all of them in one pass over the matrix.', nargs='+', default=[10], type=float, required=False)
+    parser.add_argument('-k', '--kernel', help='rbf treats every row as a feature vector like sklearn\'s rbf_kernel, gaussian is exp(-gamma * d^2) and laplacian exp(-gamma * |d|) of every distance d. Default is rbf.', choices=KERNELS, default='rbf', required=False)
+    parser.add_argument('-b', '--block-size', help='The number of rows transformed at once. Default is 1024.', default=1024, type=int, required=False)
+    parser.add_argument('--stats', help='Write the mean off-diagonal similarity and effective rank of the kernel for every sigma to a TSV.', action='store_true', required=False)
+    parser.add_argument('--stats-only', help='Only compute the statistics, without writing the kernels.', action='store_true', required=False)
+    parser.add_argument('--binary', help='Write a binary .npy matrix with a .json drug label sidecar instead of a TSV.', action='store_true', required=False)
+    parser.add_argument('--dtype', help='The dtype of a binary output.', choices=sorted(DTYPES), default='float64', required=False)
     parser.add_argument('-o', '--output', help='Output directory.', default='.', type=str, required=False)
     args = parser.parse_args()
+    args.sigma = list(dict.fromkeys(args.sigma)) # a repeated sigma would get a second output of the same name and misalign the stats
+    if len({f'{sigma:g}' for sigma in args.sigma}) < len(args.sigma):
+        parser.error('sigmas that differ past 6 significant digits would share an output name')
     return args
 
 
+'''
+Write the statistics of every sigma to a TSV.
+'''
+def writeStats(stats, f):
+    with open(f, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(['sigma', 'mean_off_diagonal', 'effective_rank'])
+        for sigma, s in stats.items():
+            summary = s.summary()
+            writer.writerow([sigma, summary['mean_off_diagonal'], summary['effective_rank']])
+
+
 '''
 Main.
 '''
 if __name__ == "__main__":
     args = parseArgs() # parse arguments
-    DRUG = 'Drug' # column header to use as index
 
-    X = pd.read_csv(args.input, delimiter='\t', index_col=DRUG) # read matrix into df
-    K = rbf_kernel(X, gamma = args.sigma) # do the RBG kernel magic!
-    Y = pd.DataFrame(K, columns=X.columns).set_index(X.index)
+    X = open_rows(args.input) # stream the matrix in row blocks
+    filename = os.path.splitext(args.input.split('/')[-1])[0] # get input file name without extension
+    extension = 'npy' if args.binary else 'tsv'
+
+    # one output per sigma, named by sigma when sweeping
+    writers = []
+    if not args.stats_only:
+        for sigma in args.sigma:
+            suffix = f'_{sigma:g}' if len(args.sigma) > 1 else ''
+            writers.append(RowWriter(f'{args.output}/{filename}_{args.kernel}_kernel{suffix}.{extension}', X.labels, DTYPES[args.dtype]))
+    stats = {sigma: KernelStats(X.n) for sigma in args.sigma} if args.stats or args.stats_only else {}
+
+    # every block of the matrix is read once for all sigmas
+    for start, stop, blocks in sweep(X, args.kernel, args.sigma, args.block_size):
+        for writer, K in zip(writers, blocks):
+            writer.write(start, stop, K)
+        for s, K in zip(stats.values(), blocks):
+            s.add(start, stop, K)
+
+    for writer in writers:
+        writer.close()
 
-    filename = args.input.split('/')[-1].split('.tsv')[0] # get input file name without extension
-    Y.to_csv(f'{args.output}/{filename}_rbf_kernel.tsv', sep='\t') # write RBF kernel to file
\ No newline at end of file
+    if stats:
+        writeStats(stats, f'{args.output}/{filename}_{args.kernel}_kernel_stats.tsv')
@@ -1,10 +1,20 @@
-import re
 import argparse
-import networkx as nx
-import math
-import pandas as pd
 import numpy as np
 import csv
+import os
+from drugstance_core.mesh import load_mesh
+from drugstance_core.semantic import SemanticIndex
+from drugstance_core.overlap import OverlapIndex
+from drugstance_core.indications import load_indications
+from drugstance_core.ia import compute_ia
+from drugstance_core.tree import MeshTree, build_graph
+from drugstance_core.condensed import condensed_segment, squareform
+from drugstance_core.tiles import parse_memory, run_tiled, sparse_nbytes, tile_size_for_budget
+from drugstance_core.store import DTYPES, create_matrix, write_matrix
+from drugstance_core.scheduler import balanced_tile_size, labels_digest, run_scheduled
+from drugstance_core.fused import FusedIndex
+from drugstance_core.kernels import ELEMENTWISE
+from drugstance_core.instrument import configure, profiled, stage
 
 '''
 Parse arguments. None are required.
@@ -15,6 +25,20 @@ def parseArgs():
     parser.add_argument('-m', '--mesh', help='A file all MeSH data in ASCII format', type=str, required=True)
     parser.add_argument('-s', '--sample', help='The number of drugs to use for testing this script on a random sample.', type=int, required=False)
     parser.add_argument('-o', '--output', help='Output directory.', default='/data', type=str, required=False)
+    parser.add_argument('--symmetric', help='Only evaluate each unordered pair of drugs once (i < j) and mirror the result.', action='store_true', required=False)
+    parser.add_argument('--max-memory', help='Compute the matrices tile by tile into memory-mapped binary matrices, picking the tile size so comparisons stay within this budget (e.g. 4G).', type=str, required=False)
+    parser.add_argument('--binary', help='Write binary .npy matrices with a .json drug label sidecar instead of TSVs.', action='store_true', required=False)
+    parser.add_argument('--condensed', help='Write only the upper triangle as condensed (scipy-style) binary matrices. Implies --symmetric and --binary.', action='store_true', required=False)
+    parser.add_argument('--dtype', help='The dtype of binary matrices.', choices=sorted(DTYPES), default='float64', required=False)
+    parser.add_argument('-n', '--num-cpus', help='Compute tiles on this many worker processes, writing binary matrices. Default is 1.', default=1, type=int, required=False)
+    parser.add_argument('--resume', help='Resume an interrupted run from the checkpoint in the output directory, skipping finished tiles.', action='store_true', required=False)
+    parser.add_argument('--fused', help='Compute the kernel of the semantic distances and its weighted average with the overlaps in the same pass, writing only the final averaged matrix (drug_average_kernel.npy).', action='store_true', required=False)
+    parser.add_argument('--kernel', help='The kernel applied to the semantic distances with --fused. Only elementwise kernels can be fused.', choices=sorted(ELEMENTWISE), default='gaussian', required=False)
+    parser.add_argument('--gamma', help='The gamma of the kernel with --fused.', type=float, required=False)
+    parser.add_argument('--weights', help='The weights of the kernel and of the overlaps in the average with --fused. Default is 1 1.', nargs=2, default=[1.0, 1.0], type=float, required=False)
+    parser.add_argument('--intermediates', help='With --fused, also write the semantic distances, the kernel and the overlaps.', action='store_true', required=False)
+    parser.add_argument('--events', help='Write machine-readable JSON events (stage times, memory, graph size, progress with ETA) to this file, one per line. Use - for stderr.', type=str, required=False)
+    parser.add_argument('--profile', help='Profile the run with cProfile and write the stats to this file. Worker processes are not profiled.', type=str, required=False)
     args = parser.parse_args()
     return args
 
@@ -23,8 +47,7 @@ def parseArgs():
 Get a drug's indications
 '''
 def getIndications(drug):
-    indications = set(chembl[chembl[NAME] == drug][INDICATION].tolist())
-    return indications
+    return indications.headings_of(drug)
 
 
 '''
@@ -77,206 +100,168 @@ def semanticDistance(drug1, drug2):
 
 
 '''
-Calculate the semantic distance between every pairwise combination of drugs, no repeats.
+Calculate the semantic distance between every pairwise combination of drugs, no repeats. Semantic distances and overlaps come from the sparse engines in one pass.
 '''
 def runComparisons(drugs):
-    all_sd = []
-    all_o = []
-    for drug1 in drugs:
-        s_distances = [drug1]
-        overlaps = [drug1]
-        for drug2 in drugs:
+    sd_index = SemanticIndex.from_graph(drugs, drug_node_dict, G) # drugs x nodes incidence and IA vector
+    o_index = OverlapIndex.from_indications(drugs, indications) # drugs x headings incidence
 
-            # compute semantic distance
-            sd = semanticDistance(drug1, drug2)
-            s_distances.append(sd)
+    distances = sd_index.distances()
+    overlaps = o_index.overlaps()
 
-            # compute overlap
-            overlap = computeOverlap(drug1, drug2)
-            overlaps.append(overlap)
-
-        all_sd.append(s_distances)
-        all_o.append(overlaps)
+    all_sd = []
+    all_o = []
+    for i, drug1 in enumerate(drugs):
+        all_sd.append([drug1] + distances[i].tolist())
+        all_o.append([drug1] + overlaps[i].tolist())
 
     return all_sd, all_o
 
 
 '''
-Write results to a TSV.
+Calculate the semantic distance and overlap for every unordered pair of drugs (i < j) only. Both metrics are symmetric so the lower triangle and the diagonal are never evaluated. Returns condensed vectors and the diagonals.
 '''
-def writeResults(results, f):
-    with open(f'{args.output}/{f}', 'w', newline='') as f:
-        writer = csv.writer(f, delimiter='\t')
-        writer.writerow(drugs)
-        writer.writerows(results)
+def runSymmetricComparisons(drugs):
+    sd_index = SemanticIndex.from_graph(drugs, drug_node_dict, G)
+    o_index = OverlapIndex.from_indications(drugs, indications)
 
+    n = len(drugs)
+    distances = condensed_segment(sd_index.distances, n)
+    overlaps = condensed_segment(o_index.overlaps, n)
 
-'''
-Get the parent number (move UP the tree one level/generation).
-'''
-def up(n):
-    sep = '.'
-    n = n.split(sep)
-    if len(n) > 1:
-        n.pop()
-        n = sep.join(n)
-    else:
-        return n[0][0]
-    return n
+    return distances, overlaps, sd_index.diagonal(), o_index.diagonal()
 
 
 '''
-Get indications headings.
+Calculate the semantic distance and overlap in tiles sized to a memory budget. Every finished tile is written straight into memory-mapped binary matrices in the output directory, so the full matrices are never held in memory.
 '''
-def getHeadings(drug):
-    indications = chembl[chembl[NAME] == drug.upper()]
-    headings = sorted(list(set(indications.mesh_heading)))
-    return headings
+def runTiledComparisons(drugs, max_memory, layout):
+    sd_index = SemanticIndex.from_graph(drugs, drug_node_dict, G)
+    o_index = OverlapIndex.from_indications(drugs, indications)
 
+    # memory already held by the indexes
+    reserved = 2 * sparse_nbytes(sd_index.A) + sparse_nbytes(o_index.B)
 
-'''
-Make a graph where the nodes are MeSH headings and the directed edges form the heirarchy. Each node has as an attribute the list of drugs that include that node.
-'''
-def makeGraph(drugs):
-    node_drug_dict = {} # init dict
-    G = nx.DiGraph() # init DAG
-
-    for drug in drugs:
-        drug_node_dict[drug] = set()
-        for heading in getHeadings(drug):
-            # add heading node
-            if heading not in list(G.nodes):
-                G.add_node(heading)
-                node_drug_dict[heading] = set()
-                
-            drug_node_dict[drug].add(heading)
-            node_drug_dict[heading].add(drug)
-
-            # add all parents
-            for n in mesh_headings[heading]:
-                c_heading = heading # set child heading
-                for i in range(n.count('.') + 1):
-                    p = up(n) # get parent number
-                    p_heading = mesh_numbers[p] # get parent heading
-
-                    # add parent heading node
-                    if p_heading not in list(G.nodes):
-                        G.add_node(p_heading)
-                        node_drug_dict[p_heading] = set()
-                    
-                    drug_node_dict[drug].add(p_heading)
-                    node_drug_dict[p_heading].add(drug)
-                    
-                    if not G.has_edge(p_heading, c_heading):
-                        G.add_edge(p_heading, c_heading) # add directed edge from parent to child
-
-                    n = p # move up path
-                    c_heading = p_heading
-    
-    nx.set_node_attributes(G, node_drug_dict, 'drugs')
+    n = len(drugs)
+    tile = tile_size_for_budget(n, max_memory, reserved)
+    print(f'Using {tile} x {tile} tiles...')
 
-    return G
+    dtype = DTYPES[args.dtype]
+    store_layout = 'condensed' if layout == 'condensed' else 'full'
+    metrics = {
+        'semantic_distances': (sd_index.distances, create_matrix(f'{args.output}/semantic_distances.npy', drugs, store_layout, dtype, sd_index.diagonal())),
+        'overlaps': (o_index.overlaps, create_matrix(f'{args.output}/overlaps.npy', drugs, store_layout, dtype, o_index.diagonal())),
+    }
+    run_tiled(metrics, n, tile, layout)
 
 
 '''
-Compute information accretion for each node in a graph.
+Calculate the semantic distance and overlap on a pool of workers. The pairs are cut into small tiles that idle workers take one at a time, every finished tile goes straight into memory-mapped binary matrices, and finished tiles are recorded in a checkpoint so an interrupted run can be resumed.
+With fused, every tile also goes through the kernel and the weighted average (see drugstance_core.fused), and only the averaged matrix is written unless the intermediates are requested.
 '''
-def computeIA(G):
-    # annotate nodes with information accretion value from probability
-    node_ia_dict = {}
+def runScheduledComparisons(drugs, layout, workers, max_memory=None, resume=False, fused=False):
+    sd_index = SemanticIndex.from_graph(drugs, drug_node_dict, G)
+    o_index = OverlapIndex.from_indications(drugs, indications)
+
+    n = len(drugs)
+    if max_memory is not None:
+        reserved = 2 * sparse_nbytes(sd_index.A) + sparse_nbytes(o_index.B) # held by every worker
+        budget = max_memory // workers
+        if fused:
+            budget //= 2 # the fused engine keeps the four blocks of the last tile
+        tile = tile_size_for_budget(n, budget, reserved)
+    else:
+        tile = balanced_tile_size(n, n, workers)
+    print(f'Using {tile} x {tile} tiles on {workers} workers...')
+
+    dtype = DTYPES[args.dtype]
+    store_layout = 'condensed' if layout == 'condensed' else 'full'
+    checkpoint = f'{args.output}/drugstance.checkpoint'
+    run = {'labels': labels_digest(drugs), 'dtype': args.dtype}
+    if fused:
+        engine = FusedIndex(sd_index, o_index, args.kernel, args.gamma, args.weights)
+        run['fused'] = engine.params() # a resumed run has to use the same kernel and weights
+        outputs = [(engine, 'averages', f'{args.output}/drug_average_kernel.npy', engine.diagonal())]
+        if args.intermediates:
+            outputs += [
+                (engine, 'distances', f'{args.output}/semantic_distances.npy', sd_index.diagonal()),
+                (engine, 'kernels', f'{args.output}/semantic_distances_{args.kernel}_kernel.npy', np.ones(n)),
+                (engine, 'overlaps', f'{args.output}/overlaps.npy', o_index.diagonal()),
+            ]
+    else:
+        outputs = [(sd_index, 'distances', f'{args.output}/semantic_distances.npy', sd_index.diagonal()), (o_index, 'overlaps', f'{args.output}/overlaps.npy', o_index.diagonal())]
 
-    for node in G.nodes:
-        n_drugs = len(G.nodes[node]['drugs']) # get the number of drugs with this heading 
+    # start new outputs unless there is a run to resume
+    if not (resume and os.path.exists(checkpoint) and all(os.path.exists(path) for _, _, path, _ in outputs)):
+        resume = False
+        for _, _, path, diagonal in outputs:
+            create_matrix(path, drugs, store_layout, dtype, diagonal)
 
-        ## get the number of drugs with all parent headings
+    def progress(done, total):
+        if done == total or done * 10 // total > (done - 1) * 10 // total:
+            print(f'{done}/{total} tiles done')
 
-        parents = G.predecessors(node) # get parent nodes
+    metrics = [(engine, method, path) for engine, method, path, _ in outputs]
+    computed, total = run_scheduled(metrics, n, tile, layout, workers, checkpoint, resume, progress=progress, run=run)
+    if computed < total:
+        print(f'Resumed with {total - computed} of {total} tiles already done.')
+    os.remove(checkpoint) # every tile is done, a stale checkpoint could make a later run in this directory skip work
 
-        # get drugs for each parent
-        drug_sets = []
-        for parent in parents:
-            drug_sets.append(G.nodes[parent]['drugs'])
 
-        n_p_drugs = len(set().union(*drug_sets)) # count the number of drugs that have all parent headings
+'''
+Mirror a condensed vector into full rows with the drug name first, like runComparisons returns.
+'''
+def mirrorResults(condensed, diagonal, drugs):
+    X = squareform(condensed, len(drugs), diagonal)
+    return [[drug] + X[i].tolist() for i, drug in enumerate(drugs)]
 
-        # compute probability
-        if n_p_drugs == 0:
-            prob = 1
-        else:
-            prob = n_drugs / n_p_drugs
 
-        # compute information accretion
-        ia = -math.log2(prob) # does this work for single values or does it have to be an array?
+'''
+Write results to a TSV.
+'''
+def writeResults(results, f):
+    with open(f'{args.output}/{f}', 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(drugs)
+        writer.writerows(results)
 
-        node_ia_dict[node] = ia
 
-    nx.set_node_attributes(G, node_ia_dict, 'ia')
+'''
+Make a graph where the nodes are MeSH headings and the directed edges form the heirarchy. Each node has as an attribute the list of drugs that include that node.
+MeSH is coded as an integer tree whose ancestor closures are computed once per heading, so each drug graph is a union of cached closures.
+'''
+def makeGraph(drugs):
+    tree = MeshTree(mesh_headings, mesh_numbers) # integer coded MeSH tree
+    drug_headings = {drug: indications.headings_of(drug.upper()) for drug in drugs} # from the interned drug -> headings index
+    G, nodes = build_graph(drugs, drug_headings, tree)
+    drug_node_dict.update(nodes)
 
     return G
 
 
+'''
+Compute information accretion for each node in a graph. Drug sets are packed into bitsets so parent unions are bulk OR + popcount.
+'''
+def computeIA(G):
+    return compute_ia(G)
+
+
 '''
 Create two dictionaries:
     mesh_headings: (key) MeSH heading as string (value) list of MeSH tree numbers as strings
     mesh_numbers: (key) MeSH tree number as string (value) MeSH heading as string
+The file is parsed in one streaming pass and the result is cached next to it, keyed by the file's hash.
 '''
 def mapMeSH(meshFile):
-    mesh_headings = {}
-    mesh_numbers = {}
-
-    roots = {'A' : 'Anatomy',
-            'B' : 'Organisms',
-            'C' : 'Diseases',
-            'D' : 'Chemicals and Drugs',
-            'E' : 'Analytical, Diagnostic and Therapeutic Techniques, and Equipment',
-            'F' : 'Psychiatry and Psychology',
-            'G' : 'Phenomena and Processes',
-            'H' : 'Disciplines and Occupations',
-            'I' : 'Anthropology, Education, Sociology, and Social Phenomena',
-            'J' : 'Technology, Industry, and Agriculture',
-            'K' : 'Humanities',
-            'L' : 'Information Science',
-            'M' : 'Named Groups',
-            'N' : 'Health Care',
-            'V' : 'Publication Characteristics',
-            'Z' : 'Geographicals'}
-    
-    # read input
-    with open(meshFile, mode='rb') as file:
-        mesh = file.readlines()
-
-    # parse input and build dicts
-    for line in mesh:
-        meshTerm = re.search(b'MH = (.+)$', line)
-        if meshTerm:
-            term = meshTerm.group(1)
-            term = term.decode()
-        meshNumber = re.search(b'MN = (.+)$', line)
-        if meshNumber:
-            number = meshNumber.group(1)
-            mesh_numbers[number.decode()] = term
-            if term in mesh_headings:
-                mesh_headings[term].append(number.decode('utf-8'))
-            else:
-                mesh_headings[term] = list()
-                mesh_headings[term].append(number.decode('utf-8'))
-
-    # add roots
-    for number, heading in roots.items():
-        mesh_headings[heading] = number
-        mesh_numbers[number] = heading
-    
-    return mesh_headings, mesh_numbers
+    return load_mesh(meshFile)
 
 
 '''
-Take a random sample of n drugs from ChEMBL.
+Take a random sample of n drugs from ChEMBL. Only the sampled drugs are looked up in the indications.
 '''
-def sample(n, drugs, chembl):
+def sample(n, drugs):
     import random
-    drugs = random.sample(drugs, n) # get random set of drugs
-    chembl = chembl[chembl[NAME].isin(drugs)] # filter chembl
-    return drugs, chembl
+    return random.sample(drugs, n) # get random set of drugs
 
 
 '''
@@ -288,30 +273,65 @@ if __name__ == "__main__":
     INDICATION = 'mesh_heading' # the MeSH heading
 
     args = parseArgs() # parse arguments
-
-    print('Loading input data...')
-    chembl = pd.read_csv(args.input, sep='\t') # load in ChEMBL
-    drugs = list(set(chembl[NAME])) # get drug list
-
-    # use random sample of ChEMBL if requested
-    if args.sample is not None:
-        drugs, chembl = sample(args.sample, drugs, chembl)
-
-    drug_node_dict = {} # init dict
-
-    print('Mapping MeSH headings and numbers...')
-    mesh_headings, mesh_numbers = mapMeSH(args.mesh) # map MeSH headings to numbers and visa-versa
-
-    print('Making graph...')
-    G = makeGraph(drugs) # build graph
-
-    print('Computing information accretion...')
-    G = computeIA(G) # compute and add ia values
-
-    print(f'Computing semantic distance and overlap between all {len(drugs)} drugs...')
-    semantic_distances, overlaps = runComparisons(drugs)
-
-    print('Writing results...')
-    drugs.insert(0,'Drug')
-    writeResults(semantic_distances, 'semantic_distances.tsv')
-    writeResults(overlaps, 'overlaps.tsv')
\ No newline at end of file
+    if args.fused and args.gamma is None:
+        raise ValueError('--fused needs the --gamma of the kernel.')
+    configure(args.events) # JSON events, if requested
+
+    with profiled(args.profile), stage('drugstance'):
+        print('Loading input data...')
+        with stage('loadInput') as info:
+            indications = load_indications(args.input, NAME, INDICATION) # load in ChEMBL, from its cache after the first run
+            drugs = list(indications.drugs) # get drug list, sorted so runs can be resumed
+
+            # use random sample of ChEMBL if requested
+            if args.sample is not None:
+                drugs = sample(args.sample, drugs)
+            info.update(drugs=len(drugs), indications=indications.rows)
+
+        drug_node_dict = {} # init dict
+
+        print('Mapping MeSH headings and numbers...')
+        with stage('mapMeSH') as info:
+            mesh_headings, mesh_numbers = mapMeSH(args.mesh) # map MeSH headings to numbers and visa-versa
+            info.update(headings=len(mesh_headings), tree_numbers=len(mesh_numbers))
+
+        print('Making graph...')
+        with stage('makeGraph') as info:
+            G = makeGraph(drugs) # build graph
+            info.update(nodes=G.number_of_nodes(), edges=G.number_of_edges())
+
+        print('Computing information accretion...')
+        with stage('computeIA'):
+            G = computeIA(G) # compute and add ia values
+
+        print(f'Computing semantic distance and overlap between all {len(drugs)} drugs...')
+        layout = 'condensed' if args.condensed else 'symmetric' if args.symmetric else 'full'
+        n = len(drugs)
+        with stage('runComparisons', drugs=n, layout=layout, pairs=n * n if layout == 'full' else n * (n - 1) // 2):
+            if args.fused or args.num_cpus > 1 or args.resume:
+                max_memory = parse_memory(args.max_memory) if args.max_memory is not None else None
+                runScheduledComparisons(drugs, layout, args.num_cpus, max_memory, args.resume, args.fused)
+            elif args.max_memory is not None:
+                runTiledComparisons(drugs, parse_memory(args.max_memory), layout)
+            elif args.condensed:
+                semantic_distances, overlaps, sd_diagonal, o_diagonal = runSymmetricComparisons(drugs)
+
+                print('Writing condensed results...')
+                write_matrix(f'{args.output}/semantic_distances.npy', semantic_distances, drugs, 'condensed', DTYPES[args.dtype], sd_diagonal)
+                write_matrix(f'{args.output}/overlaps.npy', overlaps, drugs, 'condensed', DTYPES[args.dtype], o_diagonal)
+            else:
+                if args.symmetric:
+                    semantic_distances, overlaps, sd_diagonal, o_diagonal = runSymmetricComparisons(drugs)
+                    semantic_distances = mirrorResults(semantic_distances, sd_diagonal, drugs)
+                    overlaps = mirrorResults(overlaps, o_diagonal, drugs)
+                else:
+                    semantic_distances, overlaps = runComparisons(drugs)
+
+                print('Writing results...')
+                if args.binary:
+                    write_matrix(f'{args.output}/semantic_distances.npy', np.array([row[1:] for row in semantic_distances]), drugs, 'full', DTYPES[args.dtype])
+                    write_matrix(f'{args.output}/overlaps.npy', np.array([row[1:] for row in overlaps]), drugs, 'full', DTYPES[args.dtype])
+                else:
+                    drugs.insert(0,'Drug')
+                    writeResults(semantic_distances, 'semantic_distances.tsv')
+                    writeResults(overlaps, 'overlaps.tsv')
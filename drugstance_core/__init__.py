@@ -0,0 +1,3 @@
+'''
+Shared engines used by drugstance.py, the SLURM pipeline and the downstream transformations.
+'''
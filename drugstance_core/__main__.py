@@ -0,0 +1,270 @@
+'''
+Single entry point of the pipeline: python3 -m drugstance_core <command>.
+
+    map-mesh     parse the MeSH file into the heading and tree number dicts
+    build-graph  build the graph of the drugs' MeSH headings and its IA values
+    distances    compute the semantic distance matrix from the graph
+    overlaps     compute the overlap coefficient matrix from the indications
+    kernel       transform a distance matrix with a kernel
+    average      average similarity matrices as distances
+    pairs        find and score the similar drug pairs approximately (MinHash/LSH)
+
+Every command runs a cmd_* function, so none of them shadows the drugstance_core function it wraps. Only argparse is imported at start up. numpy, pandas, scipy and networkx are imported inside the commands that use them, so --help and short commands start quickly.
+'''
+
+import argparse
+import os
+import pickle
+
+
+DTYPE_NAMES = ('float32', 'float64') # see store.DTYPES, which needs numpy
+KERNEL_NAMES = ('rbf', 'gaussian', 'laplacian') # see kernels.KERNELS
+METRIC_NAMES = ('semantic', 'overlap') # see lsh.METRICS
+
+
+'''
+Write an object to a pickle file.
+'''
+def dump(obj, path):
+    with open(path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+'''
+Read an object from a pickle file.
+'''
+def load(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+'''
+Parse the MeSH file into mesh_headings.pkl and mesh_numbers.pkl, like slurm_pipeline/mapMesh.py.
+'''
+def cmd_map_mesh(args):
+    from drugstance_core.mesh import load_mesh
+
+    mesh_headings, mesh_numbers = load_mesh(args.input, cache=not args.no_cache)
+    dump(mesh_headings, os.path.join(args.output, 'mesh_headings.pkl'))
+    dump(mesh_numbers, os.path.join(args.output, 'mesh_numbers.pkl'))
+
+
+'''
+Build the graph of the drugs' MeSH headings with the IA of every node, like slurm_pipeline/makeGraph.py. Writes the graph artifact chembl.graph and the sorted drug list.
+'''
+def cmd_build_graph(args):
+    from drugstance_core.graphfile import write_graph
+    from drugstance_core.ia import compute_ia
+    from drugstance_core.indications import load_indications
+    from drugstance_core.tree import MeshTree, build_graph
+
+    if args.mesh is not None:
+        from drugstance_core.mesh import load_mesh
+        mesh_headings, mesh_numbers = load_mesh(args.mesh)
+    else:
+        mesh_headings, mesh_numbers = load(args.headings), load(args.numbers)
+
+    indications = load_indications(args.input)
+    drugs = indications.drugs
+    drug_headings = {drug: indications.headings_of(drug.upper()) for drug in drugs}
+
+    G, drug_node_dict = build_graph(drugs, drug_headings, MeshTree(mesh_headings, mesh_numbers))
+    G = compute_ia(G)
+
+    write_graph(os.path.join(args.output, 'chembl.graph'), G, drug_node_dict, drugs, mesh=args.mesh, chembl=args.input)
+    with open(os.path.join(args.output, 'drugs'), 'w') as f:
+        f.writelines(f'{drug}\n' for drug in drugs)
+
+
+'''
+Read a drug list, one drug per line.
+'''
+def read_drugs(path):
+    with open(path) as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+
+'''
+Compute a drug x drug matrix with the tile scheduler and write it to a .npy (with its sidecar) or a .tsv output.
+'''
+def write_all_pairs(engine, method, output, workers, symmetric, condensed, dtype):
+    import tempfile
+    from drugstance_core.scheduler import balanced_tile_size, run_scheduled
+    from drugstance_core.store import DTYPES, create_matrix, open_matrix, to_tsv
+
+    drugs = engine.drugs
+    n = len(drugs)
+    layout = 'condensed' if condensed else 'symmetric' if symmetric else 'full'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = output if output.endswith('.npy') else os.path.join(tmp, 'matrix.npy')
+        create_matrix(path, drugs, 'condensed' if condensed else 'full', DTYPES[dtype], engine.diagonal())
+        run_scheduled([(engine, method, path)], n, balanced_tile_size(n, n, workers), layout, workers)
+        if path != output:
+            to_tsv(open_matrix(path), output)
+
+
+'''
+Compute the semantic distance matrix from the graph written by build-graph.
+'''
+def cmd_distances(args):
+    from drugstance_core.graphfile import load_graph
+    from drugstance_core.semantic import SemanticIndex
+
+    graph = load_graph(args.graph)
+    index = SemanticIndex.from_graph_file(graph, read_drugs(args.drugs) if args.drugs is not None else None)
+    write_all_pairs(index, 'distances', args.output, args.num_cpus, args.symmetric, args.condensed, args.dtype)
+
+
+'''
+Compute the overlap coefficient matrix from the indications.
+'''
+def cmd_overlaps(args):
+    from drugstance_core.indications import load_indications
+    from drugstance_core.overlap import OverlapIndex
+
+    indications = load_indications(args.chembl)
+    drugs = read_drugs(args.drugs) if args.drugs is not None else indications.drugs
+    index = OverlapIndex.from_indications(drugs, indications)
+    write_all_pairs(index, 'overlaps', args.output, args.num_cpus, args.symmetric, args.condensed, args.dtype)
+
+
+'''
+Transform a distance matrix with a kernel block by block, like downstream_transformations/rbfKernel.py.
+'''
+def cmd_kernel(args):
+    from drugstance_core.kernels import transform
+    from drugstance_core.store import DTYPES, open_rows, write_rows
+
+    source = open_rows(args.input)
+    write_rows(args.output, source.labels, transform(source, args.kernel, args.gamma, args.block_size), DTYPES[args.dtype])
+
+
+'''
+Average similarity matrices as distances (1 - similarity) block by block, like downstream_transformations/avgKernels.py.
+'''
+def cmd_average(args):
+    from drugstance_core.average import average_rows, open_aligned
+    from drugstance_core.store import DTYPES, write_rows
+
+    with open_aligned(args.input) as (labels, aligned):
+        write_rows(args.output, labels, average_rows(labels, aligned, args.weights, args.block_size, lambda X: 1 - X), DTYPES[args.dtype])
+
+
+'''
+Find the drug pairs that are likely similar with MinHash/LSH, score only those exactly and write them as a sparse pair list.
+'''
+def cmd_pairs(args):
+    from drugstance_core.lsh import PairFinder, write_pairs
+    from drugstance_core.instrument import configure, stage
+
+    configure(args.events, command='pairs')
+    if args.graph is not None:
+        finder = PairFinder.from_graph_file(args.graph, args.chembl, args.num_perm, args.seed)
+    else:
+        finder = PairFinder.from_files(args.chembl, args.mesh, args.num_perm, args.seed)
+
+    with stage('pairs', drugs=len(finder.drugs)) as info:
+        i, j, distances, overlaps = finder.pairs(args.metric, args.threshold, args.recall, args.bands, args.rows, args.max_distance, args.min_overlap)
+        info['pairs'] = len(i)
+    write_pairs(args.output, finder.drugs, i, j, distances, overlaps)
+
+
+'''
+Add the options of the all-pairs commands.
+'''
+def add_all_pairs_args(parser):
+    parser.add_argument('-d', '--drugs', help='A file with the drugs to compare, one per line. Default is every drug, sorted.', type=str, required=False)
+    parser.add_argument('-o', '--output', help='The output matrix. A .npy output is a binary matrix with a .json sidecar, a .tsv output a TSV matrix.', type=str, required=True)
+    parser.add_argument('-n', '--num-cpus', help='The number of worker processes. Default is 1.', default=1, type=int, required=False)
+    parser.add_argument('-s', '--symmetric', help='Only evaluate each unordered pair of drugs once and mirror the result.', action='store_true', required=False)
+    parser.add_argument('--condensed', help='Write only the upper triangle as a condensed .npy matrix.', action='store_true', required=False)
+    parser.add_argument('-t', '--dtype', help='The dtype of a binary output.', choices=DTYPE_NAMES, default='float64', required=False)
+
+
+'''
+Parse arguments.
+'''
+def parseArgs():
+    parser = argparse.ArgumentParser(prog='python3 -m drugstance_core', description='Compute the semantic distance and overlap between drugs in ChEMBL using the MeSH headings of their indications, and transform and average the matrices.')
+    commands = parser.add_subparsers(dest='command', metavar='command', required=True)
+
+    command = commands.add_parser('map-mesh', help='Map MeSH headings to their tree numbers and back.', description='Map MeSH headings to their tree numbers and visa-versa. Write mesh_headings.pkl and mesh_numbers.pkl.')
+    command.add_argument('-i', '--input', help='The MeSH database in ASCII format.', type=str, required=True)
+    command.add_argument('-o', '--output', help='Output directory.', default='.', type=str, required=False)
+    command.add_argument('--no-cache', help='Always re-parse the MeSH file instead of using the parse cache next to it.', action='store_true', required=False)
+    command.set_defaults(run=cmd_map_mesh)
+
+    command = commands.add_parser('build-graph', help='Build the graph of the drugs\' MeSH headings.', description='Build the graph of the MeSH headings of every drug and compute the IA of its nodes. Write the graph artifact (chembl.graph) and the sorted drug list (drugs).')
+    command.add_argument('-i', '--input', help='A TSV of drugs (pref_name) and their indications (mesh_heading).', type=str, required=True)
+    command.add_argument('-m', '--mesh', help='The MeSH database in ASCII format.', type=str, required=False)
+    command.add_argument('--headings', help='mesh_headings.pkl written by map-mesh, instead of --mesh.', type=str, required=False)
+    command.add_argument('--numbers', help='mesh_numbers.pkl written by map-mesh, instead of --mesh.', type=str, required=False)
+    command.add_argument('-o', '--output', help='Output directory.', default='.', type=str, required=False)
+    command.set_defaults(run=cmd_build_graph)
+
+    command = commands.add_parser('distances', help='Compute the semantic distance matrix.', description='Compute the semantic distance between all drugs from the graph written by build-graph.')
+    command.add_argument('-g', '--graph', help='The graph artifact written by build-graph (chembl.graph).', type=str, required=True)
+    add_all_pairs_args(command)
+    command.set_defaults(run=cmd_distances)
+
+    command = commands.add_parser('overlaps', help='Compute the overlap coefficient matrix.', description='Compute the overlap coefficient of the indications of all drugs.')
+    command.add_argument('-c', '--chembl', help='A TSV of drugs (pref_name) and their indications (mesh_heading).', type=str, required=True)
+    add_all_pairs_args(command)
+    command.set_defaults(run=cmd_overlaps)
+
+    command = commands.add_parser('kernel', help='Transform a distance matrix with a kernel.', description='Transform a distance matrix (TSV or .npy) with a kernel, row block by row block.')
+    command.add_argument('-i', '--input', help='A distance matrix, TSV or .npy.', type=str, required=True)
+    command.add_argument('-o', '--output', help='The kernel matrix, .tsv or .npy.', type=str, required=True)
+    command.add_argument('-k', '--kernel', help='rbf treats every row as a feature vector like sklearn\'s rbf_kernel, gaussian is exp(-gamma * d^2) and laplacian exp(-gamma * |d|) of every distance d. Default is rbf.', choices=KERNEL_NAMES, default='rbf', required=False)
+    command.add_argument('-g', '--gamma', help='The gamma of the kernel. Default is 10.', default=10.0, type=float, required=False)
+    command.add_argument('-b', '--block-size', help='The number of rows held in memory at once. Default is 1024.', default=1024, type=int, required=False)
+    command.add_argument('-t', '--dtype', help='The dtype of a binary output.', choices=DTYPE_NAMES, default='float64', required=False)
+    command.set_defaults(run=cmd_kernel)
+
+    command = commands.add_parser('average', help='Average similarity matrices as distances.', description='Average similarity matrices (TSV or .npy, 1 is equivalence) as distances, after aligning them by their drug labels.')
+    command.add_argument('-i', '--input', help='The similarity matrices.', nargs='+', type=str, required=True)
+    command.add_argument('-o', '--output', help='The average distance matrix, .tsv or .npy.', type=str, required=True)
+    command.add_argument('-w', '--weights', help='A weight per input. Default is equal weights.', nargs='+', type=float, required=False)
+    command.add_argument('-b', '--block-size', help='The number of rows held in memory at once. Default is 1024.', default=1024, type=int, required=False)
+    command.add_argument('-t', '--dtype', help='The dtype of a binary output.', choices=DTYPE_NAMES, default='float64', required=False)
+    command.set_defaults(run=cmd_average)
+
+    command = commands.add_parser('pairs', help='Find the similar drug pairs approximately.', description='Find the drug pairs that are likely similar with MinHash signatures and LSH banding, without comparing every pair, and write their exact semantic distance and overlap as a sparse pair list.')
+    command.add_argument('-c', '--chembl', help='A TSV of drugs (pref_name) and their indications (mesh_heading). Needed for overlaps.', type=str, required=False)
+    command.add_argument('-m', '--mesh', help='The MeSH database in ASCII format. Used with --chembl to build the graph.', type=str, required=False)
+    command.add_argument('-g', '--graph', help='The graph artifact written by build-graph (chembl.graph), instead of --mesh.', type=str, required=False)
+    command.add_argument('-o', '--output', help='The pair list, a .tsv or a .npz.', type=str, required=True)
+    command.add_argument('--metric', help='The sets whose signatures generate candidates: the drug graphs (semantic) and/or the indications (overlap). Default is both.', nargs='+', choices=METRIC_NAMES, default=list(METRIC_NAMES), required=False)
+    command.add_argument('--threshold', help='The Jaccard similarity of the sets above which pairs should become candidates. Default is 0.5.', default=0.5, type=float, required=False)
+    command.add_argument('--recall', help='The weight of missed pairs against extra candidates (0 to 1) when choosing the bands. Higher finds more pairs and is slower. Default is 0.5.', default=0.5, type=float, required=False)
+    command.add_argument('--num-perm', help='The length of the MinHash signatures. Default is 128.', default=128, type=int, required=False)
+    command.add_argument('--bands', help='The number of LSH bands, instead of choosing them from --threshold. Needs --rows.', type=int, required=False)
+    command.add_argument('--rows', help='The number of signature positions per band. Needs --bands.', type=int, required=False)
+    command.add_argument('--max-distance', help='Only keep candidates with at most this semantic distance (or passing --min-overlap).', type=float, required=False)
+    command.add_argument('--min-overlap', help='Only keep candidates with at least this overlap (or passing --max-distance).', type=float, required=False)
+    command.add_argument('--seed', help='The seed of the MinHash functions. Default is 1.', default=1, type=int, required=False)
+    command.add_argument('-e', '--events', help='Write JSON run events to this file (- for stderr).', type=str, required=False)
+    command.set_defaults(run=cmd_pairs)
+
+    args = parser.parse_args()
+    if args.command == 'pairs':
+        if args.graph is None and (args.chembl is None or args.mesh is None):
+            parser.error('pairs needs --chembl and --mesh, or --graph')
+        if (args.bands is None) != (args.rows is None):
+            parser.error('--bands and --rows go together')
+        if 'overlap' in args.metric and args.chembl is None:
+            parser.error('overlap candidates need --chembl')
+    if args.command in ('distances', 'overlaps') and args.condensed and not args.output.endswith('.npy'):
+        parser.error('--condensed needs a .npy output')
+    if args.command == 'build-graph' and args.mesh is None and (args.headings is None or args.numbers is None):
+        parser.error('build-graph needs --mesh, or --headings and --numbers')
+    return args
+
+
+'''
+Main.
+'''
+if __name__ == '__main__':
+    args = parseArgs()
+    args.run(args)
@@ -0,0 +1,63 @@
+'''
+Streaming, weighted averaging of drug x drug matrices.
+
+The inputs are aligned once by their drug labels, to the sorted labels. Inputs already in that order are streamed row block by row block. Other inputs are read through a memory map with their rows and columns permuted, after converting a TSV to a temporary binary copy. The average is built one row block at a time, so only a few blocks are in memory whatever the number of drugs or inputs.
+'''
+
+import os
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+
+from drugstance_core.store import TsvMatrix, from_tsv, open_matrix, open_rows
+
+
+'''
+Open matrices (see store.open_rows) aligned to their sorted drug labels. Yields the labels and a list of (source, positions), where positions are the rows and columns of each source in label order, or None if the source is already in label order.
+'''
+@contextmanager
+def open_aligned(paths):
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = [open_rows(path) for path in paths]
+        labels = sorted(sources[0].labels)
+
+        aligned = []
+        for k, (path, source) in enumerate(zip(paths, sources)):
+            if set(source.labels) != set(labels) or len(source.labels) != len(labels):
+                raise ValueError(f'{path} does not hold the same drugs as {paths[0]}.')
+            if source.labels == labels:
+                aligned.append((source, None))
+                continue
+            if isinstance(source, TsvMatrix):
+                from_tsv(source.path, os.path.join(tmp, f'{k}.npy')) # random access needs a memory map
+                source = open_matrix(os.path.join(tmp, f'{k}.npy'))
+            aligned.append((source, source.positions(labels)))
+
+        yield labels, aligned
+
+
+'''
+Compute the weighted average of aligned matrices (see open_aligned) row block by row block, after applying convert to every block. Generates consecutive (start, stop, block) row blocks.
+'''
+def average_rows(labels, aligned, weights=None, block_size=1024, convert=None):
+    n = len(labels)
+    weights = np.ones(len(aligned)) if weights is None else np.asarray(weights, dtype=np.float64)
+    if len(weights) != len(aligned):
+        raise ValueError(f'Got {len(weights)} weights for {len(aligned)} matrices.')
+    if weights.sum() <= 0:
+        raise ValueError('The weights have to add up to more than 0.')
+    weights = weights / weights.sum()
+
+    streams = [source.iter_rows(block_size) if positions is None else None for source, positions in aligned]
+
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        total = np.zeros((stop - start, n))
+        for (source, positions), stream, weight in zip(aligned, streams, weights):
+            if positions is None:
+                _, _, block = next(stream)
+            else:
+                block = source.block(positions[start:stop], positions)
+            block = np.asarray(block, dtype=np.float64)
+            total += weight * (convert(block) if convert is not None else block)
+        yield start, stop, total
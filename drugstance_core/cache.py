@@ -0,0 +1,48 @@
+import hashlib
+import os
+import pickle
+
+
+'''
+Compute the SHA-256 of a file, reading it in chunks.
+'''
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+'''
+Get the path of the cache of an input file. The cache lives next to the input (or in cache_dir) and is keyed by the input's hash, so an edited input never hits a stale cache.
+'''
+def cache_path(path, kind, digest=None, cache_dir=None):
+    digest = file_digest(path) if digest is None else digest
+    directory = os.path.dirname(os.path.abspath(path)) if cache_dir is None else cache_dir
+    return os.path.join(directory, f'.{os.path.basename(path)}.{digest[:16]}.{kind}')
+
+
+'''
+Load a pickled cache, or None if it does not exist or cannot be read. A truncated or old-format pickle can fail in many ways (AttributeError, ImportError, ValueError, ...), and any of them only means the input is parsed again.
+'''
+def read_cache(path):
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+'''
+Write a pickled cache atomically. A cache that cannot be written (e.g. read-only input directory) is skipped.
+'''
+def write_cache(path, obj):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+'''
+Number of i < j pairs between n drugs, i.e. the length of a condensed (scipy-style) distance vector.
+'''
+def condensed_size(n):
+    return n * (n - 1) // 2
+
+
+'''
+Position of the pair (i, j), i < j, in a condensed vector of n drugs. Rows of the upper triangle are stored one after another.
+'''
+def condensed_index(n, i, j):
+    if i > j:
+        i, j = j, i
+    return n * i - i * (i + 1) // 2 + (j - i - 1)
+
+
+'''
+Position in a condensed vector where the upper-triangle part of row i starts.
+'''
+def row_offset(n, i):
+    return n * i - i * (i + 1) // 2
+
+
+'''
+Evaluate only the j > i part of each row i in rows (sorted drug positions), block by block. compute(rows, cols) must return the dense block of a symmetric metric.
+Yields (i, values) where values holds the metric for j = i+1 .. n-1.
+'''
+def upper_rows(compute, n, rows, block_size=256):
+    rows = np.asarray(rows, dtype=np.int64)
+    for k in range(0, len(rows), block_size):
+        block = rows[k:k + block_size]
+        start = int(block.min()) + 1 # first column any row in this block needs
+
+        if start >= n:
+            values = np.zeros((len(block), 0))
+        else:
+            values = compute(block, slice(start, n))
+
+        for r, i in enumerate(block):
+            yield int(i), values[r, i + 1 - start:]
+
+
+'''
+Compute the condensed vector for a contiguous range of rows [start, stop). Concatenating the segments of consecutive ranges gives the full condensed vector.
+'''
+def condensed_segment(compute, n, start=0, stop=None, block_size=256, dtype=np.float64):
+    stop = n if stop is None else stop
+    segment = np.empty(row_offset(n, stop) - row_offset(n, start), dtype=dtype)
+
+    base = row_offset(n, start)
+    for i, values in upper_rows(compute, n, range(start, stop), block_size):
+        offset = row_offset(n, i) - base
+        segment[offset:offset + len(values)] = values
+
+    return segment
+
+
+'''
+Mirror a condensed vector into the full symmetric n x n matrix. diagonal is a scalar or an array of the self-comparisons.
+'''
+def squareform(condensed, n, diagonal=0.0, dtype=np.float64):
+    X = np.empty((n, n), dtype=dtype)
+    iu = np.triu_indices(n, k=1)
+    X[iu] = condensed
+    X.T[iu] = condensed
+    X[np.diag_indices(n)] = diagonal
+    return X
+
+
+'''
+Get row i of the full matrix from a condensed vector without mirroring the whole matrix.
+'''
+def condensed_row(condensed, n, i, diagonal=0.0):
+    row = np.empty(n, dtype=condensed.dtype)
+    if i > 0:
+        j = np.arange(i)
+        row[:i] = condensed[n * j - j * (j + 1) // 2 + (i - j - 1)] # column i of the rows above
+    row[i] = diagonal
+    row[i + 1:] = condensed[row_offset(n, i):row_offset(n, i + 1)]
+    return row
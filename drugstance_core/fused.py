@@ -0,0 +1,112 @@
+'''
+Fused similarity engine.
+
+For every block of drug pairs the semantic distances and overlaps are computed, the semantic distances go through an elementwise kernel, and both similarities are averaged as distances (1 - similarity), like avgKernels.py over the kernel and the overlaps. The final matrix comes out of one pass, without writing and reading back the matrices in between.
+'''
+
+import numpy as np
+
+from drugstance_core.kernels import ELEMENTWISE
+from drugstance_core.overlap import OverlapIndex
+from drugstance_core.semantic import SemanticIndex
+
+
+'''
+Get a key for a block of slices, or None for blocks that are not cached.
+'''
+def block_key(rows, cols):
+    if isinstance(rows, slice) and isinstance(cols, slice):
+        return rows.start, rows.stop, cols.start, cols.stop
+    return None
+
+
+'''
+Semantic distance, kernel, overlap and average engine. Blocks are computed together and the last block is cached, so asking for several of them for the same tile computes it once.
+weights are the weights of the kernel and of the overlaps in the average.
+'''
+class FusedIndex:
+
+    def __init__(self, sd_index, o_index, kernel='gaussian', gamma=1.0, weights=(1.0, 1.0)):
+        if kernel not in ELEMENTWISE:
+            raise ValueError(f'Only elementwise kernels ({", ".join(ELEMENTWISE)}) can be fused, {kernel} needs whole rows of the matrix.')
+        weights = np.asarray(weights, dtype=np.float64)
+        if len(weights) != 2 or weights.sum() <= 0:
+            raise ValueError('Two weights that add up to more than 0 are needed, for the kernel and the overlaps.')
+
+        self.sd = sd_index
+        self.o = o_index
+        self.drugs = sd_index.drugs
+        self.kernel = kernel
+        self.gamma = gamma
+        self.weights = weights / weights.sum()
+        self.cached = (None, None)
+
+    '''
+    Compute every block for the rows and cols drugs.
+    '''
+    def blocks(self, rows=None, cols=None):
+        key = block_key(rows, cols)
+        if key is not None and self.cached[0] == key:
+            return self.cached[1]
+
+        distances = self.sd.distances(rows, cols)
+        overlaps = self.o.overlaps(rows, cols)
+        kernels = ELEMENTWISE[self.kernel](distances, self.gamma)
+        averages = self.weights[0] * (1 - kernels) + self.weights[1] * (1 - overlaps)
+
+        blocks = {'distances': distances, 'overlaps': overlaps, 'kernels': kernels, 'averages': averages}
+        self.cached = (key, blocks)
+        return blocks
+
+    '''
+    Compute the semantic distances of a block.
+    '''
+    def distances(self, rows=None, cols=None):
+        return self.blocks(rows, cols)['distances']
+
+    '''
+    Compute the overlaps of a block.
+    '''
+    def overlaps(self, rows=None, cols=None):
+        return self.blocks(rows, cols)['overlaps']
+
+    '''
+    Compute the kernel of the semantic distances of a block.
+    '''
+    def kernels(self, rows=None, cols=None):
+        return self.blocks(rows, cols)['kernels']
+
+    '''
+    Compute the weighted average distance of a block.
+    '''
+    def averages(self, rows=None, cols=None):
+        return self.blocks(rows, cols)['averages']
+
+    '''
+    Average distance of every drug with itself: the kernel of a drug with itself is 1, so only overlaps of drugs without indications count.
+    '''
+    def diagonal(self):
+        return self.weights[1] * (1 - self.o.diagonal())
+
+    '''
+    Get the settings of the engine, to rebuild it in another process (see shared.share).
+    '''
+    def params(self):
+        return {'kernel': self.kernel, 'gamma': self.gamma, 'weights': self.weights.tolist()}
+
+    '''
+    Get the arrays of both engines, to put them in shared memory (see shared.share).
+    '''
+    def arrays(self):
+        arrays = {f'sd_{key}': value for key, value in self.sd.arrays().items()}
+        arrays.update({f'o_{key}': value for key, value in self.o.arrays().items()})
+        return arrays
+
+    '''
+    Rebuild the engine on top of the arrays of another engine without copying them.
+    '''
+    @classmethod
+    def from_arrays(cls, drugs, arrays, kernel='gaussian', gamma=1.0, weights=(1.0, 1.0)):
+        sd_index = SemanticIndex.from_arrays(drugs, {key[3:]: value for key, value in arrays.items() if key.startswith('sd_')})
+        o_index = OverlapIndex.from_arrays(drugs, {key[2:]: value for key, value in arrays.items() if key.startswith('o_')})
+        return cls(sd_index, o_index, kernel, gamma, weights)
@@ -0,0 +1,311 @@
+'''
+Versioned, memory-mappable graph artifact: the IA annotated MeSH graph of the drugs and their drug -> nodes sets in one file, replacing the pickled networkx graph (chembl.gpkl) and drug_node_dict.pkl.
+
+Layout:
+    MAGIC (8 bytes) | header length (8 bytes, little endian) | JSON header | arrays, each starting on a 64 byte boundary
+The header holds the format version, the SHA-256 of the input MeSH and ChEMBL files, and the dtype, shape and offset (from the start of the arrays) of every array:
+    node_labels, drug_labels: UTF-8 labels separated by NUL bytes, nodes sorted by label
+    ia: the IA of every node
+    parent_indptr, parent_indices: CSR parent edges, the parents of node i are parent_indices[parent_indptr[i]:parent_indptr[i + 1]]
+    drug_indptr, drug_indices: CSR drug -> nodes incidence, the nodes of the graph of drug i
+Arrays are memory-mapped read-only when the file is loaded, so loading costs next to nothing and SLURM jobs on one node share the pages. Loading needs numpy and scipy only, not networkx.
+'''
+
+import argparse
+import json
+import os
+import struct
+import numpy as np
+import scipy.sparse as sp
+from functools import cached_property
+
+from drugstance_core.cache import file_digest
+
+
+MAGIC = b'DSGRAPH\n'
+VERSION = 1
+ALIGN = 64 # arrays start on cache line boundaries
+
+
+'''
+Get the smallest multiple of ALIGN that is at least size.
+'''
+def aligned(size):
+    return -(-size // ALIGN) * ALIGN
+
+
+'''
+Get the smallest integer dtype for CSR indices below bound.
+'''
+def index_dtype(bound):
+    return np.int32 if bound < 2 ** 31 else np.int64
+
+
+'''
+Encode labels as NUL separated UTF-8.
+'''
+def encode_labels(labels):
+    labels = [str(label) for label in labels]
+    if any('\0' in label for label in labels):
+        raise ValueError('Labels cannot contain NUL characters.')
+    return np.frombuffer('\0'.join(labels).encode(), dtype=np.uint8)
+
+
+'''
+Decode NUL separated UTF-8 labels.
+'''
+def decode_labels(data, count):
+    return bytes(data).decode().split('\0') if count else []
+
+
+'''
+Encode a list of sets of positions below bound as CSR (indptr, indices), every row sorted. Both arrays share the smallest dtype that fits, so scipy can use them as they are.
+'''
+def to_csr(rows, bound):
+    sizes = [len(row) for row in rows]
+    dtype = index_dtype(max(bound, sum(sizes)))
+    indptr = np.zeros(len(rows) + 1, dtype=dtype)
+    indptr[1:] = np.cumsum(sizes)
+    indices = np.fromiter((k for row in rows for k in sorted(row)), dtype=dtype, count=int(indptr[-1]))
+    return indptr, indices
+
+
+'''
+Write the artifact of an IA annotated graph and its drug_node_dict. drugs sets the order of the drugs (default: sorted). mesh and chembl are the input files, whose checksums are recorded so consumers can check the graph is current.
+'''
+def write_graph(path, G, drug_node_dict, drugs=None, mesh=None, chembl=None):
+    nodes = sorted(G.nodes)
+    node_ids = {node: i for i, node in enumerate(nodes)}
+    drugs = sorted(drug_node_dict) if drugs is None else list(drugs)
+
+    parent_indptr, parent_indices = to_csr([[node_ids[p] for p in G.predecessors(node)] for node in nodes], len(nodes))
+    drug_indptr, drug_indices = to_csr([[node_ids[n] for n in drug_node_dict[drug]] for drug in drugs], len(nodes))
+    arrays = {
+        'node_labels': encode_labels(nodes),
+        'drug_labels': encode_labels(drugs),
+        'ia': np.array([G.nodes[node]['ia'] for node in nodes], dtype=np.float64),
+        'parent_indptr': parent_indptr,
+        'parent_indices': parent_indices,
+        'drug_indptr': drug_indptr,
+        'drug_indices': drug_indices,
+    }
+
+    # offsets are counted from the start of the arrays, so the header can hold them before its own length is known
+    specs = {}
+    offset = 0
+    for name, array in arrays.items():
+        specs[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = aligned(offset + array.nbytes)
+    header = {
+        'version': VERSION,
+        'nodes': len(nodes),
+        'edges': int(len(parent_indices)),
+        'drugs': len(drugs),
+        'mesh_sha256': None if mesh is None else file_digest(mesh),
+        'chembl_sha256': None if chembl is None else file_digest(chembl),
+        'arrays': specs,
+    }
+    header = json.dumps(header).encode()
+    start = aligned(len(MAGIC) + 8 + len(header))
+
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        for name, array in arrays.items():
+            f.seek(start + specs[name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(start + offset)
+    os.replace(tmp, path)
+
+
+'''
+Read the header of an artifact and the offset of its arrays.
+'''
+def read_header(path):
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a graph artifact. Pickled graphs of older versions can be converted with python3 -m drugstance_core.graphfile.')
+        length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length))
+    if header['version'] > VERSION:
+        raise ValueError(f'{path} is a version {header["version"]} graph artifact, this version of drugstance reads up to version {VERSION}.')
+    return header, aligned(len(MAGIC) + 8 + length)
+
+
+'''
+A loaded graph artifact. The arrays are memory-mapped, labels are decoded on first use.
+'''
+class GraphFile:
+
+    def __init__(self, path, header, arrays):
+        self.path = path
+        self.header = header
+        self.version = header['version']
+        self.mesh_sha256 = header['mesh_sha256']
+        self.chembl_sha256 = header['chembl_sha256']
+        self.arrays = arrays
+        self.ia = arrays['ia']
+
+    '''
+    Node labels, sorted.
+    '''
+    @cached_property
+    def nodes(self):
+        return decode_labels(self.arrays['node_labels'], self.header['nodes'])
+
+    '''
+    Drug labels, in the order of the incidence rows.
+    '''
+    @cached_property
+    def drugs(self):
+        return decode_labels(self.arrays['drug_labels'], self.header['drugs'])
+
+    '''
+    Map node label to position.
+    '''
+    @cached_property
+    def node_ids(self):
+        return {node: i for i, node in enumerate(self.nodes)}
+
+    '''
+    Map drug label to position.
+    '''
+    @cached_property
+    def drug_ids(self):
+        return {drug: i for i, drug in enumerate(self.drugs)}
+
+    '''
+    Get the number of nodes, like networkx.
+    '''
+    def number_of_nodes(self):
+        return self.header['nodes']
+
+    '''
+    Get the number of parent edges, like networkx.
+    '''
+    def number_of_edges(self):
+        return self.header['edges']
+
+    '''
+    Get the nodes x nodes matrix of parent edges: row i has a 1 in the column of every parent of node i.
+    '''
+    def parents(self):
+        n = self.header['nodes']
+        indices = self.arrays['parent_indices']
+        return sp.csr_matrix((np.ones(len(indices)), indices, self.arrays['parent_indptr']), shape=(n, n), copy=False)
+
+    '''
+    Get the drugs x nodes incidence matrix, of every drug or of a list of drugs in their order.
+    '''
+    def incidence(self, drugs=None):
+        indices = self.arrays['drug_indices']
+        A = sp.csr_matrix((np.ones(len(indices)), indices, self.arrays['drug_indptr']), shape=(self.header['drugs'], self.header['nodes']), copy=False)
+        if drugs is None:
+            return A
+        return A[np.array([self.drug_ids[drug] for drug in drugs], dtype=np.int64)]
+
+    '''
+    Get the set of node labels of the graph of a drug.
+    '''
+    def drug_nodes(self, drug):
+        i = self.drug_ids[drug]
+        indptr = self.arrays['drug_indptr']
+        return {self.nodes[k] for k in self.arrays['drug_indices'][indptr[i]:indptr[i + 1]]}
+
+    '''
+    Get the IA of a node by its label.
+    '''
+    def node_ia(self, node):
+        return float(self.ia[self.node_ids[node]])
+
+    '''
+    Rebuild drug_node_dict, the drug -> set of node labels dict of the pickled format.
+    '''
+    def drug_node_dict(self):
+        return {drug: self.drug_nodes(drug) for drug in self.drugs}
+
+    '''
+    Rebuild the networkx graph of the pickled format, with the 'ia' and 'drugs' attributes of every node. Needs networkx.
+    '''
+    def to_networkx(self):
+        import networkx as nx
+
+        node_drugs = {node: set() for node in self.nodes}
+        for drug, nodes in self.drug_node_dict().items():
+            for node in nodes:
+                node_drugs[node].add(drug)
+
+        G = nx.DiGraph()
+        G.add_nodes_from((node, {'ia': float(self.ia[i]), 'drugs': node_drugs[node]}) for i, node in enumerate(self.nodes))
+        parents = self.parents()
+        G.add_edges_from((self.nodes[p], self.nodes[c]) for c in range(len(self.nodes)) for p in parents.indices[parents.indptr[c]:parents.indptr[c + 1]])
+        return G
+
+    '''
+    Check the graph was built from these MeSH and ChEMBL files, raising a ValueError if not. Checksums that were not recorded are not checked.
+    '''
+    def verify(self, mesh=None, chembl=None):
+        for kind, path, recorded in (('MeSH', mesh, self.mesh_sha256), ('ChEMBL', chembl, self.chembl_sha256)):
+            if path is not None and recorded is not None and file_digest(path) != recorded:
+                raise ValueError(f'{self.path} was built from another {kind} file than {path}, rebuild the graph.')
+
+
+'''
+Load a graph artifact, memory-mapping its arrays unless mmap is False. mesh and chembl are checked against the recorded checksums when given (see GraphFile.verify).
+'''
+def load_graph(path, mmap=True, mesh=None, chembl=None):
+    header, start = read_header(path)
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        shape = tuple(spec['shape'])
+        count = int(np.prod(shape))
+        if count == 0:
+            arrays[name] = np.empty(shape, dtype=dtype) # an empty file region cannot be mapped
+        elif mmap:
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=start + spec['offset'], shape=shape)
+        else:
+            with open(path, 'rb') as f:
+                f.seek(start + spec['offset'])
+                arrays[name] = np.fromfile(f, dtype=dtype, count=count).reshape(shape)
+
+    graph = GraphFile(path, header, arrays)
+    graph.verify(mesh, chembl)
+    return graph
+
+
+'''
+Parse arguments.
+'''
+def parseArgs():
+    parser = argparse.ArgumentParser(description='Convert a pickled networkx graph (chembl.gpkl) and drug_node_dict.pkl of an older version into a graph artifact, or show the header of an artifact.')
+    parser.add_argument('-g', '--graph', help='The pickled graph, or a graph artifact to show with --show.', type=str, required=True)
+    parser.add_argument('-p', '--drug-node-dict', help='The pickled drug_node_dict.', type=str, required=False)
+    parser.add_argument('-o', '--output', help='The graph artifact to write, e.g. chembl.graph.', type=str, required=False)
+    parser.add_argument('-m', '--mesh', help='The MeSH file the graph was built from, to record its checksum.', type=str, required=False)
+    parser.add_argument('-c', '--chembl', help='The indications TSV the graph was built from, to record its checksum.', type=str, required=False)
+    parser.add_argument('--show', help='Print the header of the graph artifact given with --graph.', action='store_true', required=False)
+    args = parser.parse_args()
+    if not args.show and (args.drug_node_dict is None or args.output is None):
+        parser.error('converting needs --drug-node-dict and --output')
+    return args
+
+
+'''
+Main.
+'''
+if __name__ == '__main__':
+    args = parseArgs()
+
+    if args.show:
+        header, _ = read_header(args.graph)
+        print(json.dumps({key: value for key, value in header.items() if key != 'arrays'}, indent=2))
+    else:
+        import pickle
+        with open(args.graph, 'rb') as f:
+            G = pickle.load(f)
+        with open(args.drug_node_dict, 'rb') as f:
+            drug_node_dict = pickle.load(f)
+        write_graph(args.output, G, drug_node_dict, mesh=args.mesh, chembl=args.chembl)
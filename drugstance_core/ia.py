@@ -0,0 +1,64 @@
+import math
+import networkx as nx
+import numpy as np
+
+
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64) # set bits of every byte value
+
+
+'''
+Pack the drugs of the given nodes into a len(nodes) x ceil(drugs / 8) bitset matrix. Bit j of row i is set if drug j includes node i. Rows are packed in chunks so the unpacked booleans stay small.
+'''
+def drug_bitsets(G, nodes, drug_ids, chunk_size=1024):
+    bits = np.zeros((len(nodes), (len(drug_ids) + 7) // 8), dtype=np.uint8)
+    for start in range(0, len(nodes), chunk_size):
+        chunk = nodes[start:start + chunk_size]
+        members = np.zeros((len(chunk), bits.shape[1] * 8), dtype=bool)
+        for i, node in enumerate(chunk):
+            members[i, [drug_ids[drug] for drug in G.nodes[node]['drugs']]] = True
+        bits[start:start + len(chunk)] = np.packbits(members, axis=1)
+
+    return bits
+
+
+'''
+Count the set bits of every row of a bitset matrix.
+'''
+def popcount(bits):
+    return POPCOUNT[bits].sum(axis=-1)
+
+
+'''
+Compute information accretion for each node in a graph.
+The number of drugs with any parent heading is a union count. Nodes with one parent (most of MeSH) take the parent's count directly; for nodes with several parents the parents' drugs are packed into bitsets and counted in bulk with OR + popcount.
+'''
+def compute_ia(G):
+    nodes = list(G.nodes)
+    node_ids = {node: i for i, node in enumerate(nodes)}
+    n_drugs = np.array([len(G.nodes[node]['drugs']) for node in nodes], dtype=np.int64) # the number of drugs with each heading
+    parents = [[node_ids[p] for p in G.predecessors(node)] for node in nodes]
+
+    # count the number of drugs that have any parent heading
+    n_p_drugs = np.zeros(len(nodes), dtype=np.int64)
+    single = np.array([i for i, p in enumerate(parents) if len(p) == 1], dtype=np.int64)
+    if len(single) > 0:
+        n_p_drugs[single] = n_drugs[[parents[i][0] for i in single]]
+
+    multi = [i for i, p in enumerate(parents) if len(p) > 1]
+    if multi:
+        packed = sorted(set().union(*(parents[i] for i in multi))) # only parents of multi-parent nodes need bitsets
+        rows = {node: r for r, node in enumerate(packed)}
+        drugs = set().union(*(G.nodes[nodes[p]]['drugs'] for p in packed))
+        bits = drug_bitsets(G, [nodes[p] for p in packed], {drug: j for j, drug in enumerate(drugs)})
+        for i in multi:
+            n_p_drugs[i] = popcount(np.bitwise_or.reduce(bits[[rows[p] for p in parents[i]]], axis=0))
+
+    # compute information accretion from the probability, the same way for every node as the per-node loop did
+    node_ia_dict = {}
+    for node, n, n_p in zip(nodes, n_drugs.tolist(), n_p_drugs.tolist()):
+        prob = 1 if n_p == 0 else n / n_p
+        node_ia_dict[node] = -math.log2(prob)
+
+    nx.set_node_attributes(G, node_ia_dict, 'ia')
+
+    return G
@@ -0,0 +1,194 @@
+'''
+Incremental recompute of the semantic distance and overlap matrices for a new ChEMBL release.
+
+The new indications TSV is diffed against the previous one. Drugs whose indications changed (or that are new) get their rows and columns recomputed. For every other pair the previous distance is reused: the drug graphs of both drugs are unchanged, so only nodes whose IA changed can move their distance, and
+    SD_new(i, j) = SD_old(i, j) + sum over changed nodes n in exactly one of A_i, A_j of (IA_new(n) - IA_old(n))
+which is a sparse update over the changed nodes only. Overlaps of unchanged drugs are copied as is. Both releases must use the same MeSH file.
+'''
+
+import argparse
+import os
+import numpy as np
+import scipy.sparse as sp
+
+from drugstance_core.graphfile import load_graph, write_graph
+from drugstance_core.ia import compute_ia
+from drugstance_core.indications import load_indications
+from drugstance_core.mesh import load_mesh
+from drugstance_core.overlap import OverlapIndex
+from drugstance_core.semantic import SemanticIndex
+from drugstance_core.store import create_matrix, open_matrix
+from drugstance_core.tiles import write_tile
+from drugstance_core.tree import MeshTree, build_graph
+
+
+'''
+Build the IA annotated graph and drug_node_dict of a release.
+'''
+def build_release(drugs, drug_indications, tree):
+    drug_headings = {drug: drug_indications.get(drug.upper(), set()) for drug in drugs}
+    G, drug_node_dict = build_graph(drugs, drug_headings, tree)
+    return compute_ia(G), drug_node_dict
+
+
+'''
+Find the drugs of the new release whose indications differ from the previous release, including new drugs.
+'''
+def diff_drugs(old_drugs, old_indications, new_drugs, new_indications):
+    old = set(old_drugs)
+    changed = set()
+    for drug in new_drugs:
+        # graphs look indications up by the upper-case name, overlaps by the name itself
+        if drug not in old or old_indications.get(drug, set()) != new_indications.get(drug, set()) or old_indications.get(drug.upper(), set()) != new_indications.get(drug.upper(), set()):
+            changed.add(drug)
+    return changed
+
+
+'''
+Get the IA change of every node of the new graph, given the node -> IA dict of the previous graph. Nodes that are new have no previous IA.
+'''
+def ia_changes(old_ia, G_new):
+    nodes = list(G_new.nodes)
+    dw = np.array([G_new.nodes[n]['ia'] - old_ia.get(n, 0.0) for n in nodes], dtype=np.float64)
+    return nodes, dw
+
+
+'''
+Compute the distance correction of a block of unchanged drug pairs. A_c is the incidence of the drugs restricted to the changed nodes and dw their IA change.
+'''
+def ia_correction(A_c, A_cw, r, rows, cols):
+    return r[rows][:, None] + r[cols][None, :] - 2 * (A_cw[rows] @ A_c[cols].T).toarray()
+
+
+'''
+Write one metric of the new release row block by row block. compute(rows, cols) recomputes a block, reuse(rows, cols) returns the updated previous values for unchanged drugs.
+'''
+def refresh_matrix(out, layout, n, dirty, compute, reuse, block_size):
+    clean_cols = np.flatnonzero(~dirty)
+    dirty_cols = np.flatnonzero(dirty)
+
+    for r0 in range(0, n, block_size):
+        r1 = min(r0 + block_size, n)
+        rows = np.arange(r0, r1)
+        block = np.empty((len(rows), n))
+
+        clean_rows = rows[~dirty[rows]]
+        dirty_rows = rows[dirty[rows]]
+        if len(dirty_rows) > 0:
+            block[dirty_rows - r0] = compute(dirty_rows, slice(None))
+        if len(clean_rows) > 0:
+            block[np.ix_(clean_rows - r0, clean_cols)] = reuse(clean_rows, clean_cols)
+            if len(dirty_cols) > 0:
+                block[np.ix_(clean_rows - r0, dirty_cols)] = compute(clean_rows, dirty_cols)
+
+        write_tile(out, n, block, r0, r1, 0, n, layout)
+
+    out.flush()
+
+
+'''
+Recompute the matrices of a new release, reusing the previous ones where possible. Returns a report of how much of the matrix was reused.
+'''
+def run_incremental(old_input, new_input, mesh, old_distances, old_overlaps, output, old_graph=None, block_size=1024):
+    mesh_headings, mesh_numbers = load_mesh(mesh)
+    tree = MeshTree(mesh_headings, mesh_numbers)
+
+    old, new = load_indications(old_input), load_indications(new_input)
+    old_drugs, old_indications = old.drugs, old.to_dict()
+    new_drugs, new_indications = new.drugs, new.to_dict()
+
+    # previous graph and IA values
+    if old_graph is not None:
+        graph = load_graph(old_graph, mesh=mesh) # both releases must use the same MeSH file
+        old_ia = dict(zip(graph.nodes, graph.ia.tolist()))
+    else:
+        G_old, _ = build_release(old_drugs, old_indications, tree)
+        old_ia = {n: G_old.nodes[n]['ia'] for n in G_old}
+    G_new, drug_node_dict = build_release(new_drugs, new_indications, tree)
+
+    sd_store = open_matrix(old_distances)
+    changed = diff_drugs(old_drugs, old_indications, new_drugs, new_indications)
+
+    # keep the previous order for drugs that are still there and append new drugs
+    drugs = [d for d in sd_store.labels if d in drug_node_dict] + [d for d in new_drugs if d not in sd_store.drug_ids]
+    dirty = np.array([d in changed or d not in sd_store.drug_ids for d in drugs], dtype=bool)
+    old_pos = np.array([sd_store.drug_ids.get(d, -1) for d in drugs], dtype=np.int64)
+    n = len(drugs)
+
+    # sparse IA update over the nodes whose IA changed
+    nodes, dw = ia_changes(old_ia, G_new)
+    sd_index = SemanticIndex.from_graph(drugs, drug_node_dict, G_new) # columns follow the nodes of G_new like dw
+    changed_nodes = np.flatnonzero(dw != 0)
+    A_c = sd_index.A[:, changed_nodes].tocsr()
+    A_cw = (A_c @ sp.diags(dw[changed_nodes])).tocsr()
+    r = np.asarray(A_cw.sum(axis=1)).ravel()
+    touched = np.diff(A_c.indptr) > 0 # drugs that contain a changed node
+
+    def reuse_distances(rows, cols):
+        block = sd_store.block(old_pos[rows], old_pos[cols])
+        if len(changed_nodes) > 0:
+            block = block + ia_correction(A_c, A_cw, r, rows, cols)
+            block[block < sd_index.tol] = 0.0
+        return block
+
+    layout = sd_store.layout
+    os.makedirs(output, exist_ok=True)
+    out = create_matrix(f'{output}/semantic_distances.npy', drugs, layout, sd_store.dtype, sd_index.diagonal())
+    refresh_matrix(out, layout, n, dirty, sd_index.distances, reuse_distances, block_size)
+
+    if old_overlaps is not None:
+        o_store = open_matrix(old_overlaps)
+        o_index = OverlapIndex.from_indications(drugs, new)
+
+        # drugs missing from the previous overlaps are recomputed, so their placeholder position is never read
+        o_dirty = dirty | np.array([d not in o_store.drug_ids for d in drugs], dtype=bool)
+        o_pos = np.array([o_store.drug_ids.get(d, 0) for d in drugs], dtype=np.int64)
+
+        out = create_matrix(f'{output}/overlaps.npy', drugs, o_store.layout, o_store.dtype, o_index.diagonal())
+        refresh_matrix(out, o_store.layout, n, o_dirty, o_index.overlaps, lambda rows, cols: o_store.block(o_pos[rows], o_pos[cols]), block_size)
+
+    # save the new graph so the next release can start from it
+    write_graph(f'{output}/chembl.graph', G_new, drug_node_dict, mesh=mesh, chembl=new_input)
+
+    # how much of the matrix was reused
+    n_clean = int((~dirty).sum())
+    n_touched = int((touched & ~dirty).sum())
+    total = n * n
+    report = {
+        'drugs': n,
+        'changed_drugs': int(dirty.sum()),
+        'removed_drugs': len(sd_store.labels) - int((old_pos >= 0).sum()),
+        'changed_nodes': int(len(changed_nodes)),
+        'recomputed': (total - n_clean * n_clean) / total if total else 0.0,
+        'corrected': (n_clean * n_clean - (n_clean - n_touched) ** 2) / total if total else 0.0,
+        'copied': (n_clean - n_touched) ** 2 / total if total else 0.0,
+    }
+    return report
+
+
+'''
+Parse arguments.
+'''
+def parseArgs():
+    parser = argparse.ArgumentParser(description='Update the semantic distance and overlap matrices for a new ChEMBL release, recomputing only what changed.')
+    parser.add_argument('-p', '--previous', help='The indications TSV of the previous release.', type=str, required=True)
+    parser.add_argument('-i', '--input', help='The indications TSV of the new release.', type=str, required=True)
+    parser.add_argument('-m', '--mesh', help='The MeSH data in ASCII format used for both releases.', type=str, required=True)
+    parser.add_argument('-d', '--distances', help='The semantic distance matrix (.npy) of the previous release.', type=str, required=True)
+    parser.add_argument('-v', '--overlaps', help='The overlap matrix (.npy) of the previous release.', type=str, required=False)
+    parser.add_argument('-g', '--graph', help='The graph artifact of the previous release (chembl.graph). Rebuilt from the previous TSV if not given.', type=str, required=False)
+    parser.add_argument('-o', '--output', help='Output directory for the new matrices and graph.', type=str, required=True)
+    args = parser.parse_args()
+    return args
+
+
+'''
+Main.
+'''
+if __name__ == '__main__':
+    args = parseArgs()
+
+    report = run_incremental(args.previous, args.input, args.mesh, args.distances, args.overlaps, args.output, args.graph)
+
+    print(f"{report['changed_drugs']} new or changed drugs, {report['removed_drugs']} removed, {report['changed_nodes']} nodes with a new IA value.")
+    print(f"Reused {100 * (report['copied'] + report['corrected']):.1f}% of the matrix ({100 * report['copied']:.1f}% copied, {100 * report['corrected']:.1f}% updated for IA changes), recomputed {100 * report['recomputed']:.1f}%.")
@@ -0,0 +1,15 @@
+import numpy as np
+
+
+'''
+Convert a list of drug names, a slice or an array of positions into something that can index the rows of a drug matrix. None selects every drug.
+'''
+def drug_positions(drug_ids, drugs):
+    if drugs is None:
+        return slice(None)
+    if isinstance(drugs, slice):
+        return drugs
+    drugs = list(drugs)
+    if len(drugs) > 0 and isinstance(drugs[0], str):
+        return np.array([drug_ids[d] for d in drugs], dtype=np.int64)
+    return np.asarray(drugs, dtype=np.int64)
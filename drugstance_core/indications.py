@@ -0,0 +1,105 @@
+'''
+Columnar loader of the ChEMBL indications table.
+
+Only the drug name and MeSH heading columns are read, as categoricals, so every drug and heading is one interned string and the table becomes two integer code arrays. The drug -> headings index is built from the codes in one pass as a CSR (indptr, indices), and the encoded result is cached next to the TSV, keyed by the file's hash, so repeat runs and SLURM jobs skip parsing the CSV.
+'''
+
+import numpy as np
+import scipy.sparse as sp
+
+from drugstance_core.cache import cache_path, read_cache, write_cache
+
+
+NAME = 'pref_name' # the name of the drug
+INDICATION = 'mesh_heading' # the MeSH heading
+
+
+'''
+Interned drug -> headings index. drugs and headings are sorted, the headings of drug i are headings[indices[indptr[i]:indptr[i + 1]]].
+'''
+class Indications:
+
+    def __init__(self, drugs, headings, indptr, indices, rows=0):
+        self.drugs = list(drugs)
+        self.headings = list(headings)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.rows = rows # rows of the table, with repeats and rows without a heading
+        self.drug_ids = {drug: i for i, drug in enumerate(self.drugs)}
+
+    '''
+    Encode a table with drug name and heading columns. Rows without a drug name are dropped, drugs without any heading are kept with no headings.
+    '''
+    @classmethod
+    def from_table(cls, chembl, name=NAME, indication=INDICATION):
+        drugs = chembl[name].astype('category').cat
+        headings = chembl[indication].astype('category').cat
+        drug_codes = drugs.codes.to_numpy(dtype=np.int64)
+        heading_codes = headings.codes.to_numpy(dtype=np.int64)
+
+        # one sorted pass over the unique (drug, heading) codes gives the CSR
+        n_headings = len(headings.categories)
+        keep = (drug_codes >= 0) & (heading_codes >= 0) # missing values have code -1
+        pairs = np.unique(drug_codes[keep] * n_headings + heading_codes[keep])
+        counts = np.bincount(pairs // max(n_headings, 1), minlength=len(drugs.categories))
+        indptr = np.concatenate(([0], np.cumsum(counts)))
+
+        return cls(drugs.categories.tolist(), headings.categories.tolist(), indptr, pairs % max(n_headings, 1), len(chembl))
+
+    '''
+    Get the set of headings of a drug, empty for unknown drugs.
+    '''
+    def headings_of(self, drug):
+        i = self.drug_ids.get(drug)
+        if i is None:
+            return set()
+        return {self.headings[h] for h in self.indices[self.indptr[i]:self.indptr[i + 1]]}
+
+    '''
+    Get the drug -> set of headings dict of the drugs with at least one heading, like overlap.index_indications.
+    '''
+    def to_dict(self):
+        return {drug: self.headings_of(drug) for drug, size in zip(self.drugs, np.diff(self.indptr)) if size > 0}
+
+    '''
+    Get the binary drugs x headings matrix of a list of drugs, in their order. Unknown drugs get an empty row.
+    '''
+    def incidence(self, drugs):
+        n = len(self.drugs)
+        positions = np.array([self.drug_ids.get(drug, n) for drug in drugs], dtype=np.int64) # n is an extra empty row
+        indptr = np.append(self.indptr, self.indptr[-1])
+        X = sp.csr_matrix((np.ones(len(self.indices)), self.indices, indptr), shape=(n + 1, len(self.headings)))
+        return X[positions]
+
+    '''
+    Get the state to cache, plain lists and arrays.
+    '''
+    def __getstate__(self):
+        return {'drugs': self.drugs, 'headings': self.headings, 'indptr': self.indptr, 'indices': self.indices, 'rows': self.rows}
+
+    '''
+    Rebuild the index from a cached state.
+    '''
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+'''
+Load the indications of a TSV, from the cache next to it when it exists. The cache is keyed by the file's hash and the two columns.
+'''
+def load_indications(path, name=NAME, indication=INDICATION, cache=True, cache_dir=None):
+    import pandas as pd
+
+    if cache:
+        cached = cache_path(path, f'{name}.{indication}.indcache', cache_dir=cache_dir)
+        indications = read_cache(cached)
+        if indications is not None:
+            return indications
+
+    chembl = pd.read_csv(path, sep='\t', usecols=[name, indication], dtype='category')
+    indications = Indications.from_table(chembl, name, indication)
+
+    if cache:
+        write_cache(cached, indications)
+
+    return indications
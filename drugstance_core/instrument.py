@@ -0,0 +1,160 @@
+'''
+Machine-readable run instrumentation.
+
+Events are JSON objects written one per line, for example:
+    {"time": 1700000000.0, "event": "stage_stop", "pid": 4242, "stage": "makeGraph", "wall_seconds": 12.4, "cpu_seconds": 12.1, "peak_rss_mb": 812.3, "nodes": 9120, "edges": 11873}
+Event types:
+    stage_start, stage_stop: a stage of the run, with its wall and CPU time (worker processes included once they exit), the peak RSS, and the fields the stage adds (graph size, pairs and pairs_per_second, ...)
+    progress: periodic progress of a long loop, with its rate and ETA
+    workers: the throughput of every worker process of a pool
+    profile: the hottest functions of a cProfile run
+Nothing is written until configure() is called, so instrumented code costs next to nothing by default.
+'''
+
+import os
+import sys
+import json
+import time
+import cProfile
+import pstats
+import resource
+from contextlib import contextmanager
+
+
+_sink = None # file the events are written to, None while disabled
+_context = {} # fields added to every event, e.g. the SLURM job and shard
+
+
+'''
+Write events to a file ('-' for stderr), appending to an existing file. context is added to every event. A path of None disables the events.
+'''
+def configure(path=None, **context):
+    global _sink
+
+    if _sink is not None and _sink is not sys.stderr:
+        _sink.close()
+    _sink = None if path is None else sys.stderr if path == '-' else open(path, 'a')
+    _context.clear()
+    _context.update({key: value for key, value in context.items() if value is not None})
+
+
+'''
+Check whether events are written.
+'''
+def enabled():
+    return _sink is not None
+
+
+'''
+Write one event.
+'''
+def emit(event, **fields):
+    if _sink is None:
+        return
+    record = {'time': round(time.time(), 3), 'event': event, 'pid': os.getpid()}
+    record.update(_context)
+    record.update(fields)
+    _sink.write(json.dumps(record, default=str) + '\n')
+    _sink.flush()
+
+
+'''
+Get the peak resident set size of this process and of its finished child processes, in MB.
+'''
+def peak_rss_mb():
+    scale = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10 # ru_maxrss is in bytes on macOS, KB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(own, 1), round(children, 1)
+
+
+'''
+Get the CPU time of this process and of its finished child processes.
+'''
+def cpu_seconds():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+'''
+Emit stage_start and stage_stop events around a block. The block adds fields to the stop event through the yielded dict, e.g. the graph size or the number of pairs, from which the throughput is added.
+'''
+@contextmanager
+def stage(name, **fields):
+    info = dict(fields)
+    emit('stage_start', stage=name, **fields)
+    wall = time.perf_counter()
+    cpu = cpu_seconds()
+    try:
+        yield info
+    except BaseException as e:
+        info['error'] = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        wall = time.perf_counter() - wall
+        rss, children_rss = peak_rss_mb()
+        stop = {'stage': name, 'wall_seconds': round(wall, 3), 'cpu_seconds': round(cpu_seconds() - cpu, 3), 'peak_rss_mb': rss}
+        if children_rss:
+            stop['peak_rss_children_mb'] = children_rss
+        stop.update(info)
+        if 'pairs' in info and wall > 0:
+            stop['pairs_per_second'] = round(info['pairs'] / wall)
+        emit('stage_stop', **stop)
+
+
+'''
+Progress of a long loop. update(done) emits a progress event with the rate and ETA at most every interval seconds, and always once the loop is done. done starts at what a resumed run already has, which does not count towards the rate.
+'''
+class Progress:
+
+    def __init__(self, stage, total, unit='pairs', interval=30.0, done=0):
+        self.stage = stage
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.initial = done
+        self.start = time.perf_counter()
+        self.last = self.start
+
+    '''
+    Report that done units are finished. fields are added to the event.
+    '''
+    def update(self, done, **fields):
+        if _sink is None:
+            return
+        now = time.perf_counter()
+        if done < self.total and now - self.last < self.interval:
+            return
+        self.last = now
+
+        elapsed = now - self.start
+        rate = (done - self.initial) / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - done) / rate if rate > 0 else None
+        emit('progress', stage=self.stage, done=done, total=self.total, unit=self.unit,
+            percent=round(100 * done / self.total, 1) if self.total else 100.0,
+            per_second=round(rate, 1), elapsed_seconds=round(elapsed, 1),
+            eta_seconds=None if eta is None else round(eta, 1), **fields)
+
+
+'''
+Profile a block with cProfile when path is set. The stats are dumped to path (read them with pstats or snakeviz) and the top functions by cumulative time are emitted as a profile event. Only this process is profiled, not pool workers.
+'''
+@contextmanager
+def profiled(path=None, top=25):
+    if path is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        stats = pstats.Stats(profiler).stats
+        hottest = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+        emit('profile', path=path, functions=[
+            {'function': f'{file}:{line}({name})', 'calls': calls, 'own_seconds': round(own, 4), 'cumulative_seconds': round(cumulative, 4)}
+            for (file, line, name), (_, calls, own, cumulative, _) in hottest
+        ])
@@ -0,0 +1,129 @@
+'''
+Streaming kernel transforms of drug x drug distance matrices.
+
+Matrices are read and written in row blocks, so only a few blocks are in memory at once. Kernels:
+    gaussian: exp(-gamma * d^2) of every distance d
+    laplacian: exp(-gamma * |d|) of every distance d
+    rbf: sklearn's rbf_kernel(X, gamma), which treats every row of the matrix as a feature vector: exp(-gamma * ||x_i - x_j||^2)
+Every kernel is exp(-gamma * E) for a matrix E that does not depend on gamma, so a sweep over several gammas reads the matrix once. The elementwise kernels take one pass over the matrix. rbf needs every row for every output block, so it compares row blocks against all row blocks of a memory-mapped copy.
+'''
+
+import os
+import tempfile
+import numpy as np
+
+from drugstance_core.store import TsvMatrix, from_tsv, open_matrix
+
+
+KERNELS = ('rbf', 'gaussian', 'laplacian')
+
+
+'''
+Gaussian kernel of a block of distances.
+'''
+def gaussian(D, gamma):
+    return np.exp(-gamma * np.square(D))
+
+
+'''
+Laplacian kernel of a block of distances.
+'''
+def laplacian(D, gamma):
+    return np.exp(-gamma * np.abs(D))
+
+
+ELEMENTWISE = {'gaussian': gaussian, 'laplacian': laplacian}
+
+
+'''
+Get the squared Euclidean norm of every row of a matrix.
+'''
+def row_norms(source, block_size=1024):
+    norms = np.zeros(source.n)
+    for start, stop, block in source.iter_rows(block_size):
+        norms[start:stop] = np.einsum('ij,ij->i', block, block)
+    return norms
+
+
+'''
+Get the squared distances of the rows of a matrix as row vectors, row block by row block. They come from ||x_i||^2 + ||x_j||^2 - 2 x_i.x_j, clipped at 0 with 0 on the diagonal, like sklearn's euclidean_distances.
+'''
+def row_sq_distances(source, block_size=1024):
+    norms = row_norms(source, block_size)
+    for start, stop, rows in source.iter_rows(block_size):
+        d2 = np.empty((stop - start, source.n))
+        for c0, c1, cols in source.iter_rows(block_size):
+            d2[:, c0:c1] = norms[start:stop, None] + norms[None, c0:c1] - 2 * (rows @ cols.T)
+        np.maximum(d2, 0, out=d2)
+        d2[np.arange(stop - start), np.arange(start, stop)] = 0.0
+        yield start, stop, d2
+
+
+'''
+Generate the row blocks E of a matrix (see store.open_rows) such that the kernel is exp(-gamma * E): the part of every kernel that does not depend on gamma.
+'''
+def exponents(source, kernel='rbf', block_size=1024):
+    if kernel == 'gaussian':
+        for start, stop, D in source.iter_rows(block_size):
+            yield start, stop, np.square(np.asarray(D, dtype=np.float64))
+    elif kernel == 'laplacian':
+        for start, stop, D in source.iter_rows(block_size):
+            yield start, stop, np.abs(np.asarray(D, dtype=np.float64))
+    elif kernel == 'rbf':
+        if isinstance(source, TsvMatrix):
+            # rbf reads every row block once per output block, parse the TSV only once
+            with tempfile.TemporaryDirectory() as tmp:
+                from_tsv(source.path, os.path.join(tmp, 'matrix.npy'))
+                yield from row_sq_distances(open_matrix(os.path.join(tmp, 'matrix.npy')), block_size)
+        else:
+            yield from row_sq_distances(source, block_size)
+    else:
+        raise ValueError(f'Unknown kernel: {kernel}')
+
+
+'''
+Transform a matrix (see store.open_rows) with a kernel for several gammas at once, reading every block of the matrix once. Generates (start, stop, blocks) with one kernel block per gamma.
+'''
+def sweep(source, kernel='rbf', gammas=(1.0,), block_size=1024):
+    for start, stop, E in exponents(source, kernel, block_size):
+        yield start, stop, [np.exp(-gamma * E) for gamma in gammas]
+
+
+'''
+Transform a matrix (see store.open_rows) with a kernel. Generates consecutive (start, stop, block) row blocks of the kernel matrix.
+'''
+def transform(source, kernel='rbf', gamma=1.0, block_size=1024):
+    for start, stop, (K,) in sweep(source, kernel, [gamma], block_size):
+        yield start, stop, K
+
+
+'''
+Summary statistics of a kernel matrix, accumulated row block by row block.
+    mean_off_diagonal: the mean similarity of two different drugs
+    effective_rank: trace(K)^2 / sum(K^2), which is N^2 / sum(K^2) for a kernel with a unit diagonal. It is N when drugs are only similar to themselves and 1 when all drugs are equivalent.
+'''
+class KernelStats:
+
+    def __init__(self, n):
+        self.n = n
+        self.total = 0.0
+        self.squares = 0.0
+        self.trace = 0.0
+
+    '''
+    Add a row block of the kernel.
+    '''
+    def add(self, start, stop, K):
+        self.total += float(K.sum())
+        self.squares += float(np.einsum('ij,ij->', K, K))
+        self.trace += float(K[np.arange(stop - start), np.arange(start, stop)].sum())
+
+    '''
+    Get the statistics as a dict.
+    '''
+    def summary(self):
+        pairs = self.n * self.n - self.n
+        return {
+            'mean_off_diagonal': (self.total - self.trace) / pairs if pairs else float('nan'),
+            'effective_rank': self.trace ** 2 / self.squares if self.squares else float('nan'),
+        }
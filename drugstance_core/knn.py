@@ -0,0 +1,189 @@
+'''
+Top-k nearest drug queries that never materialize the full drug x drug matrix.
+
+Semantic distance: with W the total IA of every drug graph, SD(q, j) = W_q + W_j - 2 * w(A_q & A_j). The node -> drugs inverted index gives the shared IA of the query with every drug that shares a node with it, so only those drugs cost any sparse work. Every other drug has the closed form SD = W_q + W_j, and the nearest of them are simply the drugs with the smallest W.
+Overlap: drugs that share no heading with the query have an overlap of 0, so candidates come from the heading -> drugs inverted index.
+'''
+
+import argparse
+import sys
+import numpy as np
+
+from drugstance_core.graphfile import load_graph
+from drugstance_core.ia import compute_ia
+from drugstance_core.indications import load_indications
+from drugstance_core.mesh import load_mesh
+from drugstance_core.overlap import OverlapIndex
+from drugstance_core.semantic import SemanticIndex
+from drugstance_core.tree import MeshTree, build_graph
+
+
+NAME = 'pref_name' # the name of the drug
+INDICATION = 'mesh_heading' # the MeSH heading
+METRICS = ('semantic', 'overlap')
+
+
+'''
+Nearest-neighbour index over the semantic distance and overlap engines.
+'''
+class NeighbourIndex:
+
+    def __init__(self, sd_index, o_index=None):
+        self.sd = sd_index
+        self.o = o_index
+        self.drugs = sd_index.drugs
+        self.drug_ids = sd_index.drug_ids
+
+        # drugs sorted by the total IA of their graph, the nearest first among drugs that share no node with a query
+        self.order = np.argsort(sd_index.row_w, kind='stable')
+        self.nodes_csc = sd_index.A.tocsc() # node -> drugs inverted index
+
+        if o_index is not None:
+            self.o_positions = np.array([o_index.drug_ids[d] for d in self.drugs], dtype=np.int64) # overlap rows in our drug order
+            self.o_drugs = np.full(len(o_index.drugs), -1, dtype=np.int64)
+            self.o_drugs[self.o_positions] = np.arange(len(self.drugs))
+            self.headings_csc = o_index.B.tocsc() # heading -> drugs inverted index
+
+    '''
+    Build the index from an indications TSV and the MeSH file.
+    '''
+    @classmethod
+    def from_files(cls, chembl_path, mesh_path):
+        indications = load_indications(chembl_path, NAME, INDICATION) # interned and sorted like every other loader
+        drugs = indications.drugs
+
+        mesh_headings, mesh_numbers = load_mesh(mesh_path)
+        drug_headings = {drug: indications.headings_of(drug.upper()) for drug in drugs}
+        G, drug_node_dict = build_graph(drugs, drug_headings, MeshTree(mesh_headings, mesh_numbers))
+        G = compute_ia(G)
+
+        return cls(SemanticIndex.from_graph(drugs, drug_node_dict, G), OverlapIndex.from_indications(drugs, indications))
+
+    '''
+    Build the index from the graph artifact of the SLURM pipeline (see graphfile), and optionally the indications TSV for overlaps.
+    '''
+    @classmethod
+    def from_graph_file(cls, graph_path, chembl_path=None):
+        sd_index = SemanticIndex.from_graph_file(load_graph(graph_path))
+
+        o_index = None
+        if chembl_path is not None:
+            o_index = OverlapIndex.from_indications(sd_index.drugs, load_indications(chembl_path, NAME, INDICATION))
+
+        return cls(sd_index, o_index)
+
+    '''
+    Get the positions and exact semantic distances of the drugs that could be among the k nearest to drug q: every drug that shares a node with q, and the k + 1 drugs with the smallest W among the others.
+    '''
+    def semantic_candidates(self, q, k):
+        A, w, W = self.sd.A, self.sd.w, self.sd.row_w
+        n = len(W)
+
+        # shared IA of q with every drug through the inverted index, nodes without IA add nothing
+        nodes = A.indices[A.indptr[q]:A.indptr[q + 1]]
+        nodes = nodes[w[nodes] > 0]
+        cols = self.nodes_csc[:, nodes]
+        shared = np.bincount(cols.indices, weights=np.repeat(w[nodes], np.diff(cols.indptr)), minlength=n)
+
+        sharing = np.flatnonzero(shared)
+        scores = W[q] + W[sharing] - 2 * shared[sharing]
+        scores[scores < self.sd.tol] = 0.0
+
+        # the other drugs have SD = W_q + W_j, so the smallest W are the nearest of them (one extra in case q is among them)
+        others = np.ones(n, dtype=bool)
+        others[sharing] = False
+        others = self.order[others[self.order]][:k + 1]
+
+        return np.concatenate((sharing, others)), np.concatenate((scores, W[q] + W[others]))
+
+    '''
+    Get the k nearest drugs to drug by semantic distance (smallest first) or by overlap (largest first), as a list of (drug, score).
+    '''
+    def nearest(self, drug, k=50, metric='semantic', include_self=False):
+        q = self.drug_ids[drug]
+        if k <= 0 or len(self.drugs) <= 1:
+            return []
+
+        if metric == 'semantic':
+            candidates, scores = self.semantic_candidates(q, k)
+            order = np.lexsort((candidates, scores)) # ties by position
+        elif metric == 'overlap':
+            candidates, scores = self.overlap_candidates(q)
+            order = np.lexsort((candidates, -scores))
+        else:
+            raise ValueError(f'Unknown metric: {metric}')
+
+        results = []
+        for i in order:
+            if candidates[i] == q and not include_self:
+                continue
+            results.append((self.drugs[candidates[i]], float(scores[i])))
+            if len(results) == k:
+                break
+
+        # drugs without any shared heading have an overlap of 0
+        if metric == 'overlap' and len(results) < k:
+            seen = set(candidates.tolist())
+            for j in range(len(self.drugs)):
+                if j not in seen and (j != q or include_self):
+                    results.append((self.drugs[j], 0.0))
+                    if len(results) == k:
+                        break
+
+        return results
+
+    '''
+    Get the positions and exact overlaps of the drugs that share at least one heading with drug q.
+    '''
+    def overlap_candidates(self, q):
+        if self.o is None:
+            raise ValueError('This index was built without indications, overlaps are not available.')
+        row = self.o.B[self.o_positions[q]]
+        shared = self.headings_csc[:, row.indices].sum(axis=1).A.ravel() # intersection sizes through the inverted index
+        o_candidates = np.flatnonzero(shared)
+        scores = self.o.overlaps([self.o_positions[q]], o_candidates)[0]
+        return self.o_drugs[o_candidates], scores
+
+    '''
+    Get the k nearest drugs for every drug in drugs.
+    '''
+    def nearest_batch(self, drugs, k=50, metric='semantic', include_self=False):
+        return {drug: self.nearest(drug, k, metric, include_self) for drug in drugs}
+
+
+'''
+Parse arguments.
+'''
+def parseArgs():
+    parser = argparse.ArgumentParser(description='Find the k most similar drugs to one or more drugs without computing the full matrix.')
+    parser.add_argument('-d', '--drug', help='The drug(s) to query.', nargs='+', type=str, required=True)
+    parser.add_argument('-k', '--k', help='The number of neighbours to return. Default is 50.', default=50, type=int, required=False)
+    parser.add_argument('-t', '--metric', help='Rank by semantic distance or by overlap coefficient.', choices=METRICS, default='semantic', required=False)
+    parser.add_argument('-c', '--chembl', help='A TSV file containing ChEMBL drug indication information.', type=str, required=False)
+    parser.add_argument('-m', '--mesh', help='A file all MeSH data in ASCII format. Used with --chembl to build the graph.', type=str, required=False)
+    parser.add_argument('-g', '--graph', help='The graph artifact of ChEMBL written by makeGraph.py (chembl.graph), instead of building it.', type=str, required=False)
+    args = parser.parse_args()
+    if args.graph is None and (args.chembl is None or args.mesh is None):
+        parser.error('either --chembl and --mesh, or --graph are required')
+    return args
+
+
+'''
+Main.
+'''
+if __name__ == '__main__':
+    args = parseArgs()
+
+    if args.graph is not None:
+        index = NeighbourIndex.from_graph_file(args.graph, args.chembl)
+    else:
+        index = NeighbourIndex.from_files(args.chembl, args.mesh)
+
+    unknown = [drug for drug in args.drug if drug not in index.drug_ids]
+    if unknown:
+        sys.exit(f'Unknown drug(s): {", ".join(unknown)}')
+
+    print('Query\tRank\tDrug\tScore')
+    for drug, neighbours in index.nearest_batch(args.drug, args.k, args.metric).items():
+        for rank, (neighbour, score) in enumerate(neighbours, start=1):
+            print(f'{drug}\t{rank}\t{neighbour}\t{score}')
@@ -0,0 +1,241 @@
+'''
+Approximate all-pairs mode: MinHash signatures and LSH banding pick the drug pairs that are likely similar, and only those pairs get an exact semantic distance and overlap.
+
+Every drug is a set, its indication headings for the overlap and the nodes of its graph (the headings and all their ancestors) for the semantic distance. The MinHash signature of a set is the minimum of num_perm random hash functions over its members, and two signatures agree at one position with a probability equal to the Jaccard similarity s of the sets. Signatures are cut into b bands of r rows, and drugs whose signatures are identical in at least one band become a candidate pair, with probability
+    P(s) = 1 - (1 - s^r)^b
+an S-curve that is steepest near (1/b)^(1/r). More bands of fewer rows catch more of the similar pairs (recall) at the price of more candidates to score exactly (speed).
+Drugs with an empty set are never paired. The overlap coefficient is at least the Jaccard similarity, so pairs of very unequal sets can have a high overlap and a low Jaccard similarity: lower the threshold to catch them.
+'''
+
+import numpy as np
+
+from drugstance_core.instrument import Progress
+
+
+PRIME = (1 << 31) - 1 # modulus of the hash functions, larger than any set member
+METRICS = ('semantic', 'overlap')
+
+
+'''
+Compute the MinHash signatures of the rows of a sparse binary matrix, as an n x num_perm array. Rows without any member get PRIME at every position.
+keys gives the number hashed for every column (default: the column itself), so signatures do not depend on the column order. chunk_bytes bounds the memory of the hashed members, which are hashed a few functions at a time.
+'''
+def minhash(X, num_perm=128, seed=1, keys=None, chunk_bytes=256 * 2 ** 20):
+    X = X.tocsr()
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, PRIME, num_perm, dtype=np.int64)
+    b = rng.integers(0, PRIME, num_perm, dtype=np.int64)
+
+    signatures = np.full((X.shape[0], num_perm), PRIME, dtype=np.int64)
+    members = X.indices.astype(np.int64) if keys is None else np.asarray(keys, dtype=np.int64)[X.indices]
+    filled = np.flatnonzero(np.diff(X.indptr)) # rows of empty sets keep PRIME
+    if len(members) == 0:
+        return signatures
+
+    # the members of the filled rows are contiguous, so every row is one segment starting at its indptr
+    starts = X.indptr[filled]
+    step = max(1, chunk_bytes // (8 * len(members)))
+    for h0 in range(0, num_perm, step):
+        h1 = min(h0 + step, num_perm)
+        hashed = (a[h0:h1, None] * members[None, :] + b[h0:h1, None]) % PRIME # a * x fits into int64 as both are below 2^31
+        signatures[filled, h0:h1] = np.minimum.reduceat(hashed, starts, axis=1).T
+
+    return signatures
+
+
+'''
+Get the rank of every label in sorted order, a number for it that does not depend on the order of the labels.
+'''
+def label_ranks(labels):
+    ranks = np.empty(len(labels), dtype=np.int64)
+    ranks[sorted(range(len(labels)), key=lambda k: labels[k])] = np.arange(len(labels))
+    return ranks
+
+
+'''
+Get the probability that a pair of Jaccard similarity s becomes a candidate with b bands of r rows.
+'''
+def candidate_probability(s, bands, rows):
+    return 1 - (1 - np.asarray(s, dtype=np.float64) ** rows) ** bands
+
+
+'''
+Choose the number of bands and rows per band for a Jaccard similarity threshold. Every split of at most num_perm signature positions is scored by its area of false positives (below the threshold) and false negatives (above it), weighted by recall and 1 - recall, and the split with the smallest weighted error is returned.
+'''
+def choose_bands(threshold, num_perm=128, recall=0.5):
+    if not 0 < threshold < 1:
+        raise ValueError(f'The threshold must be between 0 and 1, got {threshold}.')
+    if not 0 <= recall <= 1:
+        raise ValueError(f'The recall weight must be between 0 and 1, got {recall}.')
+
+    below = np.linspace(0, threshold, 101)
+    above = np.linspace(threshold, 1, 101)
+    area = lambda y, x: float(np.sum((y[1:] + y[:-1]) * np.diff(x)) / 2) # trapezoid rule
+    best, best_error = None, np.inf
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            false_positives = area(candidate_probability(below, bands, rows), below)
+            false_negatives = area(1 - candidate_probability(above, bands, rows), above)
+            error = (1 - recall) * false_positives + recall * false_negatives
+            if error < best_error:
+                best, best_error = (bands, rows), error
+
+    return best
+
+
+'''
+Get every pair (i < j) of drugs in the same bucket as codes i * n + j. members holds the drugs ordered by bucket (ascending within a bucket) and sizes the size of every bucket in that order.
+'''
+def bucket_pairs(members, sizes, n):
+    ends = np.cumsum(sizes)
+    offset = np.arange(len(members)) - np.repeat(ends - sizes, sizes) # position of every drug within its bucket
+    after = np.repeat(sizes, sizes) - offset - 1 # drugs after it in the same bucket
+
+    left = np.repeat(np.arange(len(members)), after)
+    first = np.repeat(np.cumsum(after) - after, after)
+    right = left + 1 + np.arange(len(left)) - first
+
+    return members[left] * n + members[right]
+
+
+'''
+Get the candidate pairs of a signature matrix, as sorted unique codes i * n + j with i < j. A pair is a candidate when its signatures are identical in at least one of the bands of rows positions.
+'''
+def band_candidates(signatures, bands, rows):
+    n = len(signatures)
+    filled = np.flatnonzero(signatures[:, 0] != PRIME) # empty sets are never paired
+    if bands * rows > signatures.shape[1]:
+        raise ValueError(f'{bands} bands of {rows} rows need {bands * rows} signature positions, the signatures have {signatures.shape[1]}.')
+
+    codes = [np.empty(0, dtype=np.int64)]
+    meter = Progress('lsh', bands, 'bands')
+    for band in range(bands):
+        keys = np.ascontiguousarray(signatures[filled, band * rows:(band + 1) * rows])
+        keys = keys.view(np.dtype((np.void, keys.dtype.itemsize * rows))).ravel() # one key per drug for the whole band
+        _, buckets, sizes = np.unique(keys, return_inverse=True, return_counts=True)
+
+        shared = sizes[buckets.ravel()] > 1 # drugs alone in their bucket pair with nobody
+        order = np.argsort(buckets.ravel()[shared], kind='stable')
+        members = filled[shared][order]
+        codes.append(np.unique(bucket_pairs(members, sizes[sizes > 1], n)))
+        meter.update(band + 1)
+
+    return np.unique(np.concatenate(codes)) # the same pair is usually found by several bands
+
+
+'''
+Approximate pair finder over the semantic distance and overlap engines. Candidates of the semantic distance come from the MinHash signatures of the drug graphs, candidates of the overlap from those of the indication headings. Every candidate gets both exact scores.
+'''
+class PairFinder:
+
+    def __init__(self, sd_index, o_index=None, num_perm=128, seed=1):
+        self.sd = sd_index
+        self.o = o_index
+        self.drugs = sd_index.drugs
+        self.num_perm = num_perm
+        self.seed = seed
+        self.signatures = {}
+
+        if o_index is not None:
+            self.o_positions = np.array([o_index.drug_ids[d] for d in self.drugs], dtype=np.int64) # overlap rows in our drug order
+
+    '''
+    Build the finder from an indications TSV and the MeSH file (see knn.NeighbourIndex.from_files).
+    '''
+    @classmethod
+    def from_files(cls, chembl_path, mesh_path, num_perm=128, seed=1):
+        from drugstance_core.knn import NeighbourIndex
+        index = NeighbourIndex.from_files(chembl_path, mesh_path)
+        return cls(index.sd, index.o, num_perm, seed)
+
+    '''
+    Build the finder from a graph artifact, and optionally the indications TSV for overlaps (see knn.NeighbourIndex.from_graph_file).
+    '''
+    @classmethod
+    def from_graph_file(cls, graph_path, chembl_path=None, num_perm=128, seed=1):
+        from drugstance_core.knn import NeighbourIndex
+        index = NeighbourIndex.from_graph_file(graph_path, chembl_path)
+        return cls(index.sd, index.o, num_perm, seed)
+
+    '''
+    Get the MinHash signatures of the sets behind a metric, computed once.
+    '''
+    def signature(self, metric):
+        if metric not in self.signatures:
+            keys = None
+            if metric == 'semantic':
+                X = self.sd.A
+                keys = label_ranks(self.sd.nodes) # graph nodes come in set order, which changes between runs
+            elif metric == 'overlap':
+                if self.o is None:
+                    raise ValueError('This finder was built without indications, overlaps are not available.')
+                X = self.o.B[self.o_positions]
+            else:
+                raise ValueError(f'Unknown metric: {metric}')
+            self.signatures[metric] = minhash(X, self.num_perm, self.seed, keys)
+        return self.signatures[metric]
+
+    '''
+    Get the candidate pairs of one or more metrics as two arrays of positions (i < j). bands and rows default to the best split for the threshold (see choose_bands).
+    '''
+    def candidates(self, metrics=METRICS, threshold=0.5, recall=0.5, bands=None, rows=None):
+        if bands is None or rows is None:
+            bands, rows = choose_bands(threshold, self.num_perm, recall)
+
+        codes = np.empty(0, dtype=np.int64)
+        for metric in metrics:
+            codes = np.union1d(codes, band_candidates(self.signature(metric), bands, rows))
+
+        n = len(self.drugs)
+        return codes // n, codes % n
+
+    '''
+    Score a list of pairs exactly, block_size pairs at a time. Returns the semantic distance and overlap of every pair (the overlap is None without indications).
+    '''
+    def score(self, rows, cols, block_size=2 ** 18):
+        distances = np.empty(len(rows))
+        overlaps = None if self.o is None else np.empty(len(rows))
+        for start in range(0, len(rows), block_size):
+            block = slice(start, start + block_size)
+            distances[block] = self.sd.pair_distances(rows[block], cols[block])
+            if overlaps is not None:
+                overlaps[block] = self.o.pair_overlaps(self.o_positions[rows[block]], self.o_positions[cols[block]])
+        return distances, overlaps
+
+    '''
+    Find and score the candidate pairs. Without a cut-off every candidate is kept, with max_distance and/or min_overlap a candidate is kept when it passes one of them.
+    Returns the pair positions and their scores.
+    '''
+    def pairs(self, metrics=METRICS, threshold=0.5, recall=0.5, bands=None, rows=None, max_distance=None, min_overlap=None):
+        i, j = self.candidates(metrics, threshold, recall, bands, rows)
+        distances, overlaps = self.score(i, j)
+
+        if max_distance is not None or min_overlap is not None:
+            keep = np.zeros(len(i), dtype=bool)
+            if max_distance is not None:
+                keep |= distances <= max_distance
+            if min_overlap is not None and overlaps is not None:
+                keep |= overlaps >= min_overlap
+            i, j, distances = i[keep], j[keep], distances[keep]
+            overlaps = None if overlaps is None else overlaps[keep]
+
+        return i, j, distances, overlaps
+
+
+'''
+Write a sparse pair list. A .npz output holds the drug labels and the i, j, semantic_distance and overlap arrays, any other output is a TSV of drug1, drug2, semantic_distance and overlap.
+'''
+def write_pairs(path, drugs, i, j, distances, overlaps=None):
+    if path.endswith('.npz'):
+        arrays = {'drugs': np.asarray(drugs, dtype=str), 'i': i, 'j': j, 'semantic_distance': distances}
+        if overlaps is not None:
+            arrays['overlap'] = overlaps
+        np.savez(path, **arrays)
+        return
+
+    drugs = np.asarray(drugs, dtype=object)
+    with open(path, 'w') as f:
+        f.write('drug1\tdrug2\tsemantic_distance' + ('' if overlaps is None else '\toverlap') + '\n')
+        for k in range(len(i)):
+            extra = '' if overlaps is None else f'\t{overlaps[k]}'
+            f.write(f'{drugs[i[k]]}\t{drugs[j[k]]}\t{distances[k]}{extra}\n')
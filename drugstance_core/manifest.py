@@ -0,0 +1,125 @@
+'''
+Tile manifests for SLURM job arrays.
+
+A manifest lists the tiles of the drug x drug matrices and the inputs needed to compute them. Task i of the job array computes tile i and writes one .npy block per metric, then a completion marker. Tiles without a marker are missing (not run yet, failed or timed out) and can be resubmitted on their own.
+'''
+
+import json
+import os
+import numpy as np
+
+from drugstance_core.scheduler import labels_digest
+from drugstance_core.store import create_matrix, write_sidecar
+from drugstance_core.tiles import iter_tiles, write_tile
+
+
+MANIFEST_VERSION = 1
+METRICS = ('semantic_distances', 'overlaps')
+
+
+'''
+Write a manifest for the tiles of the labels x labels matrices. With symmetric only tiles on or above the diagonal are planned.
+inputs holds the paths the tasks load their data from, output the directory they write to. time_limit and mem are the SLURM time limit and memory of every task.
+'''
+def write_manifest(path, labels, tile, symmetric, inputs, output, time_limit, mem=None, metrics=METRICS):
+    n = len(labels)
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'n': n,
+        'tile': tile,
+        'symmetric': symmetric,
+        'labels': labels_digest(labels),
+        'metrics': list(metrics),
+        'inputs': inputs,
+        'output': output,
+        'time_limit': time_limit,
+        'mem': mem,
+        'tiles': [list(t) for t in iter_tiles(n, tile, symmetric)],
+    }
+    with open(path, 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+'''
+Read a manifest.
+'''
+def read_manifest(path):
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(f'{path} is a version {manifest.get("version")} manifest, expected version {MANIFEST_VERSION}.')
+    return manifest
+
+
+'''
+Get the path of the block of a metric computed by a task.
+'''
+def tile_path(manifest, metric, task):
+    return f"{manifest['output']}/{metric}_{task}.npy"
+
+
+'''
+Get the path of the completion marker of a task.
+'''
+def marker_path(manifest, task):
+    return f"{manifest['output']}/{task}.done"
+
+
+'''
+Save the blocks of a finished tile and mark it complete. Blocks are written under a temporary name and renamed, and the marker comes last, so a task killed halfway never looks complete.
+'''
+def save_tile(manifest, task, blocks, stats):
+    for metric, block in blocks.items():
+        path = tile_path(manifest, metric, task)
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, block)
+        os.replace(path + '.tmp', path)
+
+    with open(marker_path(manifest, task) + '.tmp', 'w') as f:
+        json.dump(stats, f)
+    os.replace(marker_path(manifest, task) + '.tmp', marker_path(manifest, task))
+
+
+'''
+Get the tasks whose tile is not complete.
+'''
+def missing_tiles(manifest):
+    return [task for task in range(len(manifest['tiles'])) if not os.path.exists(marker_path(manifest, task))]
+
+
+'''
+Format task ids as a compact SLURM --array list, e.g. 0-3,7,9-10.
+'''
+def array_spec(tasks):
+    ranges = []
+    for task in sorted(tasks):
+        if ranges and task == ranges[-1][1] + 1:
+            ranges[-1][1] = task
+        else:
+            ranges.append([task, task])
+    return ','.join(str(a) if a == b else f'{a}-{b}' for a, b in ranges)
+
+
+'''
+Assemble the tiles of every metric into full binary matrices (see store.create_matrix). All tiles have to be complete.
+'''
+def assemble(manifest, labels, output, dtype=np.float64):
+    if labels_digest(labels) != manifest['labels']:
+        raise ValueError('The drugs do not match the drugs the manifest was planned for.')
+    missing = missing_tiles(manifest)
+    if missing:
+        raise ValueError(f'{len(missing)} tiles are not complete: {array_spec(missing)}')
+
+    layout = 'symmetric' if manifest['symmetric'] else 'full'
+    paths = []
+    for metric in manifest['metrics']:
+        path = f'{output}/{metric}.npy'
+        out = create_matrix(path, labels, 'full', dtype)
+        for task, (r0, r1, c0, c1) in enumerate(manifest['tiles']):
+            write_tile(out, manifest['n'], np.load(tile_path(manifest, metric, task)), r0, r1, c0, c1, layout)
+        out.flush()
+        write_sidecar(path, labels, 'full', dtype, np.diagonal(out)) # the diagonal is only known once every tile is in
+        paths.append(path)
+
+    return paths
@@ -0,0 +1,95 @@
+import re
+
+from drugstance_core.cache import cache_path, read_cache, write_cache
+
+
+ROOTS = {'A' : 'Anatomy',
+        'B' : 'Organisms',
+        'C' : 'Diseases',
+        'D' : 'Chemicals and Drugs',
+        'E' : 'Analytical, Diagnostic and Therapeutic Techniques, and Equipment',
+        'F' : 'Psychiatry and Psychology',
+        'G' : 'Phenomena and Processes',
+        'H' : 'Disciplines and Occupations',
+        'I' : 'Anthropology, Education, Sociology, and Social Phenomena',
+        'J' : 'Technology, Industry, and Agriculture',
+        'K' : 'Humanities',
+        'L' : 'Information Science',
+        'M' : 'Named Groups',
+        'N' : 'Health Care',
+        'V' : 'Publication Characteristics',
+        'Z' : 'Geographicals'}
+
+RECORD = b'*NEWRECORD'
+FIELD = re.compile(rb'(MH|MN) = (.+)$') # heading and tree number fields
+
+
+'''
+Stream the MeSH ASCII file record by record and yield (heading, [tree numbers]). Only one line is held in memory at a time.
+'''
+def iter_records(meshFile):
+    heading = None
+    numbers = []
+    with open(meshFile, mode='rb') as file:
+        for line in file:
+            if line.startswith(RECORD):
+                if heading is not None:
+                    yield heading, numbers
+                heading = None
+                numbers = []
+                continue
+
+            field = FIELD.match(line)
+            if field is None:
+                continue
+            if field.group(1) == b'MH':
+                heading = field.group(2).decode()
+            else:
+                numbers.append(field.group(2).decode())
+
+    if heading is not None:
+        yield heading, numbers
+
+
+'''
+Parse the MeSH ASCII file in one streaming pass and create two dictionaries:
+    mesh_headings: (key) MeSH heading as string (value) list of MeSH tree numbers as strings
+    mesh_numbers: (key) MeSH tree number as string (value) MeSH heading as string
+The tree roots (e.g. C -> Diseases) are added to both.
+'''
+def parse_mesh(meshFile):
+    mesh_headings = {}
+    for heading, numbers in iter_records(meshFile):
+        if numbers:
+            mesh_headings.setdefault(heading, []).extend(numbers)
+
+    # add roots
+    for number, heading in ROOTS.items():
+        mesh_headings[heading] = [number]
+
+    return mesh_headings, numbers_from_headings(mesh_headings)
+
+
+'''
+Invert mesh_headings into mesh_numbers.
+'''
+def numbers_from_headings(mesh_headings):
+    return {number: heading for heading, numbers in mesh_headings.items() for number in numbers}
+
+
+'''
+Load the MeSH maps, from the parse cache next to the file when it exists. The cache is keyed by the file's hash and only stores mesh_headings, mesh_numbers is rebuilt from it.
+'''
+def load_mesh(meshFile, cache=True, cache_dir=None):
+    if not cache:
+        return parse_mesh(meshFile)
+
+    path = cache_path(meshFile, 'meshcache', cache_dir=cache_dir)
+    mesh_headings = read_cache(path)
+    if mesh_headings is not None:
+        return mesh_headings, numbers_from_headings(mesh_headings)
+
+    mesh_headings, mesh_numbers = parse_mesh(meshFile)
+    write_cache(path, mesh_headings)
+
+    return mesh_headings, mesh_numbers
@@ -0,0 +1,118 @@
+import numpy as np
+import scipy.sparse as sp
+
+from drugstance_core.indexing import drug_positions
+
+
+'''
+Build a drug -> set of indications index with one groupby over the ChEMBL table, instead of scanning the table for every drug.
+'''
+def index_indications(chembl, name='pref_name', indication='mesh_heading'):
+    chembl = chembl[[name, indication]].dropna() # rows without a heading are not indications
+    grouped = chembl.groupby(name, sort=False)[indication].unique()
+    return {drug: set(headings) for drug, headings in grouped.items()}
+
+
+'''
+Vectorized overlap coefficient engine.
+
+Drugs are encoded as a binary drugs x headings matrix B, so the intersection sizes of a block of drug pairs come from one sparse product B_rows @ B_cols.T and are divided by the pairwise minimum set sizes.
+'''
+class OverlapIndex:
+
+    def __init__(self, drugs, headings, B):
+        self.drugs = list(drugs)
+        self.headings = list(headings)
+        self.B = B.tocsr()
+        self.sizes = np.diff(self.B.indptr).astype(np.float64) # number of indications per drug
+        self.drug_ids = {drug: i for i, drug in enumerate(self.drugs)}
+
+    '''
+    Build the index from a drug -> indications dict (see index_indications).
+    '''
+    @classmethod
+    def from_dict(cls, drugs, drug_indications):
+        headings = sorted(set().union(*(drug_indications.get(d, set()) for d in drugs)))
+        heading_ids = {h: i for i, h in enumerate(headings)}
+
+        indptr = [0]
+        indices = []
+        for drug in drugs:
+            indices.extend(sorted(heading_ids[h] for h in drug_indications.get(drug, set())))
+            indptr.append(len(indices))
+
+        data = np.ones(len(indices), dtype=np.float64)
+        B = sp.csr_matrix((data, np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)), shape=(len(drugs), len(headings)))
+
+        return cls(drugs, headings, B)
+
+    '''
+    Build the index straight from the ChEMBL indications table.
+    '''
+    @classmethod
+    def from_chembl(cls, drugs, chembl, name='pref_name', indication='mesh_heading'):
+        return cls.from_dict(drugs, index_indications(chembl, name, indication))
+
+    '''
+    Build the index from the interned indications of indications.load_indications, without going through sets of strings.
+    '''
+    @classmethod
+    def from_indications(cls, drugs, indications):
+        return cls(drugs, indications.headings, indications.incidence(drugs))
+
+    '''
+    Get the arrays that define the index, to put it in shared memory (see shared.share).
+    '''
+    def arrays(self):
+        return {'indptr': self.B.indptr, 'indices': self.B.indices, 'data': self.B.data}
+
+    '''
+    Rebuild an index on top of the arrays of another index without copying them. Heading labels are not part of the arrays, headings are numbered instead.
+    '''
+    @classmethod
+    def from_arrays(cls, drugs, arrays):
+        n_headings = int(arrays['indices'].max()) + 1 if len(arrays['indices']) else 0
+        B = sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=(len(drugs), n_headings), copy=False)
+        return cls(drugs, range(n_headings), B)
+
+    '''
+    Compute the dense block of overlap coefficients between the rows and cols drugs (default: all drugs).
+    '''
+    def overlaps(self, rows=None, cols=None):
+        rows = drug_positions(self.drug_ids, rows)
+        cols = drug_positions(self.drug_ids, cols)
+
+        intersection = (self.B[rows] @ self.B[cols].T).toarray() # size of the intersection of both sets
+        min_size = np.minimum(self.sizes[rows][:, None], self.sizes[cols][None, :]) # size of the smaller set
+
+        overlap = np.zeros_like(intersection)
+        np.divide(intersection, min_size, out=overlap, where=min_size > 0) # drugs without indications overlap nothing
+
+        return overlap
+
+    '''
+    Compute the overlap coefficients of a list of drug pairs, given as two arrays of positions, without computing the block between them.
+    '''
+    def pair_overlaps(self, rows, cols):
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+
+        intersection = np.asarray(self.B[rows].multiply(self.B[cols]).sum(axis=1)).ravel()
+        min_size = np.minimum(self.sizes[rows], self.sizes[cols])
+
+        overlap = np.zeros_like(intersection)
+        np.divide(intersection, min_size, out=overlap, where=min_size > 0)
+
+        return overlap
+
+    '''
+    Compute the overlap coefficient between two drugs.
+    '''
+    def overlap(self, drug1, drug2):
+        return float(self.overlaps([drug1], [drug2])[0, 0])
+
+    '''
+    Overlap of every drug with itself: 1, or 0 for drugs without indications.
+    '''
+    def diagonal(self):
+        return (self.sizes > 0).astype(np.float64)
@@ -0,0 +1,189 @@
+'''
+Local work-stealing scheduler for all-pairs runs.
+
+The pair space is cut into many small tiles that a process pool takes one at a time, so workers that finish early keep taking tiles instead of waiting for the slowest contiguous chunk. Every worker writes its tiles straight into the memory-mapped outputs, and the parent records each finished tile in a checkpoint file, so an interrupted run resumes where it stopped.
+'''
+
+import hashlib
+import json
+import math
+import os
+import time
+import numpy as np
+from contextlib import ExitStack
+from multiprocessing import Pool
+
+from drugstance_core.instrument import Progress, emit
+from drugstance_core.shared import SharedEngine, share
+from drugstance_core.tiles import iter_tiles, write_tile
+
+
+_worker = {} # per-process state set by init_worker
+
+
+'''
+Pick a tile side that gives every worker many small tiles, so the pool stays balanced when some rows are much slower than others.
+'''
+def balanced_tile_size(n_rows, n, workers, tiles_per_worker=16, max_tile=1024):
+    cells = n_rows * n / max(1, workers * tiles_per_worker)
+    return max(1, min(max_tile, n, int(math.sqrt(cells))))
+
+
+'''
+Get a short digest of a drug list, to tell runs over different drugs apart.
+'''
+def labels_digest(labels):
+    return hashlib.sha256('\n'.join(labels).encode()).hexdigest()[:16]
+
+
+'''
+Completed tiles of a run: a JSON header describing the run, then one finished tile id per line.
+'''
+class Checkpoint:
+
+    def __init__(self, path, run):
+        self.path = path
+        self.run = run
+        self.done = set()
+
+    '''
+    Read the run description of an existing checkpoint.
+    '''
+    @staticmethod
+    def header(path):
+        with open(path) as f:
+            return json.loads(f.readline())
+
+    '''
+    Start the checkpoint. When resuming, the tiles recorded by a previous run with the same description are loaded, otherwise a new checkpoint is written.
+    '''
+    def start(self, resume=False):
+        if resume and os.path.exists(self.path):
+            with open(self.path) as f:
+                header = json.loads(f.readline())
+                if header != self.run:
+                    raise ValueError(f'{self.path} belongs to a different run and cannot be resumed.')
+                self.done = {int(line) for line in f if line.strip()}
+        else:
+            with open(self.path, 'w') as f:
+                f.write(json.dumps(self.run) + '\n')
+        return self.done
+
+    '''
+    Record a finished tile. The line is synced so a crash right after cannot lose it.
+    '''
+    def record(self, tile_id):
+        with open(self.path, 'a') as f:
+            f.write(f'{tile_id}\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.add(tile_id)
+
+
+'''
+Pool initializer: attach every metric to its engine and open its output for writing.
+metrics is a list of (engine, method, path): engine.method(rows, cols) computes a block and path is the output .npy. Engines in shared memory are attached without copying.
+'''
+def init_worker(metrics, n, layout, origin):
+    engines = {}
+    for engine, _, _ in metrics:
+        if isinstance(engine, SharedEngine) and id(engine) not in engines:
+            engines[id(engine)] = engine.attach()
+    _worker['metrics'] = [(getattr(engines.get(id(engine), engine), method), np.load(path, mmap_mode='r+')) for engine, method, path in metrics]
+    _worker['n'] = n
+    _worker['layout'] = layout
+    _worker['origin'] = origin
+
+
+'''
+Compute one tile of every metric and write it into the outputs. Once it is on disk, returns its id, the worker's pid, the seconds it took and its number of pairs.
+'''
+def compute_tile(task):
+    tile_id, (r0, r1, c0, c1) = task
+    start = time.perf_counter()
+    for compute, out in _worker['metrics']:
+        block = compute(slice(r0, r1), slice(c0, c1))
+        write_tile(out, _worker['n'], block, r0, r1, c0, c1, _worker['layout'], _worker['origin'])
+        out.flush()
+    return tile_id, os.getpid(), time.perf_counter() - start, (r1 - r0) * (c1 - c0)
+
+
+'''
+Compute the rows [start, stop) of one or more metrics over n drugs tile by tile on a pool of workers, writing into existing .npy outputs (see store.create_matrix). Tiles already recorded in the checkpoint are skipped when resuming.
+progress(done, total) is called after every finished tile. Progress events with the pair throughput and ETA, and the throughput of every worker at the end, are emitted when instrumentation is on (see instrument.configure). Returns the number of tiles computed and the total number of tiles.
+'''
+def run_scheduled(metrics, n, tile, layout='full', workers=1, checkpoint=None, resume=False, start=0, stop=None, progress=None, run=None):
+    stop = n if stop is None else stop
+    if resume and checkpoint is not None and os.path.exists(checkpoint):
+        tile = Checkpoint.header(checkpoint).get('tile', tile) # tile ids only carry over with the same tile size
+    tiles = list(iter_tiles(n, tile, layout != 'full', start, stop))
+
+    done = set()
+    if checkpoint is not None:
+        description = {'n': n, 'tile': tile, 'layout': layout, 'start': start, 'stop': stop, 'outputs': [path for _, _, path in metrics]}
+        description.update(run or {})
+        checkpoint = Checkpoint(checkpoint, description)
+        done = checkpoint.start(resume)
+
+    todo = [(i, t) for i, t in enumerate(tiles) if i not in done]
+    pairs = [(r1 - r0) * (c1 - c0) for r0, r1, c0, c1 in tiles]
+    meter = Progress('+'.join(method for _, method, _ in metrics), sum(pairs), 'pairs', done=sum(pairs[i] for i in done))
+
+    if workers <= 1:
+        init_worker(metrics, n, layout, start)
+        throughput = record_tiles(map(compute_tile, todo), checkpoint, progress, len(tiles) - len(todo), len(tiles), meter)
+    else:
+        with ExitStack() as stack:
+            # the parent puts every engine in shared memory once and the workers attach to it
+            handles = {}
+            for engine, _, _ in metrics:
+                if id(engine) not in handles:
+                    shared, handles[id(engine)] = share(engine)
+                    stack.enter_context(shared)
+            metrics = [(handles[id(engine)], method, path) for engine, method, path in metrics]
+
+            pool = stack.enter_context(Pool(workers, init_worker, (metrics, n, layout, start)))
+            throughput = record_tiles(pool.imap_unordered(compute_tile, todo, chunksize=1), checkpoint, progress, len(tiles) - len(todo), len(tiles), meter)
+
+    emit('workers', stage=meter.stage, workers=[
+        {'pid': pid, 'tiles': n_tiles, 'pairs': n_pairs, 'busy_seconds': round(seconds, 3), 'pairs_per_second': round(n_pairs / seconds) if seconds > 0 else None}
+        for pid, (n_tiles, n_pairs, seconds) in sorted(throughput.items())
+    ])
+    return len(todo), len(tiles)
+
+
+'''
+Record tiles in the checkpoint as they finish and report progress. Returns the tiles, pairs and busy seconds of every worker pid.
+'''
+def record_tiles(finished, checkpoint, progress, done, total, meter=None):
+    throughput = {}
+    pairs = meter.initial if meter is not None else 0
+    for tile_id, pid, seconds, tile_pairs in finished:
+        if checkpoint is not None:
+            checkpoint.record(tile_id)
+        done += 1
+        if progress is not None:
+            progress(done, total)
+
+        worker = throughput.setdefault(pid, [0, 0, 0.0])
+        worker[0] += 1
+        worker[1] += tile_pairs
+        worker[2] += seconds
+        pairs += tile_pairs
+        if meter is not None:
+            meter.update(pairs, tiles_done=done, tiles=total, worker_pairs_per_second={pid: round(p / s) for pid, (_, p, s) in throughput.items() if s > 0})
+    return throughput
+
+
+'''
+Get the range [start, stop) of labels covered by drugs. The drugs have to be one contiguous run of labels, like the shards split from the sorted drug list.
+'''
+def row_range(drugs, labels):
+    ids = {label: i for i, label in enumerate(labels)}
+    positions = sorted(ids[drug] for drug in drugs)
+    if not positions:
+        return 0, 0
+    start, stop = positions[0], positions[-1] + 1
+    if stop - start != len(positions):
+        raise ValueError('The drugs of a shard have to be one contiguous range of all drugs.')
+    return start, stop
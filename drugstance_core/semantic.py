@@ -0,0 +1,136 @@
+import numpy as np
+import scipy.sparse as sp
+
+from drugstance_core.indexing import drug_positions
+
+
+'''
+Encode drug_node_dict as a drugs x nodes sparse incidence matrix. Row i has a 1 in column j if node j is in the graph of drug i.
+'''
+def build_incidence(drugs, drug_node_dict, nodes):
+    node_ids = {node: i for i, node in enumerate(nodes)} # map node label to column
+
+    indptr = [0]
+    indices = []
+    for drug in drugs:
+        indices.extend(sorted(node_ids[n] for n in drug_node_dict[drug]))
+        indptr.append(len(indices))
+
+    data = np.ones(len(indices), dtype=np.float64)
+    A = sp.csr_matrix((data, np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)), shape=(len(drugs), len(nodes)))
+
+    return A
+
+
+'''
+Get the information accretion of every node in the order of nodes.
+'''
+def ia_vector(G, nodes):
+    return np.array([G.nodes[n]['ia'] for n in nodes], dtype=np.float64)
+
+
+'''
+Get the tolerance below which a semantic distance is rounding noise: sums of IA values cancel in the product.
+'''
+def distance_tol(row_w):
+    return 1e-9 * max(float(row_w.max()) if len(row_w) else 0.0, 1.0)
+
+
+'''
+All-pairs semantic distance engine.
+
+The semantic distance of two drugs is MI + RU, the summed information accretion of the nodes that are in exactly one of the two drug graphs. With A the drug x node incidence matrix and w the IA vector this is
+    SD(i, j) = wA_i + wA_j - 2 * w(A_i & A_j)
+so a whole block of the matrix comes from the weighted row sums and one weighted sparse product.
+'''
+class SemanticIndex:
+
+    def __init__(self, drugs, nodes, A, w):
+        self.drugs = list(drugs)
+        self.nodes = list(nodes)
+        self.A = A.tocsr()
+        self.w = np.asarray(w, dtype=np.float64)
+        self.Aw = sp.csr_matrix((self.A.data * self.w[self.A.indices], self.A.indices, self.A.indptr), shape=self.A.shape) # incidence weighted by IA, sharing the structure of A
+        self.row_w = np.asarray(self.Aw.sum(axis=1)).ravel() # total IA of each drug graph
+        self.drug_ids = {drug: i for i, drug in enumerate(self.drugs)}
+        self.tol = distance_tol(self.row_w)
+
+    '''
+    Build the index from drug_node_dict and an IA annotated graph.
+    '''
+    @classmethod
+    def from_graph(cls, drugs, drug_node_dict, G):
+        nodes = list(G.nodes)
+        A = build_incidence(drugs, drug_node_dict, nodes)
+        w = ia_vector(G, nodes)
+        return cls(drugs, nodes, A, w)
+
+    '''
+    Build the index from a graph artifact (see graphfile.load_graph), without networkx. Unless drugs are given, the incidence is used as it is in the artifact.
+    '''
+    @classmethod
+    def from_graph_file(cls, graph, drugs=None):
+        if drugs is None:
+            return cls(graph.drugs, graph.nodes, graph.incidence(), graph.ia)
+        return cls(drugs, graph.nodes, graph.incidence(drugs), graph.ia)
+
+    '''
+    Get the arrays that define the index, to put it in shared memory (see shared.share).
+    '''
+    def arrays(self):
+        return {'indptr': self.A.indptr, 'indices': self.A.indices, 'data': self.A.data, 'weighted': self.Aw.data, 'w': self.w, 'row_w': self.row_w}
+
+    '''
+    Rebuild an index on top of the arrays of another index without copying them. Node labels are not part of the arrays, nodes are numbered instead.
+    '''
+    @classmethod
+    def from_arrays(cls, drugs, arrays):
+        index = cls.__new__(cls)
+        index.drugs = list(drugs)
+        index.nodes = list(range(len(arrays['w'])))
+        shape = (len(index.drugs), len(index.nodes))
+        index.A = sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=shape, copy=False)
+        index.Aw = sp.csr_matrix((arrays['weighted'], arrays['indices'], arrays['indptr']), shape=shape, copy=False)
+        index.w = arrays['w']
+        index.row_w = arrays['row_w']
+        index.drug_ids = {drug: i for i, drug in enumerate(index.drugs)}
+        index.tol = distance_tol(index.row_w)
+        return index
+
+    '''
+    Compute the dense block of semantic distances between the rows and cols drugs (default: all drugs).
+    '''
+    def distances(self, rows=None, cols=None):
+        rows = drug_positions(self.drug_ids, rows)
+        cols = drug_positions(self.drug_ids, cols)
+
+        shared = (self.Aw[rows] @ self.A[cols].T).toarray() # w(A_i & A_j)
+        sd = self.row_w[rows][:, None] + self.row_w[cols][None, :] - 2 * shared
+        sd[sd < self.tol] = 0.0
+
+        return sd
+
+    '''
+    Compute the semantic distances of a list of drug pairs, given as two arrays of positions, without computing the block between them.
+    '''
+    def pair_distances(self, rows, cols):
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+
+        shared = np.asarray(self.Aw[rows].multiply(self.A[cols]).sum(axis=1)).ravel() # w(A_i & A_j) of every pair
+        sd = self.row_w[rows] + self.row_w[cols] - 2 * shared
+        sd[sd < self.tol] = 0.0
+
+        return sd
+
+    '''
+    Compute the semantic distance between two drugs.
+    '''
+    def distance(self, drug1, drug2):
+        return float(self.distances([drug1], [drug2])[0, 0])
+
+    '''
+    Semantic distance of every drug with itself, which is always 0.
+    '''
+    def diagonal(self):
+        return np.zeros(len(self.drugs))
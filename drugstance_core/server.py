@@ -0,0 +1,230 @@
+'''
+Local query service.
+
+The MeSH mapping, graph, IA values and drug indexes are loaded once and kept warm. Requests are answered concurrently over HTTP on localhost or on a Unix socket, and recently computed rows and top-k lists are kept in a bounded LRU cache. All responses are JSON:
+    /drugs                                   the drug order of /row values
+    /distance?drug1=A&drug2=B                semantic distance of a pair
+    /overlap?drug1=A&drug2=B                 overlap coefficient of a pair
+    /row?drug=A&metric=semantic|overlap      the full row of a drug
+    /topk?drug=A&k=50&metric=semantic|overlap    the k nearest drugs
+    /stats                                   the number of drugs, and the entries, bytes, hits and misses of the cache
+'''
+
+import argparse
+import json
+import os
+import socketserver
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from drugstance_core.knn import NeighbourIndex
+from drugstance_core.tiles import parse_memory
+
+
+'''
+Get the bytes a cached value counts against the byte budget: the data of numpy rows, other values (top-k lists) are small and only count as an entry.
+'''
+def cached_nbytes(value):
+    return getattr(value, 'nbytes', 0)
+
+
+'''
+Thread-safe LRU cache, bounded by the number of entries and optionally by the bytes of the cached rows.
+'''
+class LRUCache:
+
+    def __init__(self, maxsize=1024, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.items = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    '''
+    Get the cached value for key, computing and caching it on a miss. The computation runs outside the lock so other requests are not blocked.
+    '''
+    def get(self, key, compute):
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+            self.misses += 1
+
+        value = compute()
+
+        with self.lock:
+            if key in self.items:
+                self.nbytes -= cached_nbytes(self.items[key]) # computed by another request meanwhile
+            self.items[key] = value
+            self.items.move_to_end(key)
+            self.nbytes += cached_nbytes(value)
+            while len(self.items) > self.maxsize or (self.maxbytes is not None and self.nbytes > self.maxbytes and len(self.items) > 1):
+                _, dropped = self.items.popitem(last=False) # drop the least recently used
+                self.nbytes -= cached_nbytes(dropped)
+        return value
+
+
+'''
+Make a cached row read-only, so no caller can change it for the others.
+'''
+def read_only(row):
+    row.flags.writeable = False
+    return row
+
+
+'''
+Answers queries against a warm NeighbourIndex.
+'''
+class QueryService:
+
+    def __init__(self, index, cache_size=1024, cache_bytes=None):
+        self.index = index
+        self.cache = LRUCache(cache_size, cache_bytes)
+
+    '''
+    Get the full row of a drug for a metric, as a read-only numpy array shared with the cache.
+    '''
+    def row(self, drug, metric):
+        if metric == 'semantic':
+            return self.cache.get(('row', drug, metric), lambda: read_only(self.index.sd.distances([drug])[0]))
+        if metric == 'overlap':
+            return self.cache.get(('row', drug, metric), lambda: self.overlap_row(drug))
+        raise ValueError(f'Unknown metric: {metric}')
+
+    '''
+    Get the overlaps of a drug in the drug order of the semantic index.
+    '''
+    def overlap_row(self, drug):
+        if self.index.o is None:
+            raise ValueError('This service was started without indications, overlaps are not available.')
+        return read_only(self.index.o.overlaps([drug], self.index.o_positions)[0])
+
+    '''
+    Dispatch a request path and its query parameters. Returns the JSON-serializable response.
+    '''
+    def handle(self, path, params):
+        if path == '/drugs':
+            return {'drugs': self.index.drugs}
+        if path == '/stats':
+            return {'drugs': len(self.index.drugs), 'cached': len(self.cache.items), 'cached_bytes': self.cache.nbytes, 'hits': self.cache.hits, 'misses': self.cache.misses}
+        if path == '/distance':
+            drug1, drug2 = params['drug1'], params['drug2']
+            return {'drug1': drug1, 'drug2': drug2, 'semantic_distance': self.index.sd.distance(drug1, drug2)}
+        if path == '/overlap':
+            drug1, drug2 = params['drug1'], params['drug2']
+            if self.index.o is None:
+                raise ValueError('This service was started without indications, overlaps are not available.')
+            return {'drug1': drug1, 'drug2': drug2, 'overlap': self.index.o.overlap(drug1, drug2)}
+        if path == '/row':
+            drug, metric = params['drug'], params.get('metric', 'semantic')
+            return {'drug': drug, 'metric': metric, 'values': self.row(drug, metric).tolist()}
+        if path == '/topk':
+            drug, metric, k = params['drug'], params.get('metric', 'semantic'), int(params.get('k', 50))
+            neighbours = self.cache.get(('topk', drug, metric, k), lambda: self.index.nearest(drug, k, metric))
+            return {'drug': drug, 'metric': metric, 'neighbours': [{'drug': d, 'score': s} for d, s in neighbours]}
+        raise LookupError(f'Unknown endpoint: {path}')
+
+
+'''
+HTTP handler that turns service answers and errors into JSON responses.
+'''
+class QueryHandler(BaseHTTPRequestHandler):
+
+    service = None # set by make_server
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            status, body = 200, self.service.handle(url.path, params)
+        except KeyError as e:
+            status, body = 404, {'error': f'Unknown drug or missing parameter: {e.args[0]}'}
+        except LookupError as e:
+            status, body = 404, {'error': str(e)}
+        except ValueError as e:
+            status, body = 400, {'error': str(e)}
+
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else 'unix' # Unix sockets have no client address
+
+    def log_message(self, format, *args):
+        pass # keep the service quiet, errors are returned to the client
+
+
+'''
+HTTP server on a Unix socket, one thread per request.
+'''
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+'''
+Create the server for a service, on a Unix socket if socket_path is given and on host:port otherwise.
+'''
+def make_server(service, host='127.0.0.1', port=8765, socket_path=None):
+    handler = type('BoundQueryHandler', (QueryHandler,), {'service': service})
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path) # stale socket of a previous run
+        return ThreadingUnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+'''
+Parse arguments.
+'''
+def parseArgs():
+    parser = argparse.ArgumentParser(description='Serve semantic distance, overlap, row and top-k queries from a warm, in-memory index.')
+    parser.add_argument('-c', '--chembl', help='A TSV file containing ChEMBL drug indication information.', type=str, required=False)
+    parser.add_argument('-m', '--mesh', help='A file all MeSH data in ASCII format. Used with --chembl to build the graph.', type=str, required=False)
+    parser.add_argument('-g', '--graph', help='The graph artifact of ChEMBL written by makeGraph.py (chembl.graph), instead of building it.', type=str, required=False)
+    parser.add_argument('--host', help='The interface to listen on. Default is localhost only.', default='127.0.0.1', type=str, required=False)
+    parser.add_argument('--port', help='The port to listen on. Default is 8765.', default=8765, type=int, required=False)
+    parser.add_argument('--socket', help='Listen on this Unix socket instead of a TCP port.', type=str, required=False)
+    parser.add_argument('--cache-size', help='The number of rows and top-k lists to keep cached. Default is 1024.', default=1024, type=int, required=False)
+    parser.add_argument('--cache-memory', help='The memory the cached rows may use, such as 512M or 2G. Default is 256M.', default='256M', type=str, required=False)
+    args = parser.parse_args()
+    if args.graph is None and (args.chembl is None or args.mesh is None):
+        parser.error('either --chembl and --mesh, or --graph are required')
+    return args
+
+
+'''
+Main.
+'''
+if __name__ == '__main__':
+    args = parseArgs()
+
+    print('Loading index...')
+    if args.graph is not None:
+        index = NeighbourIndex.from_graph_file(args.graph, args.chembl)
+    else:
+        index = NeighbourIndex.from_files(args.chembl, args.mesh)
+
+    server = make_server(QueryService(index, args.cache_size, parse_memory(args.cache_memory)), args.host, args.port, args.socket)
+    print(f'Serving {len(index.drugs)} drugs on {args.socket or f"http://{args.host}:{args.port}"}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
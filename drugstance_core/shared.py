@@ -0,0 +1,81 @@
+'''
+Engine state in shared memory.
+
+The parent process copies the arrays that define an engine (CSR incidence, IA vector, ...) into multiprocessing.shared_memory once. Worker processes get a small picklable handle and attach to the same memory, so the engines are neither rebuilt nor copied per worker.
+'''
+
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+
+
+_attached = [] # shared memory blocks attached by this process, kept open while their arrays are in use
+
+
+'''
+Numpy arrays copied into shared memory blocks owned by this process. Use as a context manager so the blocks are freed afterwards.
+'''
+class SharedArrays:
+
+    def __init__(self, arrays):
+        self.blocks = []
+        self.spec = {} # key -> (block name, shape, dtype), enough to attach from another process
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.spec[key] = (block.name, array.shape, array.dtype.str)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    '''
+    Release and remove the blocks.
+    '''
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+'''
+Attach to arrays in shared memory from their spec (see SharedArrays). The arrays are views on the shared blocks, nothing is copied.
+'''
+def attach_arrays(spec):
+    arrays = {}
+    for key, (name, shape, dtype) in spec.items():
+        block = SharedMemory(name=name)
+        _attached.append(block)
+        arrays[key] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+    return arrays
+
+
+'''
+Picklable handle of an engine whose arrays are in shared memory. Engines implement arrays() and from_arrays(drugs, arrays, **params), and params() if they have settings besides their arrays.
+'''
+class SharedEngine:
+
+    def __init__(self, cls, drugs, spec, params=None):
+        self.cls = cls
+        self.drugs = drugs
+        self.spec = spec
+        self.params = params or {}
+
+    '''
+    Rebuild the engine on top of the shared arrays.
+    '''
+    def attach(self):
+        return self.cls.from_arrays(self.drugs, attach_arrays(self.spec), **self.params)
+
+
+'''
+Copy the arrays of an engine into shared memory. Returns the owning SharedArrays and the handle to send to workers.
+'''
+def share(engine):
+    shared = SharedArrays(engine.arrays())
+    params = engine.params() if hasattr(engine, 'params') else {}
+    return shared, SharedEngine(type(engine), engine.drugs, shared.spec, params)
@@ -0,0 +1,301 @@
+'''
+Binary drug x drug matrix store.
+
+A matrix is an .npy payload plus a JSON sidecar next to it (semantic_distances.npy -> semantic_distances.json) holding the drug labels, the layout and the diagonal. The payload is either the full n x n matrix or a scipy-style condensed vector of the i < j pairs. Readers memory-map the payload so single rows or sub-blocks are fetched without loading the file.
+'''
+
+import argparse
+import csv
+import json
+import os
+import numpy as np
+
+from drugstance_core.condensed import condensed_size, row_offset
+from drugstance_core.indexing import drug_positions
+
+
+FORMAT_VERSION = 1
+DTYPES = {'float32': np.float32, 'float64': np.float64}
+
+
+'''
+Get the path of the JSON sidecar of a matrix.
+'''
+def sidecar_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+'''
+Write the JSON sidecar of a matrix. A diagonal that is the same for every drug is stored as one number.
+'''
+def write_sidecar(path, labels, layout, dtype, diagonal):
+    diagonal = np.broadcast_to(np.asarray(diagonal, dtype=np.float64), (len(labels),))
+    if len(labels) > 0 and np.all(diagonal == diagonal[0]):
+        diagonal = float(diagonal[0])
+    else:
+        diagonal = diagonal.tolist()
+
+    meta = {'version': FORMAT_VERSION, 'layout': layout, 'dtype': np.dtype(dtype).name, 'diagonal': diagonal, 'labels': list(labels)}
+    with open(sidecar_path(path), 'w') as f:
+        json.dump(meta, f)
+
+
+'''
+Create an empty on-disk matrix for labels and return it memory-mapped for writing.
+layout is 'full' (n x n) or 'condensed' (i < j pairs only, the diagonal comes from the sidecar).
+'''
+def create_matrix(path, labels, layout='full', dtype=np.float64, diagonal=0.0):
+    n = len(labels)
+    if layout == 'full':
+        shape = (n, n)
+    elif layout == 'condensed':
+        shape = (condensed_size(n),)
+    else:
+        raise ValueError(f'Unknown layout: {layout}')
+
+    write_sidecar(path, labels, layout, dtype, diagonal)
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+
+'''
+Write an in-memory matrix (n x n, or a condensed vector with layout='condensed') to the store.
+'''
+def write_matrix(path, X, labels, layout='full', dtype=np.float64, diagonal=0.0):
+    if layout == 'full':
+        diagonal = np.diagonal(X)
+    out = create_matrix(path, labels, layout, dtype, diagonal)
+    out[:] = X
+    out.flush()
+
+
+'''
+Read-only, memory-mapped view of a stored matrix.
+'''
+class MatrixStore:
+
+    def __init__(self, path):
+        with open(sidecar_path(path)) as f:
+            meta = json.load(f)
+        if meta['version'] > FORMAT_VERSION:
+            raise ValueError(f'{path} was written by a newer version of drugstance (format {meta["version"]}).')
+
+        self.path = path
+        self.labels = meta['labels']
+        self.layout = meta['layout']
+        self.n = len(self.labels)
+        self.diagonal = np.broadcast_to(np.asarray(meta['diagonal'], dtype=np.float64), (self.n,))
+        self.data = np.load(path, mmap_mode='r')
+        self.dtype = self.data.dtype
+        self.drug_ids = {drug: i for i, drug in enumerate(self.labels)}
+
+    '''
+    Get the positions of drugs given by name, slice or position.
+    '''
+    def positions(self, drugs):
+        rows = drug_positions(self.drug_ids, drugs)
+        if isinstance(rows, slice):
+            return np.arange(self.n)[rows]
+        return rows
+
+    '''
+    Fetch the dense sub-block of rows x cols (drug names, positions or slices). Only the touched pages of the file are read.
+    '''
+    def block(self, rows=None, cols=None):
+        rows = self.positions(rows)
+        cols = self.positions(cols)
+
+        if self.layout == 'full':
+            if len(rows) > 0 and np.all(np.diff(rows) == 1):
+                rows = slice(rows[0], rows[-1] + 1) # contiguous rows are one read
+            return np.array(self.data[rows][:, cols])
+
+        # condensed: look up the upper triangle position of every pair
+        i = np.minimum(rows[:, None], cols[None, :])
+        j = np.maximum(rows[:, None], cols[None, :])
+        on_diagonal = i == j
+        index = self.n * i - i * (i + 1) // 2 + (j - i - 1)
+        index[on_diagonal] = 0
+
+        X = np.array(self.data[index.ravel()], dtype=self.dtype).reshape(index.shape) if self.n > 1 else np.zeros(index.shape, dtype=self.dtype)
+        X[on_diagonal] = np.broadcast_to(self.diagonal[rows][:, None], index.shape)[on_diagonal]
+        return X
+
+    '''
+    Fetch the full row of one drug.
+    '''
+    def row(self, drug):
+        return self.block([drug] if isinstance(drug, str) else [int(drug)])[0]
+
+    '''
+    Fetch the value for one pair of drugs.
+    '''
+    def value(self, drug1, drug2):
+        return self.block([drug1], [drug2])[0, 0]
+
+    '''
+    Iterate over (start, stop, block) of consecutive full row blocks.
+    '''
+    def iter_rows(self, block_size=1024):
+        for start in range(0, self.n, block_size):
+            stop = min(start + block_size, self.n)
+            if self.layout == 'full':
+                yield start, stop, np.array(self.data[start:stop])
+            else:
+                yield start, stop, self.block(slice(start, stop))
+
+
+'''
+Open a stored matrix for reading.
+'''
+def open_matrix(path):
+    return MatrixStore(path)
+
+
+'''
+Streaming reader of a TSV matrix with a 'Drug' header. Offers the labels and iter_rows of MatrixStore, so either can be transformed block by block.
+'''
+class TsvMatrix:
+
+    def __init__(self, path):
+        with open(path, newline='') as f:
+            header = next(csv.reader(f, delimiter='\t'))
+        self.index = header[0]
+        self.labels = header[1:]
+        self.path = path
+        self.n = len(self.labels)
+        self.drug_ids = {drug: i for i, drug in enumerate(self.labels)}
+
+    '''
+    Iterate over (start, stop, block) of consecutive row blocks. Rows have to be in the order of the header.
+    '''
+    def iter_rows(self, block_size=1024):
+        import pandas as pd # only TSV inputs need pandas, binary matrices are read without it
+
+        start = 0
+        for chunk in pd.read_csv(self.path, sep='\t', index_col=0, dtype={self.index: str}, chunksize=block_size, float_precision='round_trip'):
+            stop = start + len(chunk)
+            if list(chunk.index) != self.labels[start:stop]:
+                raise ValueError(f'The rows {start}-{stop} of {self.path} are not in the order of its header.')
+            yield start, stop, chunk.to_numpy(dtype=np.float64)
+            start = stop
+
+
+'''
+Open a matrix for reading row blocks: a stored .npy matrix or a TSV matrix.
+'''
+def open_rows(path):
+    if path.endswith('.npy'):
+        return MatrixStore(path)
+    return TsvMatrix(path)
+
+
+'''
+Writer of a labels x labels matrix that receives consecutive row blocks: a stored .npy matrix, or a TSV matrix for any other extension.
+'''
+class RowWriter:
+
+    def __init__(self, path, labels, dtype=np.float64):
+        self.path = path
+        self.labels = list(labels)
+        self.dtype = dtype
+        if path.endswith('.npy'):
+            self.out = create_matrix(path, self.labels, 'full', dtype)
+            self.diagonal = np.zeros(len(self.labels))
+        else:
+            self.file = open(path, 'w', newline='')
+            self.writer = csv.writer(self.file, delimiter='\t')
+            self.writer.writerow(['Drug'] + self.labels)
+
+    '''
+    Write the rows [start, stop).
+    '''
+    def write(self, start, stop, block):
+        if self.path.endswith('.npy'):
+            self.out[start:stop] = block
+            self.diagonal[start:stop] = block[np.arange(stop - start), np.arange(start, stop)]
+        else:
+            for drug, values in zip(self.labels[start:stop], block):
+                self.writer.writerow([drug] + values.tolist())
+
+    '''
+    Finish the matrix. A stored matrix gets its diagonal, which is only known once every row is in.
+    '''
+    def close(self):
+        if self.path.endswith('.npy'):
+            self.out.flush()
+            write_sidecar(self.path, self.labels, 'full', self.dtype, self.diagonal)
+        else:
+            self.file.close()
+
+
+'''
+Write consecutive (start, stop, block) row blocks of a labels x labels matrix as they come (see RowWriter).
+'''
+def write_rows(path, labels, blocks, dtype=np.float64):
+    writer = RowWriter(path, labels, dtype)
+    for start, stop, block in blocks:
+        writer.write(start, stop, block)
+    writer.close()
+
+
+'''
+Export a stored matrix to a TSV with a 'Drug' header, streaming row blocks.
+'''
+def to_tsv(store, path, block_size=1024):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(['Drug'] + store.labels)
+        for start, stop, block in store.iter_rows(block_size):
+            for drug, values in zip(store.labels[start:stop], block):
+                writer.writerow([drug] + values.tolist())
+
+
+'''
+Import a TSV matrix with a 'Drug' header into the store, one row at a time.
+'''
+def from_tsv(tsv, path, layout='full', dtype=np.float64):
+    with open(tsv, newline='') as f:
+        reader = csv.reader(f, delimiter='\t')
+        labels = next(reader)[1:]
+        n = len(labels)
+
+        out = create_matrix(path, labels, layout, dtype)
+        diagonal = np.zeros(n)
+
+        for i, line in enumerate(reader):
+            if line[0] != labels[i]:
+                raise ValueError(f'Row {i} of {tsv} is {line[0]} but the header expects {labels[i]}.')
+            values = np.asarray(line[1:], dtype=np.float64)
+            diagonal[i] = values[i]
+            if layout == 'full':
+                out[i] = values
+            else:
+                out[row_offset(n, i):row_offset(n, i + 1)] = values[i + 1:]
+
+    write_sidecar(path, labels, layout, dtype, diagonal) # the diagonal is only known after reading
+    out.flush()
+
+
+'''
+Parse arguments.
+'''
+def parseArgs():
+    parser = argparse.ArgumentParser(description='Convert drug x drug matrices between TSV and the binary store.')
+    parser.add_argument('-i', '--input', help='A TSV matrix with a \'Drug\' header, or a stored .npy matrix.', type=str, required=True)
+    parser.add_argument('-o', '--output', help='The output file. A .tsv output exports the stored matrix, a .npy output imports the TSV.', type=str, required=True)
+    parser.add_argument('-t', '--dtype', help='The dtype of an imported matrix.', choices=sorted(DTYPES), default='float64', required=False)
+    parser.add_argument('-c', '--condensed', help='Import only the upper triangle as a condensed vector.', action='store_true', required=False)
+    args = parser.parse_args()
+    return args
+
+
+'''
+Main.
+'''
+if __name__ == '__main__':
+    args = parseArgs()
+
+    if args.output.endswith('.tsv'):
+        to_tsv(open_matrix(args.input), args.output)
+    else:
+        from_tsv(args.input, args.output, 'condensed' if args.condensed else 'full', DTYPES[args.dtype])
@@ -0,0 +1,98 @@
+import math
+import re
+
+from drugstance_core.condensed import row_offset
+from drugstance_core.instrument import Progress
+
+
+# bytes held per cell of a tile while it is computed: the sparse product, its dense copy, the result and temporaries
+BYTES_PER_CELL = 48
+
+UNITS = {'': 1, 'B': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+'''
+Parse a memory size such as 512M, 4G or 1.5GB into bytes.
+'''
+def parse_memory(size):
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([KMGT]?)B?\s*', str(size).upper())
+    if not match:
+        raise ValueError(f'Invalid memory size: {size}')
+    return int(float(match.group(1)) * UNITS[match.group(2)])
+
+
+'''
+Get the number of bytes held by a scipy sparse matrix.
+'''
+def sparse_nbytes(X):
+    return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+
+
+'''
+Pick the side of a square tile so that computing one tile fits into max_memory bytes, after reserving the bytes already held by the drug indexes.
+'''
+def tile_size_for_budget(n, max_memory, reserved=0):
+    available = max_memory - reserved
+    if available < BYTES_PER_CELL:
+        raise ValueError(f'A memory budget of {max_memory} bytes is too small, the drug indexes alone need {reserved} bytes.')
+    tile = int(math.sqrt(available / BYTES_PER_CELL))
+    return max(1, min(tile, n))
+
+
+'''
+Generate the (row start, row stop, column start, column stop) of every tile of an n x n matrix, or of its rows [start, stop). With symmetric only tiles on or above the diagonal are generated.
+'''
+def iter_tiles(n, tile, symmetric=False, start=0, stop=None):
+    stop = n if stop is None else stop
+    for r0 in range(start, stop, tile):
+        r1 = min(r0 + tile, stop)
+        for c0 in range(r0 if symmetric else 0, n, tile):
+            yield r0, r1, c0, min(c0 + tile, n)
+
+
+'''
+Write a finished tile into an on-disk array. The layout says how the tiles were generated:
+    full: every ordered pair is computed
+    symmetric: only tiles on or above the diagonal are computed and mirrored into a full matrix
+    condensed: only i < j pairs are stored, as a scipy-style condensed vector
+origin is the first row held by out, for arrays that only hold a range of rows.
+'''
+def write_tile(out, n, block, r0, r1, c0, c1, layout='full', origin=0):
+    if layout == 'full':
+        out[r0 - origin:r1 - origin, c0:c1] = block
+    elif layout == 'symmetric':
+        out[r0:r1, c0:c1] = block
+        out[c0:c1, r0:r1] = block.T # mirror into the lower triangle
+    elif layout == 'condensed':
+        for r, i in enumerate(range(r0, r1)):
+            start = max(c0, i + 1) # only columns after the diagonal
+            if start < c1:
+                offset = row_offset(n, i) - row_offset(n, origin) + start - i - 1
+                out[offset:offset + c1 - start] = block[r, start - c0:]
+    else:
+        raise ValueError(f'Unknown layout: {layout}')
+
+
+'''
+Compute one or more drug x drug metrics tile by tile and write each finished tile straight into its memory-mapped output, so only one tile per metric is ever held in memory.
+metrics maps a name to (compute, out) where compute(rows, cols) returns a dense block and out is a memory-mapped matrix (see store.create_matrix). Progress is reported after every row of tiles (see instrument.Progress).
+'''
+def run_tiled(metrics, n, tile, layout='full'):
+    symmetric = layout != 'full'
+    tiles = list(iter_tiles(n, tile, symmetric))
+    meter = Progress('+'.join(metrics), sum((r1 - r0) * (c1 - c0) for r0, r1, c0, c1 in tiles), 'pairs')
+    pairs = 0
+    for r0, r1, c0, c1 in tiles:
+        for compute, out in metrics.values():
+            block = compute(slice(r0, r1), slice(c0, c1))
+            write_tile(out, n, block, r0, r1, c0, c1, layout)
+        pairs += (r1 - r0) * (c1 - c0)
+
+        # write finished tiles back so their pages can be dropped
+        if c1 == n:
+            for _, out in metrics.values():
+                out.flush()
+            meter.update(pairs)
+
+    for _, out in metrics.values():
+        out.flush()
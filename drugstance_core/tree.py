@@ -0,0 +1,125 @@
+import networkx as nx
+import numpy as np
+
+
+'''
+Get the parent number (move UP the tree one level/generation). A top level number such as C01 moves up to its root C, and a root is its own parent.
+'''
+def up(n):
+    sep = '.'
+    n = n.split(sep)
+    if len(n) > 1:
+        n.pop()
+        n = sep.join(n)
+    else:
+        return n[0][0]
+    return n
+
+
+'''
+Integer-coded MeSH tree.
+
+Headings and tree numbers get integer ids, number_heading and number_parent hold each number's heading and parent number (-1 when the parent is not in MeSH). The ancestor closure of a heading, the nodes and parent -> child edges it adds to a drug graph, is computed once and kept in memory.
+'''
+class MeshTree:
+
+    def __init__(self, mesh_headings, mesh_numbers):
+        self.headings = list(dict.fromkeys(list(mesh_headings) + list(mesh_numbers.values())))
+        self.heading_ids = {heading: i for i, heading in enumerate(self.headings)}
+
+        self.numbers = list(mesh_numbers)
+        self.number_ids = {number: i for i, number in enumerate(self.numbers)}
+        self.number_heading = np.array([self.heading_ids[mesh_numbers[n]] for n in self.numbers], dtype=np.int64)
+        self.number_parent = np.array([self.number_ids.get(up(n), -1) for n in self.numbers], dtype=np.int64)
+        self.is_root = np.array([up(n) == n for n in self.numbers], dtype=bool)
+
+        self.heading_numbers = [[self.number_ids[n] for n in mesh_headings.get(heading, [])] for heading in self.headings]
+
+        self._number_closures = {}
+        self._heading_closures = {}
+
+    '''
+    Get the (nodes, edges) closure above a tree number: the headings of its ancestors and the edges of the path to its root, excluding the number's own heading and its edge to its parent.
+    '''
+    def number_closure(self, k):
+        closure = self._number_closures.get(k)
+        if closure is not None:
+            return closure
+
+        if self.is_root[k]:
+            closure = (frozenset(), frozenset())
+        else:
+            p = self.number_parent[k]
+            if p < 0:
+                raise KeyError(up(self.numbers[k])) # the parent number is not in MeSH
+            p_nodes, p_edges = self.number_closure(p)
+            p_heading = int(self.number_heading[p])
+
+            nodes = p_nodes | {p_heading}
+            edges = p_edges
+            if not self.is_root[p]:
+                edges = edges | {(int(self.number_heading[self.number_parent[p]]), p_heading)} # edge from the grandparent to the parent
+            closure = (frozenset(nodes), frozenset(edges))
+
+        self._number_closures[k] = closure
+        return closure
+
+    '''
+    Get the (nodes, edges) a heading adds to a drug graph: the heading, every ancestor along each of its tree numbers, and the parent -> child edges along those paths. Computed once per heading.
+    '''
+    def closure(self, h):
+        closure = self._heading_closures.get(h)
+        if closure is not None:
+            return closure
+
+        nodes = {h}
+        edges = set()
+        for k in self.heading_numbers[h]:
+            p_nodes, p_edges = self.number_closure(k)
+            nodes |= p_nodes
+            edges |= p_edges
+            if self.is_root[k]:
+                edges.add((h, h)) # a root heading moves up to itself
+            else:
+                edges.add((int(self.number_heading[self.number_parent[k]]), h))
+
+        closure = (frozenset(nodes), frozenset(edges))
+        self._heading_closures[h] = closure
+        return closure
+
+    '''
+    Compute the closures of every heading up front.
+    '''
+    def precompute(self):
+        for h in range(len(self.headings)):
+            self.closure(h)
+
+
+'''
+Make a graph where the nodes are MeSH headings and the directed edges form the heirarchy. Each node has as an attribute the set of drugs that include that node.
+drug_headings maps a drug to its indication headings. Returns the graph and drug_node_dict. Every drug graph is the union of the cached closures of its headings.
+'''
+def build_graph(drugs, drug_headings, tree):
+    drug_node_ids = {}
+    edges = set()
+    for drug in drugs:
+        nodes = set()
+        for heading in drug_headings.get(drug, ()):
+            h_nodes, h_edges = tree.closure(tree.heading_ids[heading])
+            nodes |= h_nodes
+            edges |= h_edges
+        drug_node_ids[drug] = nodes
+
+    # invert to node -> drugs
+    node_drug_ids = {}
+    for drug, nodes in drug_node_ids.items():
+        for node in nodes:
+            node_drug_ids.setdefault(node, set()).add(drug)
+
+    G = nx.DiGraph()
+    G.add_nodes_from((tree.headings[node], {'drugs': node_drugs}) for node, node_drugs in node_drug_ids.items())
+    G.add_edges_from((tree.headings[p], tree.headings[c]) for p, c in edges)
+
+    drug_node_dict = {drug: {tree.headings[node] for node in nodes} for drug, nodes in drug_node_ids.items()}
+
+    return G, drug_node_dict
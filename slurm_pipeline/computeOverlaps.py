@@ -1,8 +1,15 @@
+import os
+import sys
+import numpy as np
 import csv
 import argparse
-import math
-import pandas as pd
-from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make drugstance_core importable
+from drugstance_core.condensed import row_offset
+from drugstance_core.overlap import OverlapIndex
+from drugstance_core.indications import load_indications
+from drugstance_core.instrument import configure, profiled, stage
+from drugstance_core.scheduler import balanced_tile_size, labels_digest, row_range, run_scheduled
 
 
 '''
@@ -15,71 +22,52 @@ def parseArgs():
     parser.add_argument('-d', '--drugs', help='A file containing a list of drugs for computation', type=str, required=True)
     parser.add_argument('-a', '--all-drugs', help='A file containing a list of all drugs in ChEMBL.', type=str, required=True)
     parser.add_argument('-i', '--id', help='A unique id to use for this scripts output file.', type=str, required=True)
+    parser.add_argument('-s', '--symmetric', help='Only compute each drug\'s columns after itself (i < j) and write a condensed segment instead of full rows.', action='store_true', required=False)
     parser.add_argument('-o', '--output', help='Output directory.', default='.', type=str, required=True)
+    parser.add_argument('-e', '--events', help='Write machine-readable JSON events (stage times, memory, throughput per worker, progress with ETA) to this file, one per line.', type=str, required=False)
+    parser.add_argument('--profile', help='Profile the shard with cProfile and write the stats to this file.', type=str, required=False)
     args = parser.parse_args()
     return args
 
 
 '''
-Get a drug's indications
+Calculate the overlap between the drugs [start, stop) of all drugs and every drug, or only the drugs after each of them (i < j) if symmetric. The rows are cut into small tiles that idle processes take one at a time and write into a memory-mapped output; finished tiles are checkpointed so a requeued job resumes where it stopped.
 '''
-def getIndications(drug):
-    indications = set(chembl[chembl['pref_name'] == drug]['mesh_heading'].tolist())
-    return indications
-
+def run_comparisons(start, stop, num_cpus):
+    n = len(all_drugs)
+    path = f'{args.output}/drug_overlaps_{args.id}.npy'
+    checkpoint = f'{path}.checkpoint'
+    layout = 'condensed' if args.symmetric else 'full'
 
-'''
-Calculate the overlap coefficient for two drugs.
-'''
-def computeOverlap(drug1, drug2):
-    # get the indications for each drug
-    indications1 = getIndications(drug1)
-    indications2 = getIndications(drug2)
+    # resume only when a previous attempt of this job left both its output and its checkpoint, otherwise start a new output and checkpoint
+    resume = os.path.exists(path) and os.path.exists(checkpoint)
+    if not resume:
+        shape = (row_offset(n, stop) - row_offset(n, start),) if args.symmetric else (stop - start, n)
+        np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=shape)
 
-    intersection = len(list(indications1 & indications2)) # get the size of the intersection of both sets
-    min_size = min(len(indications1),len(indications2)) # get the size of the smaller set
-    overlap = intersection / min_size # compute overlap 
+    tile = balanced_tile_size(stop - start, n, num_cpus)
+    run_scheduled([(index, 'overlaps', path)], n, tile, layout, num_cpus, checkpoint, resume=resume, start=start, stop=stop, run={'labels': labels_digest(all_drugs)})
 
-    return overlap
+    return np.load(path, mmap_mode='r')
 
 
 '''
-Calculate the overlap between every pairwise combination of drugs, no repeats.
+Load the data and build the index once. The scheduler puts the index in shared memory for the worker processes.
 '''
-def run_comparisons(drugs, all_drugs):
-
-    results = []
-    for drug1 in drugs:
-        overlaps = [drug1]
-        for drug2 in all_drugs:
-            overlap = computeOverlap(drug1, drug2) # compute overlap
-            overlaps.append(overlap)
-        results.append(overlaps)
-
-    return results
-    
-
-'''
-Initializer for multiprocessing to generate global variables to use in each proces.
-'''
-def initializer():
+def load_data():
     global all_drugs
-    global chembl
+    global indications
+    global index
 
     # load in all drugs
     f = open(args.all_drugs, 'r')
     all_drugs = [line.rstrip() for line in f]
 
-    # load in ChEMBL
-    chembl = pd.read_csv(args.chembl, sep='\t')
+    # load in ChEMBL, from the cache the first job wrote next to it
+    indications = load_indications(args.chembl)
 
-
-'''
-Main function for each process. Computes all comparisons.
-'''
-def main(drugs):
-    results = run_comparisons(drugs, all_drugs)
-    return results
+    # build the drugs x headings matrix from the interned index
+    index = OverlapIndex.from_indications(all_drugs, indications)
 
 
 '''
@@ -93,7 +81,15 @@ def write_results_new(overlaps):
             writer.writerow(all_drugs)
         writer.writerows(overlaps)
 
-    
+
+'''
+Write the drugs the rows of this shard's condensed segment belong to.
+'''
+def write_results_condensed(drugs):
+    with open(f'{args.output}/drug_overlaps_{args.id}.drugs', 'w') as f:
+        f.writelines(f'{drug}\n' for drug in drugs)
+
+
 '''
 Main.
 '''
@@ -105,28 +101,39 @@ if __name__ == "__main__":
     args = parseArgs() # parse arguments
     n = args.num_cpus # number of processes/cpus to use
 
-    print('loading data...')
+    configure(args.events, job=os.environ.get('SLURM_JOB_ID'), shard=args.id) # JSON events, if requested
 
-    # load in small drug list
-    f = open(args.drugs, 'r')
-    drugs = [line.rstrip() for line in f]
+    with profiled(args.profile), stage('shard'):
+        print('loading data...')
 
-    # load in all drugs
-    f = open(args.all_drugs, 'r')
-    all_drugs = [line.rstrip() for line in f]
+        # load in small drug list
+        f = open(args.drugs, 'r')
+        drugs = [line.rstrip() for line in f]
+
+        with stage('loadData') as info:
+            load_data()
+            info.update(drugs=len(all_drugs), indications=indications.rows)
+
+        # rows follow the order of all drugs
+        order = {drug: i for i, drug in enumerate(all_drugs)}
+        drugs.sort(key=order.get)
+        start, stop = row_range(drugs, all_drugs)
 
-    # divide drugs for processes
-    num_drugs = math.ceil(len(drugs) / n)
-    lists = [drugs[i:i + num_drugs] for i in range(0, len(drugs), num_drugs)]
-  
-    print('running processes...')
+        print('running processes...')
 
-    # compute overlaps across n threads
-    with Pool(n, initializer, ()) as p:
-        overlaps = p.map(main, lists)
+        # compute overlaps tile by tile across n processes
+        pairs = row_offset(len(all_drugs), stop) - row_offset(len(all_drugs), start) if args.symmetric else (stop - start) * len(all_drugs)
+        with stage('runComparisons', rows=stop - start, pairs=pairs):
+            overlaps = run_comparisons(start, stop, n)
 
-    # merge results
-    overlaps = [j for i in overlaps for j in i]
+        print('writing results...')
+        with stage('writeResults'):
+            if args.symmetric:
+                write_results_condensed(drugs)
+            else:
+                write_results_new([drug] + row.tolist() for drug, row in zip(drugs, overlaps))
 
-    print('writing results...')
-    write_results_new(overlaps)
\ No newline at end of file
+        # the checkpoint goes first, so an interruption never leaves a checkpoint without its output
+        os.remove(f'{args.output}/drug_overlaps_{args.id}.npy.checkpoint') # the shard is done
+        if not args.symmetric:
+            os.remove(f'{args.output}/drug_overlaps_{args.id}.npy') # the tsv is the shard's output
@@ -1,10 +1,15 @@
+import os
+import sys
 import numpy as np
 import csv
 import argparse
-import pickle
-import networkx as nx
-import math
-from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make drugstance_core importable
+from drugstance_core.condensed import row_offset
+from drugstance_core.semantic import SemanticIndex
+from drugstance_core.graphfile import load_graph
+from drugstance_core.instrument import configure, profiled, stage
+from drugstance_core.scheduler import balanced_tile_size, labels_digest, row_range, run_scheduled
 
 
 '''
@@ -13,94 +18,56 @@ Parse arguments. None are required.
 def parseArgs():
     parser = argparse.ArgumentParser(description='Compute the semantic distance between drugs in ChEMBL using the MeSH headings of their indications.')
     parser.add_argument('-n', '--num-cpus', help='The number of cpus to use. Default is 4.', default=4, type=int, required=True)
-    parser.add_argument('-g', '--graph', help='A pickle file of a networkx graph of ChEMBL.', type=str, required=True)
+    parser.add_argument('-g', '--graph', help='The graph artifact of ChEMBL written by makeGraph.py (chembl.graph).', type=str, required=True)
     parser.add_argument('-d', '--drugs', help='A file containing a list of drugs for computation', type=str, required=True)
     parser.add_argument('-a', '--all-drugs', help='A file containing a list of all drugs in ChEMBL.', type=str, required=True)
-    parser.add_argument('-p', '--drug-node-dict', help='A pickle file containing drug_node_dict.', type=str, required=True)
     parser.add_argument('-i', '--id', help='A unique id to use for this scripts output file.', type=str, required=True)
+    parser.add_argument('-s', '--symmetric', help='Only compute each drug\'s columns after itself (i < j) and write a condensed segment instead of full rows.', action='store_true', required=False)
     parser.add_argument('-o', '--output', help='Output directory.', type=str, required=True)
+    parser.add_argument('-e', '--events', help='Write machine-readable JSON events (stage times, memory, throughput per worker, progress with ETA) to this file, one per line.', type=str, required=False)
+    parser.add_argument('--profile', help='Profile the shard with cProfile and write the stats to this file.', type=str, required=False)
     args = parser.parse_args()
     return args
 
 
 '''
-Calculate mis-information between two drug graphs.
+Calculate the semantic distance between the drugs [start, stop) of all drugs and every drug, or only the drugs after each of them (i < j) if symmetric. The rows are cut into small tiles that idle processes take one at a time and write into a memory-mapped output; finished tiles are checkpointed so a requeued job resumes where it stopped.
 '''
-def compute_mi(drug1, drug2):
-    nodes = np.setdiff1d(list(drug_node_dict[drug1]), list(drug_node_dict[drug2]))
-
-    mi = 0
-    for n in nodes:
-        mi += G.nodes[n]['ia']
-
-    return mi
+def run_comparisons(start, stop, num_cpus):
+    n = len(all_drugs)
+    path = f'{args.output}/drug_semantic_distances_{args.id}.npy'
+    checkpoint = f'{path}.checkpoint'
+    layout = 'condensed' if args.symmetric else 'full'
 
+    # resume only when a previous attempt of this job left both its output and its checkpoint, otherwise start a new output and checkpoint
+    resume = os.path.exists(path) and os.path.exists(checkpoint)
+    if not resume:
+        shape = (row_offset(n, stop) - row_offset(n, start),) if args.symmetric else (stop - start, n)
+        np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=shape)
 
-'''
-Compute remaining uncertainty between two drug graphs.
-'''
-def compute_ru(drug1, drug2):
-    nodes = np.setdiff1d(list(drug_node_dict[drug2]), list(drug_node_dict[drug1]))
+    tile = balanced_tile_size(stop - start, n, num_cpus)
+    run_scheduled([(index, 'distances', path)], n, tile, layout, num_cpus, checkpoint, resume=resume, start=start, stop=stop, run={'labels': labels_digest(all_drugs)})
 
-    ru = 0
-    for n in nodes:
-        ru += G.nodes[n]['ia']
+    return np.load(path, mmap_mode='r')
 
-    return ru
 
-
-'''
-Calculate te semantic distance (sd) between two drugs by summing the mis-information and remaining uncertainty values.
 '''
-def semantic_distance(drug1, drug2):
-    sd = compute_mi(drug1, drug2) + compute_ru(drug1, drug2)
-    return sd
-
-
+Load the data and build the index once. The scheduler puts the index in shared memory for the worker processes.
 '''
-Calculate the semantic distance between every pairwise combination of drugs, no repeats.
-'''
-def run_comparisons(drugs, all_drugs):
-
-    results = []
-    for drug1 in drugs:
-        distances = [drug1]
-        for drug2 in all_drugs:
-            distance = semantic_distance(drug1, drug2) # compute distance
-            distances.append(distance)
-        results.append(distances)
-
-    return results
-    
-
-'''
-Initializer for multiprocessing to generate global variables to use in each proces.
-'''
-def initializer():
+def load_data():
     global all_drugs
-    global drug_node_dict
     global G
-
-    # load dict -> key: drug, value: nodes in its network
-    f = open(args.drug_node_dict, 'rb')
-    drug_node_dict = pickle.load(f)
+    global index
 
     # load in all drugs
     f = open(args.all_drugs, 'r')
     all_drugs = [line.rstrip() for line in f]
 
-    # read in graph
-    G = nx.read_gpickle(args.graph)
+    # memory-map the graph artifact: IA values and the nodes of every drug
+    G = load_graph(args.graph)
 
-
-'''
-Main function for each process. Computes all comparisons.
-'''
-def main(drugs):
-
-    results = run_comparisons(drugs, all_drugs)
-
-    return results
+    # take the drugs x nodes incidence matrix and IA vector straight from it
+    index = SemanticIndex.from_graph_file(G, all_drugs)
 
 
 '''
@@ -115,7 +82,15 @@ def write_results_new(distances):
             writer.writerow(all_drugs)
         writer.writerows(distances)
 
-    
+
+'''
+Write the drugs the rows of this shard's condensed segment belong to.
+'''
+def write_results_condensed(drugs):
+    with open(f'{args.output}/drug_semantic_distances_{args.id}.drugs', 'w') as f:
+        f.writelines(f'{drug}\n' for drug in drugs)
+
+
 '''
 Main.
 '''
@@ -127,28 +102,39 @@ if __name__ == '__main__':
     args = parseArgs() # parse arguments
     n = args.num_cpus # number of processes/cpus to use
 
-    print('loading data...')
+    configure(args.events, job=os.environ.get('SLURM_JOB_ID'), shard=args.id) # JSON events, if requested
 
-    # load in small drug list
-    f = open(args.drugs, 'r')
-    drugs = [line.rstrip() for line in f]
+    with profiled(args.profile), stage('shard'):
+        print('loading data...')
 
-    # load in all drugs
-    f = open(args.all_drugs, 'r')
-    all_drugs = [line.rstrip() for line in f]
+        # load in small drug list
+        f = open(args.drugs, 'r')
+        drugs = [line.rstrip() for line in f]
+
+        with stage('loadData') as info:
+            load_data()
+            info.update(drugs=len(all_drugs), nodes=G.number_of_nodes(), edges=G.number_of_edges())
+
+        # rows follow the order of all drugs
+        order = {drug: i for i, drug in enumerate(all_drugs)}
+        drugs.sort(key=order.get)
+        start, stop = row_range(drugs, all_drugs)
 
-    # divide drugs for processes
-    num_drugs = math.ceil(len(drugs) / n)
-    lists = [drugs[i:i + num_drugs] for i in range(0, len(drugs), num_drugs)]
-  
-    print('running processes...')
+        print('running processes...')
 
-    # compute distances across n threads
-    with Pool(n, initializer, ()) as p:
-        distances = p.map(main, lists)
+        # compute distances tile by tile across n processes
+        pairs = row_offset(len(all_drugs), stop) - row_offset(len(all_drugs), start) if args.symmetric else (stop - start) * len(all_drugs)
+        with stage('runComparisons', rows=stop - start, pairs=pairs):
+            distances = run_comparisons(start, stop, n)
 
-    # merge results
-    distances = [j for i in distances for j in i]
+        print('writing results...')
+        with stage('writeResults'):
+            if args.symmetric:
+                write_results_condensed(drugs)
+            else:
+                write_results_new([drug] + row.tolist() for drug, row in zip(drugs, distances))
 
-    print('writing results...')
-    write_results_new(distances)
\ No newline at end of file
+        # the checkpoint goes first, so an interruption never leaves a checkpoint without its output
+        os.remove(f'{args.output}/drug_semantic_distances_{args.id}.npy.checkpoint') # the shard is done
+        if not args.symmetric:
+            os.remove(f'{args.output}/drug_semantic_distances_{args.id}.npy') # the tsv is the shard's output
@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make drugstance_core importable
+from drugstance_core.instrument import configure, profiled, stage
+from drugstance_core.manifest import read_manifest, save_tile
+from drugstance_core.overlap import OverlapIndex
+from drugstance_core.indications import load_indications
+from drugstance_core.semantic import SemanticIndex
+from drugstance_core.graphfile import load_graph
+
+
+'''
+Parse arguments.
+'''
+def parseArgs():
+    parser = argparse.ArgumentParser(description='Compute one tile of the semantic distance and overlap matrices, as a task of the job array planned by planTiles.py.')
+    parser.add_argument('-m', '--manifest', help='The manifest written by planTiles.py.', type=str, required=True)
+    parser.add_argument('-e', '--events', help='Write machine-readable JSON events (stage times, memory, throughput) to this file, one per line.', type=str, required=False)
+    parser.add_argument('--profile', help='Profile the task with cProfile and write the stats to this file.', type=str, required=False)
+    parser.add_argument('-t', '--task', help='The tile to compute. Default is the SLURM array task id.', default=os.environ.get('SLURM_ARRAY_TASK_ID'), type=int, required=False)
+    args = parser.parse_args()
+    if args.task is None:
+        parser.error('--task is required outside of a SLURM job array')
+    return args
+
+
+'''
+Build the engines of the manifest's metrics for the given drugs only. IA values come from the graph of all drugs, so the values match the full matrices.
+'''
+def load_engines(manifest, drugs):
+    inputs = manifest['inputs']
+    engines = {}
+
+    if 'semantic_distances' in manifest['metrics']:
+        graph = load_graph(inputs['graph']) # memory-mapped, tasks on one node share its pages
+        engines['semantic_distances'] = SemanticIndex.from_graph_file(graph, drugs).distances
+
+    if 'overlaps' in manifest['metrics']:
+        engines['overlaps'] = OverlapIndex.from_indications(drugs, load_indications(inputs['chembl'])).overlaps # cached after the first task
+
+    return engines
+
+
+'''
+Compute every metric of one tile.
+'''
+def compute_tile(manifest, task):
+    r0, r1, c0, c1 = manifest['tiles'][task]
+
+    # load in all drugs
+    f = open(manifest['inputs']['drugs'], 'r')
+    all_drugs = [line.rstrip() for line in f]
+
+    rows = all_drugs[r0:r1]
+    cols = all_drugs[c0:c1]
+    with stage('loadEngines', drugs=len(set(rows + cols))):
+        engines = load_engines(manifest, list(dict.fromkeys(rows + cols)))
+
+    with stage('computeTile', pairs=len(rows) * len(cols) * len(engines)):
+        return {metric: compute(rows, cols) for metric, compute in engines.items()}
+
+
+'''
+Main.
+'''
+if __name__ == '__main__':
+    args = parseArgs()
+    manifest = read_manifest(args.manifest)
+
+    configure(args.events, job=os.environ.get('SLURM_ARRAY_JOB_ID'), task=args.task) # JSON events, if requested
+
+    with profiled(args.profile), stage('task'):
+        start = time.time()
+        blocks = compute_tile(manifest, args.task)
+        with stage('saveTile'):
+            save_tile(manifest, args.task, blocks, {'task': args.task, 'seconds': time.time() - start})
@@ -1,16 +1,11 @@
-num_jobs=$1 # the number of jobs to submit
+target=$1 # the target runtime of every tile in minutes
 indications=$2 # the tsv containing drugs and their indications
 
 # make drug list
 tail -n+2 data/$indications | cut -d$'\t' -f2 | sort | uniq > data/drugs
 
-# split drug list into a file for each job
-split -n l/${num_jobs} data/drugs 'data/drugs_'
+# plan tiles sized to the target runtime
+python3 planTiles.py plan -a data/drugs -g data/chembl.graph -c data/$indications -o tiles -t $target
 
-# make output dir for tsvs
-mkdir semantic_distances
-mkdir overlaps
-
-# run a job on each drug list
-ls data/drugs_* | xargs -I {} sbatch job.sh computeSemanticDistances.py {} semantic_distances
-ls data/drugs_* | xargs -I {} sbatch job.sh computeOverlaps.py {} overlaps
\ No newline at end of file
+# run all tiles as one job array, resubmitting failed or timed out tiles twice
+python3 planTiles.py submit -m tiles/manifest.json --wait --retries 2
\ No newline at end of file
@@ -11,6 +11,7 @@
 metric=$1
 drugs_list=$2 # the list of drugs to be used in this child process
 out=$3 # dir to write output file to
+# the remaining args are the script's own inputs: -g data/chembl.graph for computeSemanticDistances.py, -c data/<indications>.tsv for computeOverlaps.py
 
 # get id
 id=$(echo $drugs_list | grep -oP '(?<=_)\w+')
@@ -22,7 +23,7 @@ source ~/.bashrc
 conda activate py38env
 
 # Run computeDistances.py using multiple processes
-python3 $1 -n 20 -d $drugs_list -a data/drugs -g data/chembl.gpkl -p data/drug_node_dict.pkl -i $id -o $out
+python3 $metric -n 20 -d $drugs_list -a data/drugs -i $id -o $out -e $out/events_$id.jsonl "${@:4}"
 
 # close conda env
 conda deactivate
\ No newline at end of file
@@ -0,0 +1,212 @@
+import os
+import sys
+import csv
+import glob
+import argparse
+import shutil
+import numpy as np
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make drugstance_core importable
+from drugstance_core.condensed import row_offset
+from drugstance_core.store import DTYPES, create_matrix, sidecar_path, write_sidecar
+
+
+'''
+Parse arguments.
+'''
+def parseArgs():
+    parser = argparse.ArgumentParser(description='Merge the shard outputs of computeSemanticDistances.py or computeOverlaps.py into one matrix, checking that every drug row is present exactly once and in order.')
+    parser.add_argument('-i', '--input', help='The directory the shards were written to.', type=str, required=True)
+    parser.add_argument('-a', '--all-drugs', help='A file containing a list of all drugs in ChEMBL, in the order of the matrix.', type=str, required=True)
+    parser.add_argument('-o', '--output', help='The merged matrix. A .tsv output is a TSV matrix, a .npy output is a binary matrix with a .json sidecar.', type=str, required=True)
+    parser.add_argument('-p', '--prefix', help='Only merge shards whose file name starts with this, e.g. drug_overlaps.', default='', type=str, required=False)
+    parser.add_argument('-n', '--num-cpus', help='The number of shards to read at once. Default is 4.', default=4, type=int, required=False)
+    parser.add_argument('-t', '--dtype', help='The dtype of a binary output.', choices=sorted(DTYPES), default='float64', required=False)
+    parser.add_argument('-d', '--diagonal', help='The value of every drug with itself, for condensed shards (0 for semantic distances, 1 for overlaps). Default is 0.', default=0.0, type=float, required=False)
+    args = parser.parse_args()
+    return args
+
+
+'''
+Find the shards in a directory: TSV rows, or condensed .npy segments with a .drugs list next to them. The output is skipped in case it is written to the same directory.
+'''
+def find_shards(directory, output, prefix=''):
+    output = os.path.abspath(output)
+    tsv = sorted(path for path in glob.glob(f'{directory}/{prefix}*.tsv') if os.path.abspath(path) != output)
+    condensed = sorted(path for path in glob.glob(f'{directory}/{prefix}*.npy') if os.path.exists(os.path.splitext(path)[0] + '.drugs') and os.path.abspath(path) != output)
+    if tsv and condensed:
+        raise ValueError(f'{directory} holds both TSV and condensed shards.')
+    return tsv, condensed
+
+
+'''
+Get the drug of a TSV line. Names are only quoted by the csv writer if they contain special characters.
+'''
+def line_drug(line):
+    if line.startswith('"'):
+        return next(csv.reader([line], delimiter='\t'))[0]
+    return line.split('\t', 1)[0]
+
+
+'''
+Initializer for multiprocessing to share the drug order and the output with each process.
+'''
+def initializer(drugs, output):
+    global all_drugs
+    global positions
+    global out_path
+
+    all_drugs = drugs
+    positions = {drug: i for i, drug in enumerate(drugs)}
+    out_path = output
+
+
+'''
+Read the drugs of a TSV shard and check its header and row widths. Returns the shard and its drugs in file order.
+'''
+def scan_tsv(path):
+    drugs = []
+    with open(path, newline='') as f:
+        for number, line in enumerate(f):
+            line = line.rstrip('\r\n')
+            if number == 0 and line_drug(line) == 'Drug':
+                if next(csv.reader([line], delimiter='\t'))[1:] != all_drugs:
+                    raise ValueError(f'The header of {path} does not list all drugs in order.')
+                continue
+            if line.count('\t') != len(all_drugs):
+                raise ValueError(f'Line {number + 1} of {path} has {line.count(chr(9))} values instead of {len(all_drugs)}.')
+            drugs.append(line_drug(line))
+    return path, drugs
+
+
+'''
+Parse the rows of a TSV shard straight into the binary output. Rows land at the position of their drug, the order is validated afterwards.
+'''
+def merge_tsv(path):
+    out = np.load(out_path, mmap_mode='r+')
+    drugs = []
+    with open(path, newline='') as f:
+        for row in csv.reader(f, delimiter='\t'):
+            if not drugs and row[0] == 'Drug':
+                continue
+            if len(row) != len(all_drugs) + 1:
+                raise ValueError(f'A row of {path} has {len(row) - 1} values instead of {len(all_drugs)}.')
+            if row[0] in positions:
+                out[positions[row[0]]] = np.array(row[1:], dtype=np.float64)
+            drugs.append(row[0])
+    out.flush()
+    return path, drugs
+
+
+'''
+Read the drugs of a condensed shard and check the length of its segment.
+'''
+def scan_condensed(path):
+    with open(os.path.splitext(path)[0] + '.drugs') as f:
+        drugs = [line.rstrip('\n') for line in f]
+
+    n = len(all_drugs)
+    if drugs and drugs[0] in positions:
+        start = positions[drugs[0]]
+        expected = row_offset(n, min(start + len(drugs), n)) - row_offset(n, start)
+        length = np.load(path, mmap_mode='r').shape[0]
+        if length != expected:
+            raise ValueError(f'{path} holds {length} values, the rows of its drugs need {expected}.')
+    return path, drugs
+
+
+'''
+Copy a condensed segment into the condensed output, at the offset of its first row.
+'''
+def merge_condensed(task):
+    path, start = task
+    out = np.load(out_path, mmap_mode='r+')
+    segment = np.load(path, mmap_mode='r')
+    offset = row_offset(len(all_drugs), start)
+    out[offset:offset + len(segment)] = segment
+    out.flush()
+    return path
+
+
+'''
+Check that the shards hold every drug exactly once and that, ordered by their first drug, their rows follow the order of all drugs. Returns the shards in that order.
+'''
+def validate(shards, all_drugs):
+    positions = {drug: i for i, drug in enumerate(all_drugs)}
+    seen = {}
+    problems = []
+
+    for path, drugs in shards:
+        unknown = [drug for drug in drugs if drug not in positions]
+        if unknown:
+            problems.append(f'{path} has {len(unknown)} drugs that are not in the drug list, e.g. {unknown[0]}')
+        for drug in drugs:
+            if drug in seen:
+                problems.append(f'{drug} is in both {seen[drug]} and {path}')
+            seen[drug] = path
+
+    missing = [drug for drug in all_drugs if drug not in seen]
+    if missing:
+        problems.append(f'{len(missing)} drugs have no row, e.g. {missing[0]}')
+    if problems:
+        raise ValueError('Cannot merge shards:\n    ' + '\n    '.join(problems[:20]))
+
+    # shards have to be consecutive runs of the drug list
+    shards = sorted((shard for shard in shards if shard[1]), key=lambda shard: positions[shard[1][0]])
+    order = [drug for _, drugs in shards for drug in drugs]
+    if order != list(all_drugs):
+        first = next(i for i, (a, b) in enumerate(zip(order, all_drugs)) if a != b)
+        raise ValueError(f'Rows are out of order: row {first + 1} is {order[first]} but should be {all_drugs[first]}.')
+
+    return shards
+
+
+'''
+Concatenate TSV shards in order under one header, copying their rows as they are.
+'''
+def write_tsv(shards, all_drugs, output):
+    with open(output, 'w', newline='') as out:
+        csv.writer(out, delimiter='\t').writerow(['Drug'] + all_drugs)
+        for path, _ in shards:
+            with open(path, newline='') as f:
+                first = f.readline()
+                if line_drug(first) != 'Drug':
+                    out.write(first)
+                shutil.copyfileobj(f, out, 1024 * 1024)
+
+
+'''
+Main.
+'''
+if __name__ == '__main__':
+    args = parseArgs()
+
+    # load in all drugs
+    f = open(args.all_drugs, 'r')
+    all_drugs = [line.rstrip() for line in f]
+    n = len(all_drugs)
+
+    tsv_shards, condensed_shards = find_shards(args.input, args.output, args.prefix)
+    print(f'merging {len(tsv_shards) + len(condensed_shards)} shards of {n} drugs...')
+
+    with Pool(args.num_cpus, initializer, (all_drugs, args.output)) as p:
+        if condensed_shards:
+            if not args.output.endswith('.npy'):
+                raise ValueError('Condensed shards merge into a .npy matrix, convert it with python3 -m drugstance_core.store.')
+            shards = validate(p.map(scan_condensed, condensed_shards), all_drugs)
+            create_matrix(args.output, all_drugs, 'condensed', DTYPES[args.dtype], args.diagonal)
+            positions = {drug: i for i, drug in enumerate(all_drugs)}
+            p.map(merge_condensed, [(path, positions[drugs[0]]) for path, drugs in shards])
+        elif args.output.endswith('.npy'):
+            create_matrix(args.output, all_drugs, 'full', DTYPES[args.dtype])
+            try:
+                validate(p.map(merge_tsv, tsv_shards), all_drugs)
+            except ValueError:
+                os.remove(args.output) # an incomplete matrix must not look like a result
+                os.remove(sidecar_path(args.output))
+                raise
+            write_sidecar(args.output, all_drugs, 'full', DTYPES[args.dtype], np.diagonal(np.load(args.output, mmap_mode='r')))
+        else:
+            shards = validate(p.map(scan_tsv, tsv_shards), all_drugs)
+            write_tsv(shards, all_drugs, args.output)
@@ -0,0 +1,211 @@
+import os
+import sys
+import math
+import time
+import json
+import argparse
+import subprocess
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make drugstance_core importable
+from drugstance_core.manifest import array_spec, assemble, marker_path, missing_tiles, read_manifest, write_manifest
+from drugstance_core.overlap import OverlapIndex
+from drugstance_core.indications import load_indications
+from drugstance_core.semantic import SemanticIndex
+from drugstance_core.graphfile import load_graph
+from drugstance_core.store import DTYPES, open_matrix, to_tsv
+from drugstance_core.tiles import parse_memory, sparse_nbytes, tile_size_for_budget
+
+
+SAFETY = 0.5 # plan tiles for this fraction of the target runtime, so slower nodes still finish in time
+MEMORY_SAFETY = 0.75 # plan tiles for this fraction of the job's memory, leaving room for the interpreter and libraries
+JOB_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tile_job.sh')
+
+
+'''
+Parse arguments.
+'''
+def parseArgs():
+    parser = argparse.ArgumentParser(description='Plan the semantic distance and overlap matrices as tiles of a SLURM job array, submit the missing tiles and assemble the finished ones.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    plan = commands.add_parser('plan', help='Time a sample of comparisons and write a manifest of tiles sized to a target runtime.')
+    plan.add_argument('-a', '--all-drugs', help='A file containing a list of all drugs in ChEMBL.', type=str, required=True)
+    plan.add_argument('-g', '--graph', help='The graph artifact of ChEMBL written by makeGraph.py (chembl.graph).', type=str, required=True)
+    plan.add_argument('-c', '--chembl', help='A TSV file containing ChEMBL drug indication information.', type=str, required=True)
+    plan.add_argument('-o', '--output', help='Output directory for the manifest, tiles and completion markers.', type=str, required=True)
+    plan.add_argument('-t', '--target-minutes', help='The runtime to aim for per tile. Default is 30.', default=30, type=float, required=False)
+    plan.add_argument('-l', '--time-limit', help='The SLURM time limit of every task in minutes. Default is twice the target.', type=float, required=False)
+    plan.add_argument('--mem', help='The SLURM memory of every task, such as 4G. Tiles are capped so a task stays within it. Default is 4G.', default='4G', type=str, required=False)
+    plan.add_argument('--min-tiles', help='Plan at least this many tiles, so the job array runs in parallel even when the runtime and memory allow bigger tiles. Default is 16.', default=16, type=int, required=False)
+    plan.add_argument('-s', '--symmetric', help='Only plan tiles on or above the diagonal and mirror them when assembling.', action='store_true', required=False)
+    plan.add_argument('--sample', help='The number of drugs of the timed sample. Default is 512.', default=512, type=int, required=False)
+
+    submit = commands.add_parser('submit', help='Submit every tile without a completion marker as one job array.')
+    submit.add_argument('-m', '--manifest', help='The manifest written by plan.', type=str, required=True)
+    submit.add_argument('-r', '--max-running', help='The maximum number of tasks running at once.', type=int, required=False)
+    submit.add_argument('-w', '--wait', help='Wait for the job array to finish.', action='store_true', required=False)
+    submit.add_argument('--retries', help='With --wait, resubmit missing tiles up to this many times. Default is 0.', default=0, type=int, required=False)
+
+    status = commands.add_parser('status', help='Report complete and missing tiles.')
+    status.add_argument('-m', '--manifest', help='The manifest written by plan.', type=str, required=True)
+
+    assembly = commands.add_parser('assemble', help='Assemble the finished tiles into full binary matrices.')
+    assembly.add_argument('-m', '--manifest', help='The manifest written by plan.', type=str, required=True)
+    assembly.add_argument('-o', '--output', help='Output directory for the matrices.', type=str, required=True)
+    assembly.add_argument('--dtype', help='The dtype of the matrices.', choices=sorted(DTYPES), default='float64', required=False)
+    assembly.add_argument('--tsv', help='Also export every matrix as a TSV.', action='store_true', required=False)
+
+    args = parser.parse_args()
+    return args
+
+
+'''
+Load the data a task loads and build the indexes, timing it as the fixed cost of every task.
+'''
+def load_indexes(args, drugs):
+    start = time.time()
+
+    graph = load_graph(args.graph)
+    sd_index = SemanticIndex.from_graph_file(graph, drugs)
+    o_index = OverlapIndex.from_indications(drugs, load_indications(args.chembl))
+
+    return sd_index, o_index, time.time() - start
+
+
+'''
+Time both metrics on a random sample block and return the drug pairs computed per second.
+'''
+def measure_rate(engines, n, sample):
+    rng = np.random.default_rng(0)
+    rows = np.sort(rng.choice(n, min(n, sample), replace=False))
+    cols = np.sort(rng.choice(n, min(n, sample), replace=False))
+
+    start = time.time()
+    for compute in engines:
+        compute(rows, cols)
+    return len(rows) * len(cols) / max(time.time() - start, 1e-6)
+
+
+'''
+Pick the tile side so a task loads its data and computes one tile within the target runtime.
+'''
+def tile_size_for_runtime(n, target_seconds, load_seconds, rate):
+    available = SAFETY * target_seconds - load_seconds
+    if available <= 0:
+        raise ValueError(f'Loading the data alone takes {load_seconds:.0f} s, the target runtime has to be longer.')
+    return max(1, min(n, int(math.sqrt(available * rate))))
+
+
+'''
+Get the largest tile side that still cuts an n x n matrix (or its upper triangle when symmetric) into at least min_tiles tiles.
+'''
+def tile_size_for_count(n, min_tiles, symmetric=False):
+    k = 1 # tiles per side
+    while (k * (k + 1) // 2 if symmetric else k * k) < min_tiles and k < n:
+        k += 1
+    return max(1, n // k)
+
+
+'''
+Format minutes as a SLURM time limit (D-HH:MM).
+'''
+def format_time_limit(minutes):
+    minutes = math.ceil(minutes)
+    return f'{minutes // 1440}-{minutes % 1440 // 60:02d}:{minutes % 60:02d}'
+
+
+'''
+Time a sample of comparisons and write the manifest.
+'''
+def plan(args):
+    load_graph(args.graph, chembl=args.chembl) # every task reads these inputs, make sure the graph was built from them
+
+    f = open(args.all_drugs, 'r')
+    all_drugs = [line.rstrip() for line in f]
+    n = len(all_drugs)
+
+    sd_index, o_index, load_seconds = load_indexes(args, all_drugs)
+    rate = measure_rate([sd_index.distances, o_index.overlaps], n, args.sample)
+
+    # the tile fits the target runtime and the job's memory, and there are enough tiles to run in parallel
+    reserved = 2 * sparse_nbytes(sd_index.A) + sparse_nbytes(o_index.B) # held by every task
+    limits = {
+        'runtime': tile_size_for_runtime(n, 60 * args.target_minutes, load_seconds, rate),
+        'memory': tile_size_for_budget(n, MEMORY_SAFETY * parse_memory(args.mem), reserved),
+        'tile count': tile_size_for_count(n, args.min_tiles, args.symmetric),
+    }
+    limit = min(limits, key=limits.get)
+    tile = limits[limit]
+    time_limit = args.time_limit if args.time_limit is not None else 2 * args.target_minutes
+
+    os.makedirs(args.output, exist_ok=True)
+    inputs = {'drugs': args.all_drugs, 'graph': args.graph, 'chembl': args.chembl}
+    manifest = write_manifest(f'{args.output}/manifest.json', all_drugs, tile, args.symmetric, inputs, args.output, format_time_limit(time_limit), args.mem)
+
+    print(f"Loading takes {load_seconds:.1f} s and {rate:.0f} pairs are compared per second: {len(manifest['tiles'])} tiles of {tile} x {tile} drugs, limited by the {limit}.")
+
+
+'''
+Submit the missing tiles as one job array. With wait, resubmit tiles that are still missing afterwards up to retries times.
+'''
+def submit(args):
+    manifest = read_manifest(args.manifest)
+
+    for _ in range(args.retries + 1 if args.wait else 1):
+        missing = missing_tiles(manifest)
+        if not missing:
+            break
+
+        spec = array_spec(missing)
+        if args.max_running is not None:
+            spec += f'%{args.max_running}'
+        command = ['sbatch', f'--array={spec}', '-t', manifest['time_limit']] + (['--mem', manifest['mem']] if manifest.get('mem') else []) + (['--wait'] if args.wait else []) + [JOB_SCRIPT, args.manifest]
+        print(f'Submitting {len(missing)} tiles: ' + ' '.join(command))
+        subprocess.run(command) # failed tasks are found by their missing markers
+
+    if args.wait:
+        status(args)
+
+
+'''
+Report complete and missing tiles and the runtimes of the complete ones.
+'''
+def status(args):
+    manifest = read_manifest(args.manifest)
+    missing = missing_tiles(manifest)
+    total = len(manifest['tiles'])
+
+    seconds = []
+    for task in set(range(total)) - set(missing):
+        with open(marker_path(manifest, task)) as f:
+            seconds.append(json.load(f)['seconds'])
+
+    print(f'{total - len(missing)}/{total} tiles complete.')
+    if seconds:
+        print(f'Task runtime: mean {np.mean(seconds):.0f} s, max {np.max(seconds):.0f} s.')
+    if missing:
+        print(f'Missing: {array_spec(missing)}')
+
+
+'''
+Main.
+'''
+if __name__ == '__main__':
+    args = parseArgs()
+
+    if args.command == 'plan':
+        plan(args)
+    elif args.command == 'submit':
+        submit(args)
+    elif args.command == 'status':
+        status(args)
+    else:
+        manifest = read_manifest(args.manifest)
+        f = open(manifest['inputs']['drugs'], 'r')
+        all_drugs = [line.rstrip() for line in f]
+
+        os.makedirs(args.output, exist_ok=True)
+        for path in assemble(manifest, all_drugs, args.output, DTYPES[args.dtype]):
+            if args.tsv:
+                to_tsv(open_matrix(path), os.path.splitext(path)[0] + '.tsv')
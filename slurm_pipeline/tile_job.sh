@@ -0,0 +1,21 @@
+#!/bin/bash
+#SBATCH -c 1                               # Request cores
+#SBATCH -p short                           # Partition to run in
+#SBATCH -o tile_%A_%a.out                  # File to which STDOUT will be written, including array job ID (%A) and task ID (%a)
+#SBATCH -e tile_%A_%a.err                  # File to which STDERR will be written, including array job ID (%A) and task ID (%a)
+                                           # The runtime (-t), memory (--mem) and the tasks (--array) are set by planTiles.py submit
+
+# args
+manifest=$1 # the manifest written by planTiles.py plan
+
+# source bashrc to activate conda in shell
+source ~/.bashrc
+
+# start env with python 3.8
+conda activate py38env
+
+# compute the tile of this array task, it writes a completion marker when done
+python3 computeTile.py -m $manifest -t $SLURM_ARRAY_TASK_ID -e $(dirname $manifest)/events_$SLURM_ARRAY_TASK_ID.jsonl
+
+# close conda env
+conda deactivate
\ No newline at end of file